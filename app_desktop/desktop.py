@@ -12,6 +12,7 @@ import json
 import time
 import traceback
 import struct
+import collections
 import communication
 import sys
 import os
@@ -30,6 +31,43 @@ VK_CONTROL        = 0x11
 VK_ALT            = 0x12
 
 CAPTURE_INTERVALL_SLOW_MODE = 10 
+CAPTURE_PIPELINE_DEPTH = 2 #FRAME IN CODA DI INVIO PRIMA DI ATTENDERE (0=SERIALE)
+CAPTURE_PROCESS_MAX = 4 #CAPTURE PROCESS IN PARALLELO (UNO PER MONITOR CATTURATO)
+CAPTURE_SHARE_PENDING_MAX = 4*1024*1024 #OLTRE QUESTA SOGLIA IL VIEWER LENTO PASSA A UNA SESSIONE PROPRIA
+CAPTURE_CURSOR_INTERVAL = 0.05 #CADENZA DEL CANALE CURSORE IN SECONDI (OGNI VIEWER AGGIUNGE UNA RICHIESTA AL PROCESSO DI CATTURA PER INTERVALLO)
+CAPTURE_CURSOR_CACHE_SIZE = 32 #FORME DEL CURSORE CHE IL VIEWER PUO' RIPRENDERE DALLA CACHE
+
+#TOKEN CURSORE GENERATI DAL MANAGER
+#TYPE=5 DATA=X-Y-HASH -> CURSORE VISIBILE CON FORMA GIA' INVIATA (SOLO SE IL VIEWER HA RICHIESTO cursorCache)
+#    HASH=PRIMI 8 BYTE SHA1 DEL TOKEN 3 DALL'OFFSET 7 (W-H-OFFX-OFFY-IMG)
+#    IL VIEWER CONSERVA PER TUTTA LA SESSIONE LE FORME RICEVUTE CON IL TOKEN 3
+#TYPE=802 -> CANALE CURSORE NON SUPPORTATO DALLA LIBRERIA (NON INVIATO AL VIEWER)
+
+TILE_CACHE_SIZE_MAX = 16*1024*1024 #BYTE MASSIMI DELLA CACHE BLOCCHI (IL VIEWER PUO' CHIEDERNE MENO)
+TILE_CACHE_TOKEN_MIN = 256 #BLOCCHI PIU' PICCOLI NON VENGONO MESSI IN CACHE
+
+#TOKEN CACHE BLOCCHI GENERATI DAL MANAGER (SOLO SE IL VIEWER HA RICHIESTO tileCache)
+#TYPE=803 DATA=SZ (!i) -> SVUOTA LA CACHE E IMPOSTA LA DIMENSIONE MASSIMA (0=DISABILITATA)
+#TYPE=6 DATA=L-HASH -> TOKEN FRAME GIA' INVIATO: IL VIEWER RIAPPLICA IL TOKEN 2 CON LO STESSO HASH
+#    HASH=PRIMI 8 BYTE SHA1 DEL TOKEN 2 DALL'OFFSET 3; L=LAST DEL TOKEN CORRENTE
+#    IL VIEWER INSERISCE OGNI TOKEN 2 CON TILE_CACHE_TOKEN_MIN<=LEN-3<=SZ, SPOSTA IN CODA A OGNI TOKEN 6
+#    E RIMUOVE I PIU' VECCHI FINCHE' LA SOMMA DI LEN-3 SUPERA SZ (STESSE REGOLE DI TileCache)
+
+#PROTOCOLLO BINARIO RICHIESTE AL CAPTURE PROCESS
+#UN TOKEN CONTIENE UNA O PIU' RICHIESTE: OPCODE (1 byte) + CAMPI FISSI (+ STRINGHE !H len + utf8)
+#L'OPCODE E' < 0x20 QUINDI NON SI CONFONDE CON LE RICHIESTE STRINGA
+REQ_TERMINATE = 1 # !I sid
+REQ_DIFFERENCE = 2 # !Ihhh sid tp qa monitor
+REQ_COPYTEXT = 3 # !I sid
+REQ_PASTETEXT = 4 # !I sid + stringa
+REQ_MOUSE = 5 # !IiiiiB sid x y btn whl flags
+REQ_KEYBOARD = 6 # !IB sid flags + stringa tp + stringa code
+REQ_DIFFERENCE_DAMAGE = 7 # !Ihhh come REQ_DIFFERENCE MA SALTATA SE LO SCHERMO NON HA AREE DANNEGGIATE
+REQ_CURSOR = 8 # !Ih sid monitor
+REQ_FLAG_CTRL = 1
+REQ_FLAG_ALT = 2
+REQ_FLAG_SHIFT = 4
+REQ_FLAG_COMMAND = 8
 
 _libmap={}
 
@@ -55,7 +93,9 @@ class Desktop():
 
     def __init__(self, agent_main):
         self._agent_main=agent_main
-        self._capture_process = None
+        self._capture_processes = []
+        self._capture_monitors = {}
+        self._capture_process_max = max(1, self._agent_main._get_config("desktop_capture_processes", CAPTURE_PROCESS_MAX))
         self._list = {}
         self._list_semaphore = threading.Condition()    
     
@@ -86,9 +126,7 @@ class Desktop():
                 break
         return True
             
-        if not self._capture_process is None:
-            self._capture_process.destroy()
-            self._capture_process=None
+        self._destroy_capture_processes()
         
     def on_conn_close(self, idses):
         lstcopy=None
@@ -117,8 +155,6 @@ class Desktop():
             while True:
                 key = agent.generate_key(10) 
                 if key not in self._list:
-                    if self._capture_process is None:
-                        self._capture_process = CaptureProcess(self._agent_main)
                     itm = Manager(self, cinfo, key, wsock)
                     self._list[key]=itm
                     break
@@ -132,12 +168,76 @@ class Desktop():
         try:
             if sid in self._list:
                 del self._list[sid]
-                if len(self._list)==0 and not self._capture_process is None:
-                    self._capture_process.destroy()
-                    self._capture_process=None
+                if len(self._list)==0:
+                    self._destroy_capture_processes()
         finally:
             self._list_semaphore.release()
     
+    def _destroy_capture_processes(self):
+        #NON SINCRONIZZATO: CHIAMATO CON self._list_semaphore ACQUISITO
+        for cp in self._capture_processes:
+            cp.destroy()
+        self._capture_processes=[]
+        self._capture_monitors={}
+    
+    def _new_capture_process(self):
+        return CaptureProcess(self._agent_main)
+    
+    def _get_capture_process(self, dm, monitor):
+        #UN CAPTURE PROCESS PER MONITOR (FINO A _capture_process_max) COSI' I MONITOR VENGONO CATTURATI IN PARALLELO
+        #I VIEWER DELLO STESSO MONITOR RESTANO NELLO STESSO PROCESSO E POSSONO CONDIVIDERE LA CATTURA
+        self._list_semaphore.acquire()
+        try:
+            cur=dm._capture_process
+            if monitor<0:
+                #SOLO RILEVAMENTO DEI MONITOR: VA BENE QUALSIASI PROCESSO
+                if cur is not None:
+                    return cur
+                if len(self._capture_processes)==0:
+                    self._capture_processes.append(self._new_capture_process())
+                cp=self._capture_processes[0]
+            else:
+                actmon=[appdm._capture_monitor for appdm in self._list.values() if appdm is not dm]
+                for k in self._capture_monitors.keys():
+                    if k not in actmon:
+                        del self._capture_monitors[k]
+                if monitor in self._capture_monitors:
+                    cp=self._capture_monitors[monitor]
+                else:
+                    used=self._capture_monitors.values()
+                    cp=None
+                    if cur is not None and cur not in used:
+                        cp=cur
+                    else:
+                        for appcp in self._capture_processes:
+                            if appcp not in used:
+                                cp=appcp
+                                break
+                    if cp is None:
+                        if len(self._capture_processes)<self._capture_process_max:
+                            cp=self._new_capture_process()
+                            self._capture_processes.append(cp)
+                        else:
+                            cp=min(self._capture_processes, key=lambda c: used.count(c))
+                    self._capture_monitors[monitor]=cp
+                dm._capture_monitor=monitor
+            dm._capture_process=cp
+        finally:
+            self._list_semaphore.release()
+        if cur is not None and cur is not cp:
+            #CAMBIO DI PROCESSO: LE SESSIONI NATIVE DEL VIEWER NEL VECCHIO PROCESSO VENGONO CHIUSE
+            cur.remove(dm)
+        return cp
+    
+    def _remove_capture(self, dm):
+        self._list_semaphore.acquire()
+        try:
+            lstcp=list(self._capture_processes)
+        finally:
+            self._list_semaphore.release()
+        for cp in lstcp:
+            cp.remove(dm)
+    
     def _get_desktop_manager(self, sid):
         self._list_semaphore.acquire()
         try:
@@ -172,26 +272,134 @@ class Desktop():
     def req_websocket(self, cinfo, wsock):
         self._add_desktop_manager(cinfo, wsock)
         
+class RatePolicy():
+    
+    #POLITICA DEL CONTROLLO DI VELOCITA' (DEFAULT "balanced")
+    #LE SOTTOCLASSI SOVRASCRIVONO I PARAMETRI O get_frame_type
+    name="balanced"
+    fps_min=1
+    fps_max=20
+    quality_min=0
+    quality_max=9
+    quality_start=6
+    rtt_factor=1.5 #CODA SE RITARDO DI CODA > RTT_MIN*(rtt_factor-1)+rtt_slack
+    rtt_slack=0.03
+    decrease=0.7 #DECREMENTO MOLTIPLICATIVO
+    interval=1.0 #SECONDI TRA DUE DECISIONI
+    prefer="balanced" #"quality": SI SACRIFICANO PRIMA GLI FPS; "fps": SI SACRIFICA PRIMA LA QUALITA'
+    rate_max=0 #BYTE/S (0=NESSUN LIMITE)
+    frame_type=None #TIPO FRAME PREFERITO (None=QUELLO NEGOZIATO)
+    
+    def get_frame_type(self, accepted, current):
+        if self.frame_type is not None and accepted is not None and self.frame_type in accepted:
+            return self.frame_type
+        return current
+
+
+class RatePolicyLatencyFirst(RatePolicy):
+    name="latency-first"
+    fps_max=30
+    quality_start=5
+    rtt_factor=1.25
+    rtt_slack=0.015
+    decrease=0.6
+    interval=0.5
+    prefer="fps"
+
+
+class RatePolicyBandwidthSaver(RatePolicy):
+    name="bandwidth-saver"
+    fps_max=8
+    quality_max=6
+    quality_start=4
+    rtt_factor=2.0
+    rtt_slack=0.05
+    interval=2.0
+    prefer="quality"
+    frame_type=100
+
+
+RATE_POLICIES={RatePolicy.name: RatePolicy, 
+               RatePolicyLatencyFirst.name: RatePolicyLatencyFirst, 
+               RatePolicyBandwidthSaver.name: RatePolicyBandwidthSaver}
+
+
+class WindowedFilter():
+    
+    #MASSIMO (O MINIMO) DEI CAMPIONI NEGLI ULTIMI window SECONDI
+    def __init__(self, window, bmax):
+        self._window=window
+        self._bmax=bmax
+        self._samples=collections.deque()
+    
+    def update(self, tm, v):
+        while len(self._samples)>0 and ((self._bmax and self._samples[-1][1]<=v) or (not self._bmax and self._samples[-1][1]>=v)):
+            self._samples.pop()
+        self._samples.append((tm, v))
+        while self._samples[0][0]<tm-self._window:
+            self._samples.popleft()
+    
+    def get(self):
+        if len(self._samples)==0:
+            return None
+        return self._samples[0][1]
+
+
+class TileCache():
+    
+    #LRU ALLINEATA CON IL VIEWER: I TOKEN ARRIVANO NELLO STESSO ORDINE E LE REGOLE SONO LE STESSE
+    def __init__(self, sizemax):
+        self._sizemax=sizemax
+        self._size=0
+        self._items=collections.OrderedDict()
+    
+    def get_size_max(self):
+        return self._sizemax
+    
+    def lookup(self, sdata):
+        ln=len(sdata)-3
+        if ln<TILE_CACHE_TOKEN_MIN or ln>self._sizemax:
+            return sdata
+        hsh=sdata.digest("sha1", 3)[0:8]
+        if hsh in self._items:
+            self._items[hsh]=self._items.pop(hsh)
+            return utils.Bytes(struct.pack("!hB", 6, sdata[2])+hsh)
+        self._items[hsh]=ln
+        self._size+=ln
+        while self._size>self._sizemax:
+            self._size-=self._items.popitem(last=False)[1]
+        return sdata
+
+
 class SpeedManager():
     
-    def __init__(self, dskmain):
+    #STIMA BANDA (MASSIMO DELLA VELOCITA' DI CONSEGNA) E RTT MINIMO DAGLI ACK frametime
+    #IL RITARDO DI CODA (RTT - TRASMISSIONE - RTT MINIMO) REGOLA QUALITA' E FPS
+    #CON INCREMENTO ADDITIVO / DECREMENTO MOLTIPLICATIVO
+    def __init__(self, dskmain, policy=None):
         self._dskmain=dskmain
+        if policy is None:
+            policy=RatePolicy()
+        self._policy=policy
         self._frame_sent=0l
-        self._frame_sent_size=0l
         self._frame_received=0l
-        self._frame_distance=0l
+        self._frame_pixels=None
         self._fps_counter=None
         self._fps_frame=0l
         self._fps=-1
-        self._qa_check_frame=None
-        self._qa_check_frame_size_avg=None
-        self._qa_check_frame_size=None
-        self._qa_check_frame_time=None
-        self._qa_time_wait=0.0
-        self._qa_time_counter=None
-        self._qa_time_bytes=0l
-        self._qa_detect=9
-        
+        self._inflight=collections.OrderedDict()
+        self._delivered=0l
+        self._delivered_time=None
+        self._bw=WindowedFilter(2.0, True)
+        self._rtt_min=WindowedFilter(60.0, False)
+        self._rtt=None
+        self._qdelay=0.0
+        self._frame_size_avg=None
+        self._last_send_time=None
+        self._qa_detect=policy.quality_start
+        self._fps_target=policy.fps_max
+        self._ctrl_time=None
+        self._ctrl_bytes=0l
         
     def get_frame_sent(self):
         return self._frame_sent
@@ -199,22 +407,38 @@ class SpeedManager():
     def get_qa_detect(self):
         return self._qa_detect
     
+    def get_fps_target(self):
+        return self._fps_target
+    
+    def get_frame_type(self, accepted, current):
+        return self._policy.get_frame_type(accepted, current)
+    
+    def get_metrics(self):
+        return {"policy": self._policy.name, "quality": self._qa_detect, "fpsTarget": self._fps_target, "fps": self._fps,
+                "bandwidth": self._bw.get(), "rttMin": self._rtt_min.get(), "rtt": self._rtt, "queueDelay": self._qdelay, 
+                "inflightMax": self._get_inflight_max()}
+    
     def update_frame_size(self,w,h):        
-        self._qa_check_frame_size_avg=long(((float(w*h*3)*10.0)/100.0))        
+        self._frame_pixels=w*h
     
     def sent(self,fsize):
+        tm=time.time()
         self._frame_sent+=1l
-        self._frame_sent_size=fsize
-        if self._frame_sent==1l:
-            self._qa_time_counter=communication.Counter()            
-            self._qa_check_frame=self._frame_sent        
-            self._qa_check_frame_size=fsize
-            self._qa_check_frame_time=time.time()
-        self._qa_time_bytes+=fsize
-        
+        if self._delivered_time is None:
+            self._delivered_time=tm
+        self._inflight[self._frame_sent]=(tm, fsize, self._delivered, self._delivered_time)
+        if self._frame_size_avg is None:
+            self._frame_size_avg=float(fsize)
+        else:
+            self._frame_size_avg=self._frame_size_avg*0.8+float(fsize)*0.2
+        if self._ctrl_time is None:
+            self._ctrl_time=tm
+        self._ctrl_bytes+=fsize
+        self._last_send_time=tm
             
     def received(self, frec):
         self._frame_received=frec
+        tm=time.time()
         
         #CALCULATE FPS
         if self._fps_counter is None:
@@ -226,79 +450,91 @@ class SpeedManager():
             self._fps_frame=self._frame_received
             self._fps_counter.reset()
         
-        #CALCULATE QA    
-        if self._qa_check_frame is not None and self._qa_check_frame==frec:
-            newqa=None
-            elp=time.time()-self._qa_check_frame_time
-            elp=((elp*(float(self._qa_check_frame_size_avg)/2))/float(self._qa_check_frame_size))
-            if elp>=0:
-                if elp<0.2:
-                    newqa=9
-                elif elp<0.3:
-                    newqa=8
-                elif elp<0.4:
-                    newqa=7
-                elif elp<0.5:
-                    newqa=6
-                elif elp<0.6:
-                    newqa=5
-                elif elp<0.7:
-                    newqa=4
-                elif elp<0.8:
-                    newqa=3
-                elif elp<0.9:
-                    newqa=2
-                elif elp<1.0:
-                    newqa=1
+        #ACK CUMULATIVO
+        smp=None
+        while len(self._inflight)>0:
+            f=next(iter(self._inflight))
+            if f>frec:
+                break
+            smp=self._inflight.pop(f)
+            self._delivered+=smp[1]
+        if smp is None:
+            return
+        self._delivered_time=tm
+        rtt=tm-smp[0]
+        if rtt>=0:
+            self._rtt_min.update(tm, rtt)
+            if self._rtt is None:
+                self._rtt=rtt
+            else:
+                self._rtt=self._rtt*0.75+rtt*0.25
+        elp=tm-smp[3]
+        if elp>0:
+            self._bw.update(tm, float(self._delivered-smp[2])/elp)
+        if rtt>=0 and self._bw.get()>0:
+            appq=rtt-self._rtt_min.get()-float(smp[1])/self._bw.get()
+            if appq<0:
+                appq=0.0
+            self._qdelay=self._qdelay*0.75+appq*0.25
+        self._control(tm)
+    
+    def _control(self, tm):
+        plc=self._policy
+        elp=tm-self._ctrl_time
+        if elp<plc.interval or self._rtt is None:
+            return
+        demand=float(self._ctrl_bytes)/elp
+        self._ctrl_time=tm
+        self._ctrl_bytes=0l
+        bqueue=self._qdelay>self._rtt_min.get()*(plc.rtt_factor-1.0)+plc.rtt_slack
+        #SE "balanced" SI AGISCE SU QUELLO RELATIVAMENTE PIU' ALTO (O PIU' BASSO)
+        prefer=plc.prefer
+        if prefer=="balanced":
+            rqa=float(self._qa_detect-plc.quality_min)/float(max(1, plc.quality_max-plc.quality_min))
+            rfps=float(self._fps_target-plc.fps_min)/float(max(1, plc.fps_max-plc.fps_min))
+        if bqueue or (plc.rate_max>0 and demand>plc.rate_max):
+            if prefer=="balanced":
+                prefer="quality" if rfps>=rqa else "fps"
+            if prefer=="fps" or self._fps_target<=plc.fps_min:
+                if self._qa_detect>plc.quality_min:
+                    self._qa_detect=max(plc.quality_min, int(self._qa_detect*plc.decrease))
                 else:
-                    newqa=0
-            if newqa is not None:
-                self._qa_detect=newqa
-                #self._dskmain._agent_main.write_info("INITQA: " + str(self._qa_detect) + " - ELAPSED: " + str(elp) + " - FRAMESIZE:" + str(self._qa_check_frame_size))
-            self._qa_check_frame=None
-            self._qa_check_frame_time=None
-            self._qa_time_counter.reset()
-            self._qa_time_bytes=0l            
-            self._qa_time_wait=0.0
-   
-            
-            
+                    self._fps_target=max(plc.fps_min, int(self._fps_target*plc.decrease))
+            else:
+                self._fps_target=max(plc.fps_min, int(self._fps_target*plc.decrease))
+        else:
+            if prefer=="balanced":
+                prefer="fps" if rfps<rqa else "quality"
+            if (prefer=="fps" and self._fps_target<plc.fps_max) or self._qa_detect>=plc.quality_max:
+                if self._fps_target<plc.fps_max:
+                    self._fps_target+=1
+            else:
+                self._qa_detect+=1
     
-    def wait_time(self, semre):
-        while True:
-            self._frame_distance=self._frame_sent-self._frame_received                        
-            #self._dskmain._agent_main.write_info("DISTANCE: " + str(self._frame_distance) + " - FPS: " + str(self._fps) + " - FRAME: " + str(self._frame_sent) + " - QA: " + str(self._qa_detect))
+    def _get_inflight_max(self):
+        #FRAME NON CONFERMATI AMMESSI: PRODOTTO BANDA*RTT IN FRAME, AL MASSIMO UN SECONDO DI FRAME
+        bw=self._bw.get()
+        rttmin=self._rtt_min.get()
+        if bw is None or rttmin is None or not self._frame_size_avg:
+            return self._qa_detect+3
+        return max(2, min(self._fps_target, int((bw*rttmin)/self._frame_size_avg)+2))
+    
+    def wait_time(self, semre, fclose=None):
+        while fclose is None or not fclose():
+            if self._frame_sent==0:
+                break
             if self._frame_sent==1:
                 bok = self._frame_sent==self._frame_received
             else:
-                appfps = self._fps
-                if appfps==-1:
-                    appfps=self._qa_detect+3
-                bok = self._frame_distance<=appfps                            
+                bok = self._frame_sent-self._frame_received<=self._get_inflight_max()
             if bok:
-                break
+                #CADENZA DEGLI FPS
+                appwait=self._last_send_time+(1.0/float(self._fps_target))-time.time()
+                if appwait<=0 or appwait>1.0:
+                    break
+                semre.wait(appwait)
             else:
-                tmw = time.time()
                 semre.wait(0.25)
-                elw = time.time()-tmw
-                if self._frame_sent>1:                                         
-                    if elw>0:
-                        self._qa_time_wait+=elw
-        #DETECT QA                      
-        if self._frame_sent>1 and self._qa_time_counter.is_elapsed(1000):
-            autoqawaitint=int(self._qa_time_wait*1000)
-            autoqawaitperc=int((float(autoqawaitint)/float(self._qa_time_counter.get_value()))*100.0)            
-            if autoqawaitperc>=50.0:
-                if self._qa_detect>0:
-                    self._qa_detect-=1
-                    #self._dskmain._agent_main.write_info("NEWQA: " + str(self._qa_detect) + " - WAIT: " + str(autoqawaitint) + " - PERC: " + str(autoqawaitperc) + " - BYTES: " + str(self._qa_time_bytes))
-            elif self._qa_time_bytes>long(self._qa_check_frame_size_avg*(float(self._qa_time_counter.get_value()) / 1000.0)) and autoqawaitperc<=5.0:
-                if self._qa_detect<9:
-                    self._qa_detect+=1
-                    #self._dskmain._agent_main.write_info("NEWQA: " + str(self._qa_detect) + " - WAIT: " + str(autoqawaitint) + " - PERC: " + str(autoqawaitperc) + " - BYTES: " + str(self._qa_time_bytes))
-            self._qa_time_counter.reset()
-            self._qa_time_bytes=0l
-            self._qa_time_wait=0.0
 
 class Manager(threading.Thread):
         
@@ -330,9 +566,12 @@ class Manager(threading.Thread):
         self._quality=-1
         
         self._frame_sent_size=None
-        self._speed_manager = SpeedManager(self._dskmain)
+        plc=RATE_POLICIES.get(self._dskmain._agent_main._get_config("desktop_rate_policy", RatePolicy.name), RatePolicy)()
+        plc.rate_max=self._dskmain._agent_main._get_config("desktop_rate_max", plc.rate_max)
+        self._speed_manager = SpeedManager(self._dskmain, plc)
         
         self._supported_frame=None
+        self._accept_frame=None
         self._frame_type=0 # 0=DATA_PALETTE_COMPRESS_V1; 100=DATA_TJPEG"
         self._send_frame_type=False        
         
@@ -346,11 +585,28 @@ class Manager(threading.Thread):
         #self._input_click_state=None
         #self._input_counter=communication.Counter()
         self._inputs = []
+        self._input_btn_state = 0
+        self._input_thread = None
         self._cursor_visible = True
         self._slow_mode = False
         #self._cursor_last_token = None
         self._monitor = -1 
         self._monitor_count = 0
+        self._pipeline_depth = self._dskmain._agent_main._get_config("desktop_pipeline_depth", CAPTURE_PIPELINE_DEPTH)
+        self._pipeline_queue = collections.deque()
+        self._pipeline_frames = 0
+        self._pipeline_sender = None
+        self._semaphore_send = threading.Condition()
+        self._cursor_thread = None
+        self._cursor_channel = self._dskmain._agent_main._get_config("desktop_cursor_channel", True)
+        self._cursor_channel_active = False
+        self._cursor_interval = self._dskmain._agent_main._get_config("desktop_cursor_interval", CAPTURE_CURSOR_INTERVAL)
+        self._cursor_cache = None
+        self._capture_process = None
+        self._capture_monitor = None
+        self._tile_cache = None
+        self._tile_cache_request = None
+        self._tile_cache_max = self._dskmain._agent_main._get_config("desktop_tile_cache_max", TILE_CACHE_SIZE_MAX)
     
     def get_id(self):
         return self._id
@@ -378,6 +634,7 @@ class Manager(threading.Thread):
                         self._semaphore_inputs.acquire()
                         try:
                             self._inputs.extend(applist)
+                            self._semaphore_inputs.notify_all()
                         finally:
                             self._semaphore_inputs.release()
                         #print("_inputevents " +  self._id + ": " + str(long(time.time() * 1000)-apptm));                        
@@ -390,6 +647,23 @@ class Manager(threading.Thread):
                             self._cursor_visible=False
                     finally:
                         self._semaphore.release()
+                if prprequest is not None and "tileCache" in prprequest:
+                    self._semaphore.acquire()
+                    try:
+                        #APPLICATA DAL THREAD DI CATTURA PER RESTARE IN ORDINE CON I TOKEN FRAME
+                        self._tile_cache_request=max(0, min(int(prprequest["tileCache"]), self._tile_cache_max))
+                    finally:
+                        self._semaphore.release()
+                if prprequest is not None and "cursorCache" in prprequest:
+                    self._semaphore.acquire()
+                    try:
+                        if prprequest["cursorCache"]=="true":
+                            if self._cursor_cache is None:
+                                self._cursor_cache=collections.OrderedDict()
+                        elif prprequest["cursorCache"]=="false":
+                            self._cursor_cache=None
+                    finally:
+                        self._semaphore.release()
                 if prprequest is not None and "monitor" in prprequest:
                     self._semaphore.acquire()
                     try:
@@ -397,6 +671,8 @@ class Manager(threading.Thread):
                         if prprequest is not None and "acceptFrameType" in prprequest:
                             arft = prprequest["acceptFrameType"].split(";")
                             if self._supported_frame is not None:
+                                appft=[int(ft) for ft in arft]
+                                self._accept_frame=[tf for tf in self._supported_frame if tf in appft]
                                 for f in range (len(self._supported_frame)):
                                     tf=self._supported_frame[f]                            
                                     for i in range(len(arft)):
@@ -435,7 +711,20 @@ class Manager(threading.Thread):
     def _on_token(self,sdata):
         if self._send_frame_type==True:
             self._send_frame_type=False
-            self._websocket.send_bytes(utils.Bytes(struct.pack("!hh",801,self._frame_type)))
+            self._send_token(utils.Bytes(struct.pack("!hh",801,self._frame_type)))
+        if self._tile_cache_request is not None:
+            self._semaphore.acquire()
+            try:
+                tcsz=self._tile_cache_request
+                self._tile_cache_request=None
+                self._tile_cache=None
+                if tcsz>0:
+                    self._tile_cache=TileCache(tcsz)
+            finally:
+                self._semaphore.release()
+            self._send_token(utils.Bytes(struct.pack("!hi",803,tcsz)))
+        
+        bendframe=False
         
         tp = struct.unpack("!h",sdata[0:2])[0]
         self._semaphore.acquire()
@@ -457,6 +746,8 @@ class Manager(threading.Thread):
                 self._distanceFrameMs=struct.unpack("!i",sdata[2:6])[0]
                 sdata=None
             elif tp==2: #TOKEN FRAME                
+                if self._tile_cache is not None:
+                    sdata=self._tile_cache.lookup(sdata)
                 if self._frame_sent_size==None:
                     self._frame_sent_size=len(sdata)
                     #print "inizio TOKEN #########################################"
@@ -472,15 +763,121 @@ class Manager(threading.Thread):
                     #   print "#"
                     #   print "#"
                     self._speed_manager.sent(self._frame_sent_size)
-                    self._websocket.send_bytes(utils.Bytes(struct.pack("!h",800)+str(self._speed_manager.get_frame_sent())))
+                    self._send_token(utils.Bytes(struct.pack("!h",800)+str(self._speed_manager.get_frame_sent())))
                     self._frame_sent_size=None
+                    bendframe=True
+            elif tp==3 and self._cursor_channel_active: #TOKEN CURSOR
+                #IL CURSORE VIAGGIA SUL CANALE DEDICATO
+                sdata=None
                         
         finally:
             self._semaphore.release()
         if sdata is not None:
+            self._send_token(sdata, bendframe)
+    
+    def _send_direct(self, sdata):
+        #UN MESSAGGIO ALLA VOLTA: I TOKEN DEL CURSORE SI INSERISCONO TRA I TOKEN DEL FRAME
+        self._semaphore_send.acquire()
+        try:
             self._websocket.send_bytes(sdata)
-        
-                        
+        finally:
+            self._semaphore_send.release()
+    
+    def _send_token(self, sdata, bendframe=False):
+        if self._pipeline_sender is None:
+            self._send_direct(sdata)
+            return
+        #PIPELINE: IL TOKEN VIENE INVIATO DAL THREAD SENDER
+        self._semaphore.acquire()
+        try:
+            self._pipeline_queue.append((sdata, bendframe))
+            if bendframe:
+                self._pipeline_frames+=1
+            self._semaphore.notify_all()
+        finally:
+            self._semaphore.release()
+    
+    def _pipeline_wait(self):
+        #NON SINCRONIZZATO: CHIAMATO CON self._semaphore ACQUISITO
+        while self._pipeline_sender is not None and self._pipeline_frames>=self._pipeline_depth and not self._bclose:
+            self._semaphore.wait(0.25)
+    
+    def _pipeline_run(self):
+        try:
+            while True:
+                self._semaphore.acquire()
+                try:
+                    while len(self._pipeline_queue)==0 and not self._bclose:
+                        self._semaphore.wait(0.5)
+                    if self._bclose:
+                        self._pipeline_queue.clear()
+                        return
+                    sdata, bendframe = self._pipeline_queue.popleft()
+                finally:
+                    self._semaphore.release()
+                self._send_direct(sdata)
+                if bendframe:
+                    self._semaphore.acquire()
+                    try:
+                        self._pipeline_frames-=1
+                        self._semaphore.notify_all()
+                    finally:
+                        self._semaphore.release()
+        except Exception as e:
+            if not self.is_close():
+                self._dskmain._agent_main.write_except(e,"AppDesktop:: pipeline send error " + self._id + ":")
+                self.terminate()
+    
+    def _cursor_token_cache(self, sdata):
+        #FORMA GIA' INVIATA AL VIEWER: BASTA IL RIFERIMENTO ALLA CACHE
+        if len(sdata)<=15 or sdata[2]!=1:
+            return sdata
+        self._semaphore.acquire()
+        try:
+            if self._cursor_cache is None:
+                return sdata
+            hsh=sdata.digest("sha1", 7)[0:8]
+            if hsh in self._cursor_cache:
+                del self._cursor_cache[hsh]
+                self._cursor_cache[hsh]=True
+                x, y = sdata.unpack_from("!hh", 3)
+                return utils.Bytes(struct.pack("!hhh", 5, x, y)+hsh)
+            self._cursor_cache[hsh]=True
+            if len(self._cursor_cache)>CAPTURE_CURSOR_CACHE_SIZE:
+                self._cursor_cache.popitem(last=False)
+            return sdata
+        finally:
+            self._semaphore.release()
+    
+    def _on_cursor_token(self, sdata):
+        tp = struct.unpack("!h",sdata[0:2])[0]
+        if tp==802:
+            self._cursor_channel=False
+            return
+        if tp==3:
+            self._cursor_channel_active=True
+            sdata=self._cursor_token_cache(sdata)
+        self._send_direct(sdata)
+    
+    def _cursor_run(self):
+        #IL CURSORE HA UNA CADENZA PROPRIA: NON ATTENDE IL PACING DELLO SpeedManager NE' L'INVIO DEI FRAME AL VIEWER
+        #LA RICHIESTA NATIVA PERO' E' SERIALIZZATA CON LA CATTURA (VEDI CaptureProcess.cursor)
+        while self._cursor_channel and not self.is_close():
+            try:
+                self._semaphore.acquire()
+                try:
+                    mon=-1
+                    if self._monitor_count>0:
+                        mon=self._monitor
+                finally:
+                    self._semaphore.release()
+                if mon>=0:
+                    self._get_capture_process().cursor(self, mon, self._on_cursor_token)
+                time.sleep(self._cursor_interval)
+            except Exception as e:
+                if not self.is_close():
+                    self._dskmain._agent_main.write_err("Desktop cursor channel error id:" + self._id + " error:" + str(e))
+                    time.sleep(1)
                         
     def run(self):
         #last_diff_time=long(time.time() * 1000)
@@ -488,6 +885,18 @@ class Manager(threading.Thread):
         #INVIA ID
         sdataid=struct.pack("!h",900)+self._id;
         self._websocket.send_bytes(utils.Bytes(sdataid))
+        if self._pipeline_depth>0:
+            self._pipeline_sender=threading.Thread(target=self._pipeline_run, name="DesktopManagerSender")
+            self._pipeline_sender.daemon=True
+            self._pipeline_sender.start()
+        #GLI INPUT NON ATTENDONO IL CICLO DI CATTURA
+        self._input_thread=threading.Thread(target=self._input_run, name="DesktopManagerInput")
+        self._input_thread.daemon=True
+        self._input_thread.start()
+        if self._cursor_channel and self._get_capture_process().is_binary_protocol():
+            self._cursor_thread=threading.Thread(target=self._cursor_run, name="DesktopManagerCursor")
+            self._cursor_thread.daemon=True
+            self._cursor_thread.start()
         lclose=self.is_close()
         curmon=-1
         max_retry=3
@@ -497,13 +906,13 @@ class Manager(threading.Thread):
         while not lclose:
             try:
                 #print("_send_token_image WAIT time=" + str(long(time.time() * 1000)-apptmwait));
-                self._inputevents()
                 #last_diff_time=communication.get_time()                
                 self._distanceFrameMsCounter.reset()
                 appqa=quality_detect
                 if quality_request>=0 and quality_request<=9:                    
                     appqa=quality_request                   
-                self._dskmain._capture_process.difference(self, frame_type, appqa,curmon,self._on_token)
+                cp=self._dskmain._get_capture_process(self, curmon)
+                cp.difference(self, frame_type, appqa,curmon,self._on_token)
                 max_retry=5;
                 #print("_send_token_image _capture_process time=" + str(communication.get_time()-last_diff_time));
                 
@@ -511,8 +920,13 @@ class Manager(threading.Thread):
                 try:
                     if self._bclose:
                         lclose=True
-                        break                    
-                    self._speed_manager.wait_time(self._semaphore)                    
+                        break
+                    #FRAME N+1 PARTE MENTRE FRAME N E' ANCORA IN INVIO
+                    self._pipeline_wait()
+                    if self._bclose:
+                        lclose=True
+                        break
+                    self._speed_manager.wait_time(self._semaphore, lambda: self._bclose)
                     appwait=0
                     if self._slow_mode:
                         appwait=CAPTURE_INTERVALL_SLOW_MODE
@@ -527,6 +941,10 @@ class Manager(threading.Thread):
                     else:
                         curmon=-1
                     quality_request=self._quality
+                    appft=self._speed_manager.get_frame_type(self._accept_frame, self._frame_type)
+                    if appft!=self._frame_type:
+                        self._frame_type=appft
+                        self._send_frame_type=True
                     frame_type=self._frame_type
                     quality_detect = self._speed_manager.get_qa_detect()
                 finally:
@@ -536,7 +954,7 @@ class Manager(threading.Thread):
                 if not self.is_close():
                     if cnt_retry>=max_retry: #NUMERO TENTATITVI
                         try:
-                            self._websocket.send_bytes(utils.Bytes(struct.pack("!h",999) + str(e)))
+                            self._send_direct(utils.Bytes(struct.pack("!h",999) + str(e)))
                             #TOKEN MONITOR = 0 NOT DETECTED
                             #self._websocket.send_bytes(struct.pack("!hh",10,0))
                         except Exception as ex:
@@ -587,14 +1005,56 @@ class Manager(threading.Thread):
             sctrl = ar[5]
             salt = ar[6]
             sshift = ar[7]
-            self._dskmain._capture_process.mouse(self, x, y, btn, whl, sctrl=="true",salt=="true",sshift=="true")
+            self._get_capture_process().mouse(self, x, y, btn, whl, sctrl=="true",salt=="true",sshift=="true")
             if ar[3]=="64":
                 if self._input_click_state["state"]=="DOWN":
-                    self._dskmain._capture_process.mouse(self, x, y, 1, whl, sctrl=="true",salt=="true",sshift=="true")
+                    self._get_capture_process().mouse(self, x, y, 1, whl, sctrl=="true",salt=="true",sshift=="true")
             self._input_click_state=None
     
     '''
     
+    def _input_run(self):
+        while not self._bclose:
+            self._semaphore_inputs.acquire()
+            try:
+                while len(self._inputs)==0 and not self._bclose:
+                    self._semaphore_inputs.wait(0.5)
+            finally:
+                self._semaphore_inputs.release()
+            if not self._bclose:
+                self._inputevents()
+    
+    def _inputevents_coalesce(self, events):
+        #UNISCE UN MOVIMENTO MOUSE CON L'EVENTO MOUSE SUCCESSIVO (VALE LA POSIZIONE PIU' RECENTE)
+        #E SOMMA I DELTA ROTELLA CONSECUTIVI; CLICK E TASTI MANTENGONO L'ORDINE ESATTO
+        #UN EVENTO E' "PURO" SE NON CAMBIA LO STATO DEI PULSANTI (btn=-1 O UGUALE ALLO STATO)
+        ret=[]
+        arpure=[]
+        st=self._input_btn_state
+        for ev in events:
+            if ev[0]!="MOUSE":
+                ret.append(ev)
+                arpure.append(False)
+                continue
+            x, y, btn, whl = ev[1:5]
+            bpure = btn!=64 and btn!=128 and (btn==-1 or btn==st)
+            if len(ret)>0 and arpure[-1] and ret[-1][0]=="MOUSE" and ret[-1][5:]==ev[5:] and x!=-1 and y!=-1:
+                prv=ret[-1]
+                if prv[4]==0:
+                    ret.pop()
+                    arpure.pop()
+                elif bpure and whl!=0 and (whl>0)==(prv[4]>0) and not agent.is_linux():
+                    #SU LINUX OGNI EVENTO ROTELLA E' UNO SCATTO: NON SI POSSONO SOMMARE
+                    ret.pop()
+                    arpure.pop()
+                    ev=(ev[0], x, y, btn, whl+prv[4]) + ev[5:]
+            if btn!=-1 and btn!=64 and btn!=128:
+                st=btn
+            ret.append(ev)
+            arpure.append(bpure)
+        self._input_btn_state=st
+        return ret
+    
     def _inputevents(self):
         bret=True
         try:
@@ -628,6 +1088,7 @@ class Manager(threading.Thread):
                 bret=False
                 self._inputevents_fire_click_state_if_need()
             '''
+            events=[]
             for i in range(len(applist)):
                 s = applist[i]
                 ar = s.split(",")
@@ -685,7 +1146,7 @@ class Manager(threading.Thread):
                     #print("_inputevents " + str(btn) + "  " + str(long(time.time() * 1000) - long(ar[len(ar)-1])))
                     
                     #if bfireev:
-                    self._dskmain._capture_process.mouse(self, x, y, btn, whl, sctrl=="true",salt=="true",sshift=="true",scommand=="true")
+                    events.append(("MOUSE", x, y, btn, whl, sctrl=="true",salt=="true",sshift=="true",scommand=="true"))
                        
                      
                 elif ar[0]=='KEYBOARD':
@@ -698,23 +1159,31 @@ class Manager(threading.Thread):
                     scommand = "false"
                     if len(ar)==7:
                         scommand = ar[6]
-                    self._dskmain._capture_process.keyboard(self, tp, code, sctrl=="true",salt=="true",sshift=="true",scommand=="true")
+                    events.append(("KEYBOARD", tp, code, sctrl=="true",salt=="true",sshift=="true",scommand=="true"))
+            if len(events)>0:
+                self._get_capture_process().inputs(self, self._inputevents_coalesce(events))
         except Exception as e:
             self._dskmain._agent_main.write_except(e,"AppDesktop:: inputevents error " + self._id + ":")
         return bret
                 
+    def _get_capture_process(self):
+        cp=self._capture_process
+        if cp is None:
+            cp=self._dskmain._get_capture_process(self, -1)
+        return cp
+    
     def _on_close(self):
         self.terminate();
     
     def copy_text(self):
         if not self._allow_inputs:
             raise Exception("Permission denied (inputs).")
-        return self._dskmain._capture_process.copy_text(self);
+        return self._get_capture_process().copy_text(self);
     
     def paste_text(self,s):
         if not self._allow_inputs:
             raise Exception("Permission denied (inputs).")
-        return self._dskmain._capture_process.paste_text(self,s);
+        return self._get_capture_process().paste_text(self,s);
     
     def terminate(self):
         self._semaphore.acquire()
@@ -726,11 +1195,14 @@ class Manager(threading.Thread):
     
     def _destroy(self):
         if self._id is not None:
+            if self._cursor_thread is not None:
+                #LA SESSIONE NATIVA DEL CURSORE VIENE RIMOSSA CON IL MANAGER
+                self._cursor_thread.join(5)
             if self._websocket is not None:
                 self._websocket.close()
                 self._websocket=None
             try:
-                self._dskmain._capture_process.remove(self)
+                self._dskmain._remove_capture(self)
             except Exception as e:
                 self._dskmain._agent_main.write_except(e,"AppDesktop:: captureprocess remove error " + self._id + ":")
             if self._id is not None:
@@ -759,6 +1231,64 @@ class CaptureProcessStdRedirect(object):
 
 
 
+class CaptureShare():
+    
+    #SESSIONE NATIVA CONDIVISA DA PIU' VIEWER CON STESSO MONITOR, TIPO FRAME E QUALITA'
+    #I TOKEN DI OGNI CATTURA VENGONO ACCODATI AGLI ALTRI MEMBRI, CHE LI RICEVONO ALLA LORO RICHIESTA
+    #NON SINCRONIZZATO: USATO SOTTO IL LOCK DI CaptureProcess
+    def __init__(self, sid, key, share):
+        self._sid=sid
+        self._key=key
+        self._share=share
+        self._members={}
+    
+    def get_sid(self):
+        return self._sid
+    
+    def get_key(self):
+        return self._key
+    
+    def set_key(self, key):
+        self._key=key
+    
+    def get_member_count(self):
+        return len(self._members)
+    
+    def is_shareable(self, key):
+        return self._share and self._key==key
+    
+    def is_empty(self):
+        return len(self._members)==0
+    
+    def add(self, dm):
+        self._members[dm]=[collections.deque(), 0]
+    
+    def remove(self, dm):
+        if dm in self._members:
+            del self._members[dm]
+    
+    def clear_pending(self):
+        for dm in self._members:
+            self._members[dm]=[collections.deque(), 0]
+    
+    def pop_pending(self, dm):
+        pnd=self._members[dm][0]
+        self._members[dm]=[collections.deque(), 0]
+        return pnd
+    
+    def append_pending(self, bts, dmexclude, sizemax):
+        #RITORNA I MEMBRI CHE HANNO SUPERATO LA SOGLIA
+        arover=[]
+        for dm in self._members:
+            if dm is not dmexclude:
+                itm=self._members[dm]
+                itm[0].append(bts)
+                itm[1]+=len(bts)
+                if itm[1]>sizemax:
+                    arover.append(dm)
+        return arover
+
+
 class CaptureProcess():
     
     def __init__(self,agent_main):
@@ -769,12 +1299,24 @@ class CaptureProcess():
         self._osmodule=None
         self._listlibs=None
         self._semaphore = threading.Condition()
+        self._semaphore_write = threading.Condition()
         self._sharedmem=None
         self._process=None
         self._ppid=None
         self._currentconsoleid=None
         self._listdm={}
+        self._listcursor={}
         self._last_copy_text=""
+        self._share_enabled=True
+        self._share_pending_max=CAPTURE_SHARE_PENDING_MAX
+        self._binary_protocol=True
+        self._damage_enabled=True
+        self._damage_hint=False
+        if self._agent_main is not None:
+            self._binary_protocol=self._agent_main._get_config("desktop_capture_binary_protocol", True)
+            self._damage_enabled=self._agent_main._get_config("desktop_capture_damage", True)
+            self._share_enabled=self._agent_main._get_config("desktop_capture_share", True)
+            self._share_pending_max=self._agent_main._get_config("desktop_capture_share_pending_max", CAPTURE_SHARE_PENDING_MAX)
     
     def destroy(self):
         self._semaphore.acquire()
@@ -960,7 +1502,11 @@ class CaptureProcess():
                     self._agent_main.get_osmodule().task_kill(self._ppid)
         except Exception as e:
             self._agent_main.write_except(e)
-        self._sharedmem=None
+        self._semaphore_write.acquire()
+        try:
+            self._sharedmem=None
+        finally:
+            self._semaphore_write.release()
         self._process=None
         self._ppid=None
         self._currentconsoleid=None
@@ -992,9 +1538,17 @@ class CaptureProcess():
     '''
         
     def write_token(self,s):
-        bts=utils.Bytes();
-        bts.append_str(s, "utf8")
-        self._sharedmem.write_token(bts)
+        if isinstance(s, utils.Bytes):
+            bts=s
+        else:
+            bts=utils.Bytes();
+            bts.append_str(s, "utf8")
+        #LA SCRITTURA E' SERIALIZZATA A PARTE: GLI INPUT NON ATTENDONO UNA difference IN CORSO
+        self._semaphore_write.acquire()
+        try:
+            self._sharedmem.write_token(bts)
+        finally:
+            self._semaphore_write.release()
         #self._sharedmem.write_token(s)
         
     def read_token(self):        
@@ -1042,33 +1596,108 @@ class CaptureProcess():
         finally:
             self._semaphore.release()
         
-    def remove(self, dm):
+    def _leave_share(self, dm, bdestroy):
+        #NON SINCRONIZZATO: CHIAMATO CON self._semaphore ACQUISITO
+        if dm in self._listdm:
+            shr=self._listdm[dm]
+            del self._listdm[dm]
+            shr.remove(dm)
+            if shr.is_empty():
+                self._request_async(self._req_terminate(shr.get_sid()),bdestroy and len(self._listdm)==0)
+    
+    def _new_share(self, dm, key, share):
+        #NON SINCRONIZZATO: CHIAMATO CON self._semaphore ACQUISITO
+        self._lastid+=1;
+        shr=CaptureShare(str(self._lastid), key, share)
+        shr.add(dm)
+        self._listdm[dm]=shr
+        return shr
+    
+    def _get_share(self, dm, key):
+        #NON SINCRONIZZATO: CHIAMATO CON self._semaphore ACQUISITO
+        cur=None
         if dm in self._listdm:
-            sid=self._listdm[dm]
-            del self._listdm[dm] 
-            self._request_async(u"TERMINATE:"+sid,len(self._listdm)==0)
+            cur=self._listdm[dm]
+            if cur.get_key()==key:
+                return cur
+        if self._share_enabled and key is not None:
+            for appdm in self._listdm:
+                shr=self._listdm[appdm]
+                if shr is not cur and shr.is_shareable(key):
+                    if cur is not None:
+                        self._leave_share(dm, False)
+                    #IL NUOVO MEMBRO HA BISOGNO DI UN FRAME COMPLETO: RIPARTE LA SESSIONE NATIVA
+                    shr.add(dm)
+                    shr.clear_pending()
+                    self._listdm[dm]=shr
+                    self._request_async(self._req_terminate(shr.get_sid()))
+                    return shr
+        if cur is not None:
+            if cur.get_member_count()==1:
+                #UNICO MEMBRO: LA SESSIONE NATIVA PROSEGUE CON I NUOVI PARAMETRI
+                cur.set_key(key)
+                return cur
+            self._leave_share(dm, False)
+        return self._new_share(dm, key, self._share_enabled)
+    
+    def remove(self, dm):
+        self._semaphore.acquire()
+        try:
+            if dm in self._listcursor:
+                self._request_async(self._req_terminate(self._listcursor[dm]))
+                del self._listcursor[dm]
+            self._leave_share(dm, True)
+        finally:
+            self._semaphore.release()
     
     def get_id(self,dm):
-        if dm not in self._listdm:
-            self._lastid+=1;
-            appid=str(self._lastid)
-            #self._request("INITIALIZE:" + appid)
-            self._listdm[dm]=appid
-            #self._listdm[dm]=str(self._get_osmodule().initialize())
-        return self._listdm[dm]
+        self._semaphore.acquire()
+        try:
+            if dm not in self._listdm:
+                self._new_share(dm, None, self._share_enabled)
+            return self._listdm[dm].get_sid()
+        finally:
+            self._semaphore.release()
     
     def difference(self, dm, tp, qa, monitor, ontoken):
-        sid=self.get_id(dm)
-        sreq=[]
-        sreq.append(u"DIFFERENCE:")
-        sreq.append(sid)
-        sreq.append(u";")
-        sreq.append(str(tp))
-        sreq.append(u";")
-        sreq.append(str(qa))
-        sreq.append(u";")
-        sreq.append(str(monitor))
-        self._request(u"".join(sreq),ontoken)
+        self._semaphore.acquire()
+        try:
+            shr=self._get_share(dm, (tp, qa, monitor))
+            pnd=shr.pop_pending(dm)
+            if len(pnd)>0:
+                #FRAME GIA' CATTURATI PER UN ALTRO MEMBRO
+                for bts in pnd:
+                    ontoken(bts)
+                return
+            
+            def ontoken_share(bts):
+                arover=shr.append_pending(bts, dm, self._share_pending_max)
+                for appdm in arover:
+                    #VIEWER TROPPO LENTO: PROSEGUE CON UNA SESSIONE PROPRIA (FRAME COMPLETO)
+                    shr.remove(appdm)
+                    self._new_share(appdm, shr.get_key(), False)
+                ontoken(bts)
+            
+            if self._binary_protocol:
+                sreq=utils.Bytes()
+                op=REQ_DIFFERENCE
+                if self._damage_enabled:
+                    op=REQ_DIFFERENCE_DAMAGE
+                sreq.append_pack("!BIhhh", op, int(shr.get_sid()), tp, qa, monitor)
+            else:
+                sreq=[]
+                sreq.append(u"DIFFERENCE:")
+                sreq.append(shr.get_sid())
+                sreq.append(u";")
+                sreq.append(str(tp))
+                sreq.append(u";")
+                sreq.append(str(qa))
+                sreq.append(u";")
+                sreq.append(str(monitor))
+                sreq=u"".join(sreq)
+            self._request(sreq,ontoken_share)
+        finally:
+            self._semaphore.release()
         '''
         sret = self._request("DIFFERENCE:" + sid + ";" + str(bps) + ";" + str(monitor))
         if sret==None:
@@ -1076,23 +1705,109 @@ class CaptureProcess():
         return sret
         '''
     
-    def keyboard(self, dm, tp, code, ctrl, alt, shift, cmdkey) :
-        sid=self.get_id(dm)
-        bok = True;
+    def is_binary_protocol(self):
+        return self._binary_protocol
+    
+    def cursor(self, dm, monitor, ontoken):
+        #IL PROCESSO DI CATTURA ESEGUE LE RICHIESTE UNA ALLA VOLTA E LA LIBRERIA NATIVA NON E' THREAD SAFE:
+        #SE E' IN CORSO UNA difference LA RICHIESTA DEL CURSORE ATTENDE LA FINE DELLA CATTURA
+        self._semaphore.acquire()
+        try:
+            if dm not in self._listcursor:
+                #SESSIONE NATIVA PROPRIA: LO STATO DEL CURSORE NON SI CONDIVIDE TRA VIEWER
+                self._lastid+=1
+                self._listcursor[dm]=str(self._lastid)
+            sreq=utils.Bytes()
+            sreq.append_pack("!BIh", REQ_CURSOR, int(self._listcursor[dm]), monitor)
+            self._request(sreq,ontoken)
+        finally:
+            self._semaphore.release()
+    
+    def _req_flags(self, ctrl, alt, shift, cmdkey):
+        f=0
+        if ctrl:
+            f|=REQ_FLAG_CTRL
+        if alt:
+            f|=REQ_FLAG_ALT
+        if shift:
+            f|=REQ_FLAG_SHIFT
+        if cmdkey:
+            f|=REQ_FLAG_COMMAND
+        return f
+    
+    def _req_append_str(self, bts, s, fmt="!H"):
+        apps=unicode(s).encode("utf8")
+        bts.append_pack(fmt + str(len(apps)) + "s", len(apps), apps)
+    
+    def _req_terminate(self, sid):
+        if self._binary_protocol:
+            bts=utils.Bytes()
+            bts.append_pack("!BI", REQ_TERMINATE, int(sid))
+            return bts
+        return u"TERMINATE:"+sid
+    
+    def _req_keyboard(self, bts, sid, tp, code, ctrl, alt, shift, cmdkey):
         if agent.is_windows() and tp=="CTRLALTCANC":
             if self._get_osmodule().sas():
-                bok = False
-        if bok:
-            apps=u"KEYBOARD:"+unicode(sid)+u";"+ unicode(tp) +u";"+unicode(code)+u";"+unicode(ctrl)+u";"+unicode(alt)+u";"+unicode(shift)+u";"+unicode(cmdkey)
-            #print(apps)
-            self._request_async(apps)
-        
+                return None
+        if bts is None:
+            return u"KEYBOARD:"+unicode(sid)+u";"+ unicode(tp) +u";"+unicode(code)+u";"+unicode(ctrl)+u";"+unicode(alt)+u";"+unicode(shift)+u";"+unicode(cmdkey)
+        bts.append_pack("!BIB", REQ_KEYBOARD, int(sid), self._req_flags(ctrl, alt, shift, cmdkey))
+        self._req_append_str(bts, tp)
+        self._req_append_str(bts, code)
+        return bts
+    
+    def _req_mouse(self, bts, sid, x, y , btn, whl, ctrl, alt, shift, cmdkey):
+        if bts is None:
+            return u"MOUSE:"+unicode(sid)+u";"+unicode(x)+u";"+unicode(y)+u";"+unicode(btn)+u";"+unicode(whl)+u";"+unicode(ctrl)+u";"+unicode(alt)+u";"+unicode(shift)+u";"+unicode(cmdkey)
+        bts.append_pack("!BIiiiiB", REQ_MOUSE, int(sid), x, y, btn, whl, self._req_flags(ctrl, alt, shift, cmdkey))
+        return bts
+    
+    def keyboard(self, dm, tp, code, ctrl, alt, shift, cmdkey) :
+        self.inputs(dm, [("KEYBOARD", tp, code, ctrl, alt, shift, cmdkey)])
     
     def mouse(self, dm, x, y , btn, whl, ctrl, alt, shift, cmdkey) :
-        sid=self.get_id(dm)
-        apps=u"MOUSE:"+unicode(sid)+u";"+unicode(x)+u";"+unicode(y)+u";"+unicode(btn)+u";"+unicode(whl)+u";"+unicode(ctrl)+u";"+unicode(alt)+u";"+unicode(shift)+u";"+unicode(cmdkey)
-        #print(apps)
-        self._request_async(apps)
+        self.inputs(dm, [("MOUSE", x, y, btn, whl, ctrl, alt, shift, cmdkey)])
+    
+    def inputs(self, dm, events):
+        #events: ("MOUSE", x, y, btn, whl, ctrl, alt, shift, cmdkey) o ("KEYBOARD", tp, code, ctrl, alt, shift, cmdkey)
+        #CON IL PROTOCOLLO BINARIO TUTTI GLI EVENTI VIAGGIANO IN UN SOLO TOKEN
+        #NON SINCRONIZZATO: LETTURA DI self._listdm PER NON ATTENDERE LA difference IN CORSO
+        #IL PROCESSO FIGLIO E' A THREAD SINGOLO: IL TOKEN VIENE SCRITTO SUBITO MA GLI EVENTI
+        #SONO ESEGUITI SOLO AL TERMINE DELLA DIFFERENCE IN CORSO (VEDI _listen_binary)
+        shr=self._listdm.get(dm)
+        if shr is not None:
+            sid=shr.get_sid()
+        else:
+            sid=self.get_id(dm)
+        bts=None
+        if self._binary_protocol:
+            bts=utils.Bytes()
+        artoken=[]
+        for ev in events:
+            if ev[0]=="MOUSE":
+                apps=self._req_mouse(bts, sid, *ev[1:])
+            elif ev[0]=="KEYBOARD":
+                apps=self._req_keyboard(bts, sid, *ev[1:])
+            else:
+                continue
+            if bts is None and apps is not None:
+                artoken.append(apps)
+        if bts is not None and len(bts)>0:
+            artoken.append(bts)
+        if len(artoken)==0:
+            return
+        self._semaphore_write.acquire()
+        try:
+            if self._sharedmem is not None:
+                for apps in artoken:
+                    self.write_token(apps)
+                return
+        finally:
+            self._semaphore_write.release()
+        #PROCESSO NON ATTIVO
+        for apps in artoken:
+            self._request_async(apps)
     
     
     def _on_token_copy_text(self,sdata):
@@ -1101,13 +1816,24 @@ class CaptureProcess():
     def copy_text(self, dm) :
         sid=self.get_id(dm)
         self._last_copy_text=""
-        self._request(u"COPYTEXT:"+str(sid),self._on_token_copy_text)
+        if self._binary_protocol:
+            sreq=utils.Bytes()
+            sreq.append_pack("!BI", REQ_COPYTEXT, int(sid))
+        else:
+            sreq=u"COPYTEXT:"+str(sid)
+        self._request(sreq,self._on_token_copy_text)
         return self._last_copy_text
     
     def paste_text(self, dm, s) :
         sid=self.get_id(dm)
         if s is not None:
-            self._request_async(u"PASTETEXT:"+str(sid)+u";"+base64.b64encode(s.encode("utf8")))
+            if self._binary_protocol:
+                sreq=utils.Bytes()
+                sreq.append_pack("!BI", REQ_PASTETEXT, int(sid))
+                self._req_append_str(sreq, s, "!I")
+            else:
+                sreq=u"PASTETEXT:"+str(sid)+u";"+base64.b64encode(s.encode("utf8"))
+            self._request_async(sreq)
         
     
     def _enable_debug(self):
@@ -1165,6 +1891,121 @@ class CaptureProcess():
         if sz>0:
             self.write_res_token("K", utils.Bytes(pdata[0:sz]))
     
+    def _listen_error(self, ex):
+        self._debug_print(traceback.format_exc());
+        bts = utils.Bytes()
+        bts.append_str(unicode(ex), "utf8")
+        self.write_res_token("E", bts )
+    
+    def _listen_terminate(self, listids, appid):
+        if appid in listids:
+            del listids[appid]
+            self._get_osmodule().term(appid)
+    
+    def _listen_session(self, listids, appid, monidx):
+        if appid not in listids:
+            self._get_osmodule().init(appid);
+            listids[appid]={"monitor": monidx};
+            self._get_osmodule().monitor(appid,monidx)
+        elif listids[appid]["monitor"]!=monidx:
+            listids[appid]["monitor"]=monidx
+            self._get_osmodule().monitor(appid,monidx)
+    
+    def _listen_difference(self, listids, appid, tp, qa, monidx, bdamage=False):
+        self._listen_session(listids, appid, monidx)
+        if bdamage and self._damage_hint and self._get_osmodule().damaged(appid)==0:
+            #NESSUNA AREA DANNEGGIATA: IL FRAME NON E' CAMBIATO E NON SERVE CONFRONTARLO
+            self.write_res_token("T", None)
+            return
+        self._get_osmodule().difference(appid,tp,qa,cb_difference)
+        self.write_res_token("T", None)
+    
+    def _listen_cursor(self, listids, libver, appid, monidx):
+        if libver<3:
+            #LIBRERIA SENZA CANALE CURSORE: IL CURSORE RESTA NEI TOKEN DEL FRAME
+            self.write_res_token("K", utils.Bytes(struct.pack("!h",802)))
+        else:
+            self._listen_session(listids, appid, monidx)
+            self._get_osmodule().cursor(appid,cb_difference)
+        self.write_res_token("T", None)
+    
+    def _listen_copytext(self, appid):
+        apps = self._copy_text(appid)
+        if apps is None:
+            self.write_res_token("T", None)
+        else:
+            bts = utils.Bytes()
+            bts.append_str(base64.b64encode(apps.encode("utf8")), "utf8")
+            self.write_res_token("T", bts)
+    
+    def _listen_mouse(self, libver, appid, x, y, btn, whl, ctrl, alt, shift, cmdkey):
+        if libver==0:
+            self._get_osmodule().inputMouse(appid, x, y, btn, whl, ctrl, alt, shift)
+        else:
+            self._get_osmodule().inputMouse(appid, x, y, btn, whl, ctrl, alt, shift, cmdkey)
+    
+    def _listen_keyboard(self, libver, appid, tp, code, ctrl, alt, shift, cmdkey):
+        if libver==0:
+            self._get_osmodule().inputKeyboard(appid, tp, code, ctrl, alt, shift)
+        else:
+            self._get_osmodule().inputKeyboard(appid, tp, code, ctrl, alt, shift, cmdkey)
+    
+    def _listen_unpack(self, bts, fmt, p):
+        return bts.unpack_from(fmt, p), p+struct.calcsize(fmt)
+    
+    def _listen_unpack_str(self, bts, fmt, p):
+        ln, p = self._listen_unpack(bts, fmt, p)
+        if p+ln[0]>len(bts):
+            raise struct.error("Binary request truncated.")
+        return bts.unpack_from(str(ln[0]) + "s", p)[0], p+ln[0]
+    
+    def _listen_binary(self, bts, listids, libver):
+        #RICHIESTE ESEGUITE IN ORDINE SUL THREAD DI ASCOLTO: MOUSE E KEYBOARD ATTENDONO LA DIFFERENCE
+        #IN CORSO (LA LIBRERIA NATIVA NON E' GARANTITA THREAD-SAFE TRA CATTURA E INPUT)
+        p=0
+        while p<len(bts):
+            op=bts[p]
+            p+=1
+            try:
+                if op==REQ_TERMINATE:
+                    prms, p = self._listen_unpack(bts, "!I", p)
+                    self._listen_terminate(listids, prms[0])
+                elif op==REQ_DIFFERENCE or op==REQ_DIFFERENCE_DAMAGE:
+                    prms, p = self._listen_unpack(bts, "!Ihhh", p)
+                    self._listen_difference(listids, prms[0], prms[1], prms[2], prms[3], op==REQ_DIFFERENCE_DAMAGE)
+                elif op==REQ_CURSOR:
+                    prms, p = self._listen_unpack(bts, "!Ih", p)
+                    self._listen_cursor(listids, libver, prms[0], prms[1])
+                elif op==REQ_COPYTEXT:
+                    prms, p = self._listen_unpack(bts, "!I", p)
+                    self._listen_copytext(prms[0])
+                elif op==REQ_PASTETEXT:
+                    prms, p = self._listen_unpack(bts, "!I", p)
+                    apps, p = self._listen_unpack_str(bts, "!I", p)
+                    self._paste_text(prms[0], apps.decode("utf8"))
+                elif op==REQ_MOUSE:
+                    prms, p = self._listen_unpack(bts, "!IiiiiB", p)
+                    f=prms[5]
+                    self._listen_mouse(libver, prms[0], prms[1], prms[2], prms[3], prms[4], 
+                                       (f & REQ_FLAG_CTRL)!=0, (f & REQ_FLAG_ALT)!=0, (f & REQ_FLAG_SHIFT)!=0, (f & REQ_FLAG_COMMAND)!=0)
+                elif op==REQ_KEYBOARD:
+                    prms, p = self._listen_unpack(bts, "!IB", p)
+                    tp, p = self._listen_unpack_str(bts, "!H", p)
+                    code, p = self._listen_unpack_str(bts, "!H", p)
+                    f=prms[1]
+                    self._listen_keyboard(libver, prms[0], tp, code, 
+                                          (f & REQ_FLAG_CTRL)!=0, (f & REQ_FLAG_ALT)!=0, (f & REQ_FLAG_SHIFT)!=0, (f & REQ_FLAG_COMMAND)!=0)
+                else:
+                    raise Exception(u"Request opcode " + unicode(op) + u" not found.")
+            except struct.error as ex:
+                #TOKEN NON VALIDO: IL RESTO NON E' INTERPRETABILE
+                self._listen_error(ex)
+                return
+            except Exception as ex:
+                self._listen_error(ex)
+                if op<REQ_TERMINATE or op>REQ_CURSOR:
+                    return
+    
     def listen(self,fname,dbgenable):
         try:
             self._dbgenable=(dbgenable.upper()=="TRUE")
@@ -1187,6 +2028,7 @@ class CaptureProcess():
             libver = self._get_osmodule().version()
         except:
             None            
+        self._damage_hint=(libver>=2)
         self._debug_print("Init capture process. (" + fname + ")")
         listids={}
         try:
@@ -1198,6 +2040,9 @@ class CaptureProcess():
                 if bts==None:
                     #self._debug_print("########## Richiesta: NONE")
                     break
+                if len(bts)>0 and bts[0]<0x20:
+                    self._listen_binary(bts, listids, libver)
+                    continue
                 srequest=bts.to_str('utf8')
                 self._debug_print("Richiesta: " + srequest)
                 ar = srequest.split(":")
@@ -1206,50 +2051,23 @@ class CaptureProcess():
                         if len(ar)==2:
                             prms=ar[1].split(";")
                         if ar[0]==u"TERMINATE":
-                            appid=int(prms[0]);
-                            if appid in listids:
-                                del listids[appid]
-                                self._get_osmodule().term(appid)
+                            self._listen_terminate(listids, int(prms[0]))
                         elif ar[0]==u"DIFFERENCE":
-                            appid=int(prms[0]);
-                            tp=int(prms[1]);
-                            qa=int(prms[2]);
-                            monidx=int(prms[3]);
-                            if appid not in listids:
-                                self._get_osmodule().init(appid);
-                                listids[appid]={"monitor": monidx};
-                                self._get_osmodule().monitor(appid,monidx)
-                            elif listids[appid]["monitor"]!=monidx:
-                                self._get_osmodule().monitor(appid,monidx)
-                            
-                            self._get_osmodule().difference(appid,tp,qa,cb_difference)
-                            self.write_res_token("T", None)
+                            self._listen_difference(listids, int(prms[0]), int(prms[1]), int(prms[2]), int(prms[3]))
                         elif ar[0]==u"COPYTEXT":
-                            apps = self._copy_text(int(prms[0]))
-                            if apps is None:
-                                self.write_res_token("T", None)
-                            else:
-                                bts = utils.Bytes()
-                                bts.append_str(base64.b64encode(apps.encode("utf8")), "utf8")
-                                self.write_res_token("T", bts)
+                            self._listen_copytext(int(prms[0]))
                         elif ar[0]==u"PASTETEXT":
                             self._paste_text(int(prms[0]),base64.b64decode(prms[1]).decode("utf8"))
                         elif ar[0]==u"MOUSE":
-                            if libver==0:
-                                self._get_osmodule().inputMouse(int(prms[0]),int(prms[1]), int(prms[2]), int(prms[3]), int(prms[4]), prms[5]=="True", prms[6]=="True",prms[7]=="True")
-                            else:
-                                bcommand=False
-                                if len(prms)==9:
-                                    bcommand=(prms[8]=="True")
-                                self._get_osmodule().inputMouse(int(prms[0]),int(prms[1]), int(prms[2]), int(prms[3]), int(prms[4]), prms[5]=="True", prms[6]=="True",prms[7]=="True",bcommand)
+                            bcommand=False
+                            if len(prms)==9:
+                                bcommand=(prms[8]=="True")
+                            self._listen_mouse(libver, int(prms[0]),int(prms[1]), int(prms[2]), int(prms[3]), int(prms[4]), prms[5]=="True", prms[6]=="True",prms[7]=="True",bcommand)
                         elif ar[0]==u"KEYBOARD":
-                            if libver==0:
-                                self._get_osmodule().inputKeyboard(int(prms[0]), str(prms[1]), str(prms[2]), prms[3]=="True", prms[4]=="True",prms[5]=="True")
-                            else:
-                                bcommand=False
-                                if len(prms)==7:
-                                    bcommand=(prms[6]=="True")
-                                self._get_osmodule().inputKeyboard(int(prms[0]), str(prms[1]), str(prms[2]), prms[3]=="True", prms[4]=="True",prms[5]=="True",bcommand)
+                            bcommand=False
+                            if len(prms)==7:
+                                bcommand=(prms[6]=="True")
+                            self._listen_keyboard(libver, int(prms[0]), str(prms[1]), str(prms[2]), prms[3]=="True", prms[4]=="True",prms[5]=="True",bcommand)
                         else:
                             bts = utils.Bytes()
                             bts.append_str(u"Request '" + srequest + u"' not found.", "utf8")
@@ -1257,10 +2075,7 @@ class CaptureProcess():
                     else:
                         raise Exception(u"Request '" + srequest + u"' is not valid.")
                 except Exception as ex:
-                    self._debug_print(traceback.format_exc());
-                    bts = utils.Bytes()
-                    bts.append_str(unicode(ex), "utf8")
-                    self.write_res_token("E", bts )
+                    self._listen_error(ex)
         except Exception as ex:
             self._debug_print(traceback.format_exc());
         
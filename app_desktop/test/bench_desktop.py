@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import time
+import json
+import zlib
+import struct
+import ctypes
+import argparse
+import shutil
+import tempfile
+import threading
+
+_basepath=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, _basepath + os.sep + "core")
+sys.path.insert(0, _basepath + os.sep + "app_desktop")
+
+import utils
+import sharedmem
+import desktop
+
+SCENARIOS=["static", "scrolltext", "video", "fullscreen", "damage"]
+FRAME_TYPES={"palette": 0, "tjpeg": 100}
+SCREEN_W=640
+SCREEN_H=360
+TOKEN_SIZE_MAX=64*1024
+DAMAGE_INTERVAL=0.5
+
+
+#CPU DEL THREAD CORRENTE (LINUX), SERVE PER ESCLUDERE IL MODULO NATIVO FINTO
+class _timespec(ctypes.Structure):
+    _fields_=[("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+_librt=None
+try:
+    _librt=ctypes.CDLL("librt.so.1")
+except:
+    None
+
+def thread_cpu():
+    if _librt is not None:
+        ts=_timespec()
+        if _librt.clock_gettime(3, ctypes.byref(ts))==0: #CLOCK_THREAD_CPUTIME_ID
+            return ts.tv_sec+ts.tv_nsec/1e9
+    return time.clock()
+
+def process_cpu():
+    t=os.times()
+    return t[0]+t[1]
+
+
+class FakeScreen():
+
+    #SCHERMI SCRIPTATI: RITORNA LA REGIONE CAMBIATA RISPETTO AL FRAME PRECEDENTE
+    def __init__(self, scenario):
+        self._scenario=scenario
+        self._frame=0
+        self._rowsize=SCREEN_W*3
+        if scenario=="scrolltext":
+            ar=bytearray()
+            glyph=bytearray("\xff\xff\xff"*6+"\x20\x20\x20"*2)
+            for r in range(SCREEN_H*2):
+                if (r % 16)<12:
+                    ln=(r*7) % SCREEN_W
+                    row=(glyph*(ln/8+1))[:ln*3]
+                    ar+=row+bytearray("\xff"*(self._rowsize-len(row)))
+                else:
+                    ar+=bytearray("\xff"*self._rowsize)
+            self._text=ar
+
+    def next_region(self):
+        self._frame+=1
+        if self._frame==1:
+            return bytearray(os.urandom(SCREEN_W*SCREEN_H*3))
+        if self._scenario=="static":
+            return None
+        elif self._scenario=="scrolltext":
+            p=((self._frame*4) % SCREEN_H)*self._rowsize
+            return self._text[p:p+SCREEN_H*self._rowsize]
+        elif self._scenario=="video" or self._scenario=="damage":
+            return bytearray(os.urandom(320*180*3))
+        elif self._scenario=="fullscreen":
+            return bytearray(os.urandom(SCREEN_W*SCREEN_H*3))
+
+
+class FakeNative():
+
+    #SOSTITUISCE LA LIBRERIA screencapture NEL CAPTURE PROCESS
+    #SCENARIO damage: IL MONITOR (CONDIVISO DALLE SESSIONI) CAMBIA OGNI DAMAGE_INTERVAL E damaged SEGUE IL CONTRATTO
+    #DELLA LIBRERIA: LE AREE DANNEGGIATE SONO AZZERATE DALLA PRIMA SESSIONE CHE CATTURA, LE ALTRE CONFRONTANO shotID
+    def __init__(self, scenario):
+        self._scenario=scenario
+        self._sessions={}
+        self._masks={}
+        self._shot_id=0
+        self._damage_time=0
+        self.cpu=0.0
+        self.frames=0
+        self.inputs=0
+        self.shots=0
+
+    def version(self):
+        if self._scenario=="damage":
+            return 2
+        return 1
+
+    def setCallbackDebug(self, cb):
+        None
+
+    def init(self, sid):
+        self._sessions[sid]={"screen": FakeScreen(self._scenario), "first": True, "shotID": -1}
+
+    def term(self, sid):
+        if sid in self._sessions:
+            del self._sessions[sid]
+
+    def monitor(self, sid, idx):
+        None
+
+    def _is_damage_pending(self):
+        return self._shot_id==0 or time.time()-self._damage_time>=DAMAGE_INTERVAL
+
+    def damaged(self, sid):
+        ses=self._sessions.get(sid)
+        if ses is None or ses["shotID"]==-1 or ses["shotID"]!=self._shot_id or self._is_damage_pending():
+            return 1
+        return 0
+
+    def inputMouse(self, *args):
+        self.inputs+=1
+
+    def inputKeyboard(self, *args):
+        self.inputs+=1
+
+    def _get_mask(self, qa):
+        if qa not in self._masks:
+            msk=(0xFF << ((9-qa)/2)) & 0xFF
+            self._masks[qa]=bytearray([b & msk for b in range(256)])
+        return self._masks[qa]
+
+    def _token(self, cb, bts):
+        buf=ctypes.create_string_buffer(str(bts), len(bts))
+        cb(len(bts), ctypes.cast(buf, ctypes.POINTER(ctypes.c_char)))
+
+    def difference(self, sid, tp, qa, cb):
+        tm=time.time()
+        cpu=thread_cpu()
+        ses=self._sessions[sid]
+        if ses["first"]:
+            ses["first"]=False
+            self._token(cb, struct.pack("!hhh", 0, SCREEN_W, SCREEN_H))
+            self._token(cb, struct.pack("!hh", 10, 1))
+            self._token(cb, struct.pack("!hhhh", 11, 2, FRAME_TYPES["tjpeg"], FRAME_TYPES["palette"]))
+        if self._scenario=="damage":
+            if self._is_damage_pending():
+                self._shot_id+=1
+                self._damage_time=tm
+                self.shots+=1
+            rgn=None
+            if ses["shotID"]!=self._shot_id:
+                ses["shotID"]=self._shot_id
+                rgn=ses["screen"].next_region()
+        else:
+            rgn=ses["screen"].next_region()
+        data=struct.pack("!d", tm)
+        if rgn is not None:
+            rgn=rgn.translate(self._get_mask(max(0, min(9, qa))))
+            if tp==FRAME_TYPES["tjpeg"]:
+                rgn=rgn[::max(1, 10-qa)]
+            data+=zlib.compress(str(rgn), 1)
+        p=0
+        while True:
+            ln=min(TOKEN_SIZE_MAX, len(data)-p)
+            blast=(p+ln==len(data))
+            self._token(cb, struct.pack("!hB", 2, 1 if blast else 0)+data[p:p+ln])
+            p+=ln
+            if blast:
+                break
+        self.frames+=1
+        self.cpu+=thread_cpu()-cpu
+
+
+class FakeAgentMain():
+
+    def __init__(self, config):
+        self._config=config
+        self._agent_debug_mode=False
+        self.errors=[]
+
+    def _get_config(self, key, default=None):
+        return self._config.get(key, default)
+
+    def write_info(self, msg):
+        None
+
+    def write_err(self, msg):
+        self.errors.append(msg)
+
+    def write_debug(self, msg):
+        None
+
+    def write_except(self, e, tx=u""):
+        self.errors.append(tx + str(e))
+
+    def get_app_permission(self, cinfo, name):
+        return {"fullAccess": True}
+
+    def has_app_permission(self, cinfo, name):
+        return True
+
+    def unload_lib(self, name):
+        None
+
+
+class FakeConnectionInfo():
+
+    def get_permissions(self):
+        return {"fullAccess": True}
+
+    def get_idsession(self):
+        return "bench"
+
+
+class FakeWebSocket():
+
+    #CLIENT SIMULATO: LINK CON BANDA E LATENZA, CONFERMA I FRAME CON frametime
+    #IL PRIMO FRAME (COMPLETO) E' ESCLUSO DALLE STATISTICHE
+    def __init__(self, bandwidth, latency, frame_type, quality):
+        self._bandwidth=bandwidth
+        self._latency=latency
+        self._frame_type=frame_type
+        self._quality=quality
+        self._semaphore=threading.Condition()
+        self._on_data=None
+        self._on_close=None
+        self._frame_ts=None
+        self._frame_num=None
+        self._bclose=False
+        self._first_frame=True
+        self.frames=0
+        self.bytes=0
+        self.latencies=[]
+
+    def get_properties(self):
+        return {}
+
+    def accept(self, priority, events):
+        self._on_data=events["on_data"]
+        self._on_close=events["on_close"]
+
+    def _send_data(self, prop):
+        if not self._bclose:
+            self._on_data(self, "text", utils.Bytes(json.dumps(prop)))
+
+    def send_bytes(self, bts):
+        self._semaphore.acquire()
+        try:
+            if self._bclose:
+                raise Exception("WebSocket closed.")
+            if self._bandwidth>0:
+                time.sleep(float(len(bts))/self._bandwidth)
+            self.bytes+=len(bts)
+        finally:
+            self._semaphore.release()
+        tp=bts.unpack_from("!h", 0)[0]
+        if tp==11:
+            prop={"monitor": "0", "acceptFrameType": str(self._frame_type)}
+            if self._quality is not None:
+                prop["quality"]=str(self._quality)
+            self._send_data(prop)
+        elif tp==800:
+            self._frame_num=bts.new_buffer(2).to_str()
+        elif tp==2:
+            if self._frame_ts is None:
+                self._frame_ts=bts.unpack_from("!d", 3)[0]
+            if bts[2]==1:
+                if self._first_frame:
+                    self._first_frame=False
+                    self.bytes=0
+                else:
+                    self.frames+=1
+                    self.latencies.append(time.time()+self._latency/2.0-self._frame_ts)
+                self._frame_ts=None
+                if self._frame_num is not None:
+                    tm=threading.Timer(self._latency, self._send_data, [{"frametime": self._frame_num}])
+                    tm.daemon=True
+                    tm.start()
+                    self._frame_num=None
+
+    def close(self):
+        self._bclose=True
+
+
+class BenchCaptureProcess(desktop.CaptureProcess):
+
+    #IL CAPTURE PROCESS GIRA IN UN THREAD CON IL MODULO NATIVO FINTO
+    def __init__(self, agent_main, native):
+        desktop.CaptureProcess.__init__(self, agent_main)
+        self._native=native
+        self._child=None
+        self._child_thread=None
+
+    def _init_process(self):
+        if self._bdestroy:
+            raise Exception("Process destroyed.")
+        if self._sharedmem is None:
+            self._sharedmem=sharedmem.Stream()
+            fname=self._sharedmem.create()
+            self._child=desktop.CaptureProcess(None)
+            self._child._osmodule=self._native
+            desktop._libmap["captureprocess"]=self._child
+            self._child_thread=threading.Thread(target=self._child.listen, args=(fname, "False"), name="BenchCaptureChild")
+            self._child_thread.daemon=True
+            self._child_thread.start()
+
+    def join_child(self, timeout):
+        if self._child_thread is not None:
+            self._child_thread.join(timeout)
+
+
+def run_bench(scenario, frame_type, quality, duration, bandwidth, latency, config, viewers=1):
+    native=FakeNative(scenario)
+    agent_main=FakeAgentMain(config)
+    dsk=desktop.Desktop(agent_main)
+    lstcp=[]
+    def new_capture_process():
+        cp=BenchCaptureProcess(agent_main, native)
+        lstcp.append(cp)
+        return cp
+    dsk._new_capture_process=new_capture_process
+    #GLI ALTRI VIEWER USANO UNA QUALITA' DIVERSA: SESSIONI NATIVE SEPARATE SULLO STESSO MONITOR
+    arws=[]
+    for i in range(viewers):
+        arws.append(FakeWebSocket(bandwidth, latency, FRAME_TYPES[frame_type], quality if i==0 else (quality+i) % 10))
+    ws=arws[0]
+    cpu=process_cpu()
+    tm=time.time()
+    ardm=[dsk._add_desktop_manager(FakeConnectionInfo(), appws) for appws in arws]
+    time.sleep(duration)
+    for dm in ardm:
+        dm.terminate()
+    for dm in ardm:
+        dm.join(10)
+        for th in [dm._pipeline_sender, dm._input_thread]:
+            if th is not None:
+                th.join(5)
+    elapsed=time.time()-tm
+    cpu=process_cpu()-cpu
+    for cp in lstcp:
+        cp.join_child(5)
+
+    ret={"scenario": scenario, "frameType": frame_type, "quality": quality, "frames": ws.frames}
+    ret["fps"]=round(ws.frames/elapsed, 2)
+    ret["bytesPerFrame"]=0
+    ret["latencyAvgMs"]=0
+    ret["latencyP95Ms"]=0
+    ret["agentCpuMsPerFrame"]=0
+    if ws.frames>0:
+        ret["bytesPerFrame"]=int(ws.bytes/ws.frames)
+        lat=sorted(ws.latencies)
+        ret["latencyAvgMs"]=round(sum(lat)*1000.0/len(lat), 2)
+        ret["latencyP95Ms"]=round(lat[int(len(lat)*0.95)]*1000.0, 2)
+        ret["agentCpuMsPerFrame"]=round((cpu-native.cpu)*1000.0/ws.frames, 3)
+    if scenario=="damage":
+        #OGNI VIEWER DEVE RICEVERE TUTTI I FRAME CATTURATI (IL PRIMO E' ESCLUSO, L'ULTIMO PUO' ESSERE IN VOLO)
+        ret["shots"]=native.shots
+        ret["viewerFrames"]=[appws.frames for appws in arws]
+        ret["staleViewers"]=len([appws for appws in arws if appws.frames<native.shots-2])
+    ret["errors"]=agent_main.errors
+    return ret
+
+
+def main(args):
+    prs=argparse.ArgumentParser(description="Desktop streaming benchmark (fake native module, headless).")
+    prs.add_argument("--scenario", action="append", choices=SCENARIOS)
+    prs.add_argument("--frametype", action="append", choices=sorted(FRAME_TYPES.keys()))
+    prs.add_argument("--quality", action="append", type=int)
+    prs.add_argument("--duration", type=float, default=5.0)
+    prs.add_argument("--bandwidth", type=float, default=0, help="bytes/s (0=unlimited)")
+    prs.add_argument("--latency", type=float, default=20, help="round trip ms")
+    prs.add_argument("--viewers", type=int, help="viewers on the same monitor (default 2 for damage, 1 otherwise)")
+    prs.add_argument("--config", action="append", default=[], help="agent config key=json value")
+    prs.add_argument("--json", action="store_true")
+    opts=prs.parse_args(args)
+    config={}
+    for itm in opts.config:
+        k, v = itm.split("=", 1)
+        config[k]=json.loads(v)
+
+    #I FILE DELLO STREAM SU DISCO VANNO IN UNA CARTELLA TEMPORANEA (RIMOSSA AL TERMINE)
+    oldpath=os.getcwd()
+    tmppath=tempfile.mkdtemp(prefix="bench_desktop_")
+    os.chdir(tmppath)
+    try:
+        sharedmem.init_path()
+
+        arret=[]
+        for scenario in opts.scenario or SCENARIOS:
+            for frame_type in opts.frametype or ["palette", "tjpeg"]:
+                for quality in opts.quality or [3, 6, 9]:
+                    viewers=opts.viewers
+                    if viewers is None:
+                        viewers=2 if scenario=="damage" else 1
+                    ret=run_bench(scenario, frame_type, quality, opts.duration, opts.bandwidth, opts.latency/1000.0, config, viewers)
+                    arret.append(ret)
+                    if not opts.json:
+                        print("%-10s %-7s qa=%d  fps=%7.2f  bytes/frame=%9d  latency avg=%8.2fms p95=%8.2fms  agent cpu/frame=%7.3fms%s%s" % (
+                              scenario, frame_type, quality, ret["fps"], ret["bytesPerFrame"], ret["latencyAvgMs"], ret["latencyP95Ms"],
+                              ret["agentCpuMsPerFrame"],
+                              "  shots=%d viewer frames=%s STALE=%d" % (ret["shots"], ret["viewerFrames"], ret["staleViewers"]) if "shots" in ret else "",
+                              "  ERRORS=" + str(len(ret["errors"])) if len(ret["errors"])>0 else ""))
+                        sys.stdout.flush()
+    finally:
+        os.chdir(oldpath)
+        shutil.rmtree(tmppath, True)
+    if opts.json:
+        print(json.dumps(arret, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import unittest
+
+_basepath=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, _basepath + os.sep + "core")
+sys.path.insert(0, _basepath + os.sep + "app_desktop")
+
+import agent
+import desktop
+
+
+def mv(x, y, btn=-1, whl=0, ctrl=False):
+    return ("MOUSE", x, y, btn, whl, ctrl, False, False, False)
+
+def key(code):
+    return ("KEYBOARD", "CHAR", code, False, False, False, False)
+
+
+#(NOME, LINUX, STATO PULSANTI INIZIALE, EVENTI, RISULTATO, STATO PULSANTI FINALE)
+COALESCE_TESTS=[
+    ("moves", False, 0,
+        [mv(1, 1), mv(2, 2), mv(3, 3)],
+        [mv(3, 3)], 0),
+    ("move before down", False, 0,
+        [mv(1, 1), mv(5, 5, 1)],
+        [mv(5, 5, 1)], 1),
+    ("move after down", False, 0,
+        [mv(5, 5, 1), mv(6, 6), mv(7, 7)],
+        [mv(5, 5, 1), mv(7, 7)], 1),
+    ("drag", False, 0,
+        [mv(1, 1, 1), mv(2, 2, 1), mv(3, 3, 1), mv(4, 4, 0), mv(5, 5)],
+        [mv(1, 1, 1), mv(4, 4, 0), mv(5, 5)], 0),
+    ("click clears state", False, 0,
+        [mv(1, 1, 1), mv(1, 1, 0), mv(1, 1, 1), mv(1, 1, 0)],
+        [mv(1, 1, 1), mv(1, 1, 0), mv(1, 1, 1), mv(1, 1, 0)], 0),
+    ("right button", False, 0,
+        [mv(1, 1), mv(2, 2, 2), mv(3, 3), mv(3, 3, 0)],
+        [mv(2, 2, 2), mv(3, 3, 0)], 0),
+    ("click events do not change state", False, 0,
+        [mv(1, 1), mv(2, 2, 64), mv(3, 3), mv(4, 4, 128), mv(5, 5)],
+        [mv(2, 2, 64), mv(4, 4, 128), mv(5, 5)], 0),
+    ("wheel same sign", False, 0,
+        [mv(1, 1, -1, 1), mv(1, 1, -1, 2), mv(2, 2, -1, 1)],
+        [mv(2, 2, -1, 4)], 0),
+    ("wheel same sign linux", True, 0,
+        [mv(1, 1, -1, 1), mv(1, 1, -1, 2), mv(2, 2, -1, 1)],
+        [mv(1, 1, -1, 1), mv(1, 1, -1, 2), mv(2, 2, -1, 1)], 0),
+    ("wheel negative", False, 0,
+        [mv(1, 1, -1, -1), mv(1, 1, -1, -3)],
+        [mv(1, 1, -1, -4)], 0),
+    ("wheel opposite sign", False, 0,
+        [mv(1, 1, -1, 1), mv(1, 1, -1, -1), mv(1, 1, -1, -1)],
+        [mv(1, 1, -1, 1), mv(1, 1, -1, -2)], 0),
+    ("move before wheel", False, 0,
+        [mv(1, 1), mv(2, 2, -1, 1)],
+        [mv(2, 2, -1, 1)], 0),
+    ("move before wheel linux", True, 0,
+        [mv(1, 1), mv(2, 2, -1, 1)],
+        [mv(2, 2, -1, 1)], 0),
+    ("move after wheel", False, 0,
+        [mv(1, 1, -1, 1), mv(2, 2)],
+        [mv(1, 1, -1, 1), mv(2, 2)], 0),
+    ("wheel while pressed", False, 1,
+        [mv(1, 1, 1, 1), mv(1, 1, 1, 1)],
+        [mv(1, 1, 1, 2)], 1),
+    ("wheel with button change", False, 0,
+        [mv(1, 1, -1, 1), mv(1, 1, 1, 1)],
+        [mv(1, 1, -1, 1), mv(1, 1, 1, 1)], 1),
+    ("modifiers differ", False, 0,
+        [mv(1, 1), mv(2, 2, ctrl=True), mv(3, 3, ctrl=True)],
+        [mv(1, 1), mv(3, 3, ctrl=True)], 0),
+    ("keyboard keeps order", False, 0,
+        [mv(1, 1), key("a"), mv(2, 2), mv(3, 3), key("b"), mv(4, 4)],
+        [mv(1, 1), key("a"), mv(3, 3), key("b"), mv(4, 4)], 0),
+    ("no position", False, 0,
+        [mv(1, 1), mv(-1, -1), mv(-1, 5)],
+        [mv(1, 1), mv(-1, -1), mv(-1, 5)], 0),
+    ("state from previous batch", False, 1,
+        [mv(1, 1, 1), mv(2, 2, 1)],
+        [mv(2, 2, 1)], 1),
+    ("empty", False, 0,
+        [],
+        [], 0),
+]
+
+
+class TestInputCoalesce(unittest.TestCase):
+
+    def setUp(self):
+        self._is_linux=agent.is_linux
+
+    def tearDown(self):
+        agent.is_linux=self._is_linux
+
+    def _new_manager(self, st):
+        dm=desktop.Manager.__new__(desktop.Manager)
+        dm._input_btn_state=st
+        return dm
+
+    def test_table(self):
+        for name, linux, st, events, expected, stend in COALESCE_TESTS:
+            agent.is_linux=lambda: linux
+            dm=self._new_manager(st)
+            self.assertEqual(dm._inputevents_coalesce(events), expected, name)
+            self.assertEqual(dm._input_btn_state, stend, name)
+
+    def test_batches(self):
+        #LO STATO DEI PULSANTI PASSA DA UN BLOCCO AL SUCCESSIVO
+        agent.is_linux=lambda: False
+        dm=self._new_manager(0)
+        self.assertEqual(dm._inputevents_coalesce([mv(1, 1), mv(2, 2, 1)]), [mv(2, 2, 1)])
+        self.assertEqual(dm._inputevents_coalesce([mv(3, 3, 1), mv(4, 4, 1)]), [mv(4, 4, 1)])
+        self.assertEqual(dm._inputevents_coalesce([mv(5, 5, 0)]), [mv(5, 5, 0)])
+        self.assertEqual(dm._inputevents_coalesce([mv(6, 6, 1), mv(6, 6, 0)]), [mv(6, 6, 1), mv(6, 6, 0)])
+        self.assertEqual(dm._input_btn_state, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
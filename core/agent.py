@@ -30,8 +30,11 @@ import importlib
 import urllib
 import applications
 import struct
+import collections
+import heapq
 import utils
 import mimetypes
+import email.utils
 import detectinfo
 import native
 
@@ -200,6 +203,10 @@ class Agent():
         self._agent_log_semaphore = threading.Condition()
         self._connections_semaphore = threading.Condition()
         self._libs_apps_semaphore = threading.Condition()
+        self._path_upload_partials='uploadpartials.json'
+        self._upload_partials_semaphore=threading.Condition()
+        self._upload_partials=None
+        self._upload_partials_active={}
         self._agent_enabled = True
         self._agent_missauth = False
         self._agent_status = self._STATUS_OFFLINE
@@ -1065,7 +1072,9 @@ class Agent():
             utils.path_makedirs("native")
                 
         #Crea taskpool
-        self._task_pool = communication.ThreadPool("Task", 50, 30, self.write_except)
+        self._task_pool = communication.ThreadPool("Task", self._get_config('task_pool_queue_size', 500), 
+                                                   self._get_config('task_pool_core_size', 10), self.write_except, 
+                                                   self._get_config('task_pool_max_size', 150))
         
         #Avvia agent status
         if not self._runonfly:
@@ -1100,8 +1109,13 @@ class Agent():
                                 if not self._debug_path.endswith(utils.path_sep):
                                     self._debug_path+=utils.path_sep
                                 threading.setprofile(self._debug_func)
-                            
-                            
+                            #CARICA IO MODE
+                            try:
+                                communication.set_io_mode(self._get_config('io_mode',None))
+                            except Exception as e:
+                                self.write_except(e, "INIT IO MODE: ")
+                            self.write_info("IO mode: " + communication.get_io_mode())
+
                         
                 
                 #Avvia il listener (PER USI FUTURI)
@@ -1148,7 +1162,8 @@ class Agent():
                         self._runonfly_conn_retry+=1
                         self._update_onfly_status("WAIT:" + str(self._runonfly_conn_retry))
             time.sleep(1)
-        self._task_pool.destroy()
+        if not self._task_pool.destroy(5):
+            self.write_info("Task pool: some tasks still running at shutdown.")
         self._task_pool = None
         
         if self._httpserver is not None:
@@ -1319,6 +1334,117 @@ class Agent():
             except Exception as e:
                 self.write_except(e)
     
+    def _load_upload_partials(self):
+        if self._upload_partials is None:
+            self._upload_partials={}
+            try:
+                if utils.path_exists(self._path_upload_partials):
+                    f = utils.file_open(self._path_upload_partials)
+                    try:
+                        self._upload_partials = json.loads(f.read())
+                    finally:
+                        f.close()
+            except Exception as e:
+                self.write_err("Error reading upload partials file: " + utils.exception_to_string(e))
+        return self._upload_partials
+    
+    def _save_upload_partials(self):
+        try:
+            s = json.dumps(self._upload_partials, sort_keys=True, indent=1)
+            f = utils.file_open(self._path_upload_partials, 'wb')
+            try:
+                f.write(s)
+            finally:
+                f.close()
+        except Exception as e:
+            self.write_err("Error writing upload partials file: " + utils.exception_to_string(e))
+    
+    def _is_upload_partial_expired(self, itm):
+        return time.time()-itm["time"]>self._get_config('upload_partial_ttl', 24*60*60)
+    
+    def _acquire_upload_partial(self, key, upl):
+        #RITORNA IL FILE PARZIALE (None SE NON ESISTE O E' SCADUTO) E L'EVENTUALE UPLOAD ATTIVO DA CHIUDERE
+        self._upload_partials_semaphore.acquire()
+        try:
+            prts=self._load_upload_partials()
+            uold=None
+            if key in self._upload_partials_active:
+                uold=self._upload_partials_active[key]
+            self._upload_partials_active[key]=upl
+            if key in prts:
+                itm=prts[key]
+                if uold is not None or (not self._is_upload_partial_expired(itm) and utils.path_exists(itm["path"])):
+                    return (itm["path"], uold)
+                try:
+                    if utils.path_exists(itm["path"]):
+                        utils.path_remove(itm["path"])
+                except:
+                    None
+                del prts[key]
+                self._save_upload_partials()
+            return (None, uold)
+        finally:
+            self._upload_partials_semaphore.release()
+    
+    def _set_upload_partial(self, key, tmpname):
+        self._upload_partials_semaphore.acquire()
+        try:
+            prts=self._load_upload_partials()
+            prts[key]={"path": tmpname, "time": time.time()}
+            self._save_upload_partials()
+        finally:
+            self._upload_partials_semaphore.release()
+    
+    def _release_upload_partial(self, key, upl, tmpname):
+        #IL FILE PARZIALE VIENE MANTENUTO PER LA RIPRESA
+        self._upload_partials_semaphore.acquire()
+        try:
+            if key in self._upload_partials_active and self._upload_partials_active[key] is upl:
+                del self._upload_partials_active[key]
+            self._set_upload_partial(key, tmpname)
+        finally:
+            self._upload_partials_semaphore.release()
+    
+    def _remove_upload_partial(self, key, upl):
+        self._upload_partials_semaphore.acquire()
+        try:
+            if key in self._upload_partials_active:
+                if self._upload_partials_active[key] is not upl:
+                    return
+                del self._upload_partials_active[key]
+            prts=self._load_upload_partials()
+            if key in prts:
+                del prts[key]
+                self._save_upload_partials()
+        finally:
+            self._upload_partials_semaphore.release()
+    
+    def _clean_upload_partials(self,binit):
+        if binit:
+            self._upload_partials_checkcnt=communication.Counter(10*60*1000) #10 MINUTES
+        elif not self._upload_partials_checkcnt.is_elapsed():
+            return
+        self._upload_partials_checkcnt.reset()
+        self._upload_partials_semaphore.acquire()
+        try:
+            prts=self._load_upload_partials()
+            bsave=False
+            for key in prts.keys():
+                if key not in self._upload_partials_active and self._is_upload_partial_expired(prts[key]):
+                    try:
+                        if utils.path_exists(prts[key]["path"]):
+                            utils.path_remove(prts[key]["path"])
+                    except Exception as e:
+                        self.write_except(e)
+                    del prts[key]
+                    bsave=True
+            if bsave:
+                self._save_upload_partials()
+        except Exception as e:
+            self.write_except(e)
+        finally:
+            self._upload_partials_semaphore.release()
+    
     def _run_agent(self):
         self.write_info("Initializing agent (key: " + self._agent_key + ", node: " + self._agent_server + ")..." )
         try:
@@ -1345,6 +1471,7 @@ class Agent():
             #ready agent
             self._suppapps=";".join(self.get_supported_applications())
             self._update_supported_apps(True)
+            self._clean_upload_partials(True)
             m = {
                     'name':  'ready', 
                     'osType':  get_os_type(),
@@ -1381,6 +1508,7 @@ class Agent():
                 if not self._check_reloads():
                     break;                
                 self._update_supported_apps(False)
+                self._clean_upload_partials(False)
 
             if self._runonfly:
                 self._runonfly_user=None
@@ -1821,8 +1949,14 @@ class Connection():
     def get_id(self):
         return self._id
     
-    def send(self,data):
-        self._raw.send(data)        
+    def send(self,data,p=0,ln=None):
+        self._raw.send(data,p,ln)
+    
+    def send_frames(self,ardata):
+        self._raw.send_frames(ardata)
+    
+    def is_secure(self):
+        return self._raw.is_secure()
     
     def set_events(self,evts):
         if evts is None:
@@ -1961,18 +2095,72 @@ class Connection():
         self._raw.close()
         
 
+class RecoveryBuffer():
+    #NON SINCRONIZZATO: USATO SOTTO IL SEMAFORO DELLA CONNESSIONE
+    
+    def __init__(self, size_max):
+        self._size_max=size_max
+        self._items=collections.OrderedDict()
+        self._heap=[]
+        self._size=0
+        self._dropped=0
+        self._resent=0
+    
+    def add(self, rc, data):
+        if rc in self._items:
+            self._size-=len(self._items[rc])
+        else:
+            heapq.heappush(self._heap, rc)
+        self._items[rc]=data
+        self._size+=len(data)
+        #LIMITE IN BYTE: SCARTA LE RISPOSTE PIU' VECCHIE
+        while self._size_max>0 and self._size>self._size_max and len(self._items)>1:
+            orc, odata = self._items.popitem(last=False)
+            self._size-=len(odata)
+            self._dropped+=1
+    
+    def trim(self, rc):
+        #RIMUOVE LE RISPOSTE CONFERMATE (requestCount<=rc)
+        while len(self._heap)>0 and self._heap[0]<=rc:
+            orc=heapq.heappop(self._heap)
+            if orc in self._items:
+                self._size-=len(self._items.pop(orc))
+        if len(self._heap)>2*len(self._items)+64:
+            self._heap=list(self._items.keys())
+            heapq.heapify(self._heap)
+    
+    def get_all(self):
+        ar=self._items.values()
+        self._resent+=len(ar)
+        return ar
+    
+    def get_metrics(self):
+        return {"count": len(self._items), "bytes": self._size, "bytesMax": self._size_max, "dropped": self._dropped, "resent": self._resent}
+
+
 class Message():
+    _SIZE_MAX = 64*1024*1024
+    _RECOVERY_SIZE_MAX = 16*1024*1024
+    _COMPRESS_THRESHOLD = 512
+    _COMPRESS_BPS_FAST = 2*1024*1024
+    _COMPRESS_BPS_SLOW = 64*1024
     
     def __init__(self, agent, conn):
         self._agent=agent
-        self._temp_msg={"length":0, "read":0, "data":utils.Bytes()}
+        self._size_max=agent._get_config('message_size_max', Message._SIZE_MAX)
+        self._compress_threshold=agent._get_config('message_compress_threshold', Message._COMPRESS_THRESHOLD)
+        self._compress_level=agent._get_config('message_compress_level', None)
+        self._temp_msg={"length":0, "read":0, "header":utils.Bytes(), "discard":False, "data":utils.ZlibDecompressor(self._size_max)}
         self._conn=conn
         self._conn.set_events({"on_close" : self._on_close, "on_data" : self._on_data, "on_recovery": self._on_recovery})
         self._conn._allow_recovery=True
         self._bwsendcalc=communication.BandwidthCalculator()
+        self._send_scheduler=communication.SendScheduler()
+        self._send_channel=self._send_scheduler.new_channel(communication.PRIORITY_NORMAL)
+        self._fire_priority=communication.PRIORITY_NORMAL
         self._lastacttm=time.time()
         self._lastreqcnt=0l
-        self._send_response_recovery=[]
+        self._send_response_recovery=RecoveryBuffer(agent._get_config('recovery_buffer_size_max', Message._RECOVERY_SIZE_MAX))
             
     def get_last_activity_time(self):
         return self._lastacttm
@@ -1987,13 +2175,28 @@ class Message():
             self._conn._semaphore.acquire()
             try:
                 if self._temp_msg["length"]==0:
-                    self._temp_msg["length"] = struct.unpack("!I",data[p:p+4])[0]
-                    p+=4
+                    #LA LUNGHEZZA PUO' ESSERE DIVISA TRA DUE FRAME
+                    hd=self._temp_msg["header"]
+                    c=min(4-len(hd),len(data)-p)
+                    hd.append_bytes(data.new_buffer(p,c))
+                    p+=c
+                    if len(hd)<4:
+                        break
+                    self._temp_msg["length"] = struct.unpack("!I",hd[0:4])[0]
+                    self._temp_msg["header"]=utils.Bytes()
+                    if self._size_max>0 and self._temp_msg["length"]>self._size_max:
+                        self._temp_msg["discard"]=True
+                        self._agent.write_err("Message discarded: size exceeds the limit of " + str(self._size_max) + " bytes.")
                 c=self._temp_msg["length"]-self._temp_msg["read"]
                 rms=len(data)-p
                 if rms<c:
                     c=rms
-                self._temp_msg["data"].append_bytes(data.new_buffer(p,c))
+                if not self._temp_msg["discard"]:
+                    try:
+                        self._temp_msg["data"].decompress(data,p,c)
+                    except Exception as e:
+                        self._temp_msg["discard"]=True
+                        self._agent.write_except(e)
                 self._temp_msg["read"]+=c            
                 p=p+c
                 if self._temp_msg["read"]==self._temp_msg["length"]:
@@ -2002,10 +2205,11 @@ class Message():
                 self._conn._semaphore.release()
             if dt is not None:
                 try:
-                    dt.decompress_zlib()
-                    msg=json.loads(dt.to_str("utf8"))                    
-                    if self._check_recovery_msg(msg):
-                        self._agent._task_pool.execute(self._fire_msg, msg)
+                    if not self._temp_msg["discard"]:
+                        dt.flush()
+                        msg=json.loads(dt.to_str("utf8"))                    
+                        if self._check_recovery_msg(msg):
+                            self._agent._task_pool.execute_priority(self._fire_priority, self._fire_msg, msg)
                 except Exception as e:
                     self._agent.write_except(e)
                 finally:
@@ -2030,20 +2234,14 @@ class Message():
                 cntRequestReceived=msg["cntRequestReceived"];
                 self._conn._semaphore.acquire()
                 try:
-                    appar=[]
-                    for o in self._send_response_recovery: 
-                        if o["requestCount"]>cntRequestReceived:
-                            appar.append(o)
-                    self._send_response_recovery=appar
+                    self._send_response_recovery.trim(cntRequestReceived)
                 finally:
                     self._conn._semaphore.release()
             if "status" in msg and msg["status"]=="end":
                 appar=[]
                 self._conn._semaphore.acquire()
                 try:                    
-                    appar=[]
-                    for o in self._send_response_recovery: 
-                        appar.append(o)
+                    appar=self._send_response_recovery.get_all()
                 finally:
                     self._conn._semaphore.release()
                 if len(appar)>0:
@@ -2058,8 +2256,15 @@ class Message():
         return True
     
     def _send_message_recovery(self,ar):
-        for msg in ar:
-            self.send_message(msg)
+        for appm in ar:
+            self._send_encoded(appm)
+    
+    def get_recovery_metrics(self):
+        self._conn._semaphore.acquire()
+        try:
+            return self._send_response_recovery.get_metrics()
+        finally:
+            self._conn._semaphore.release()
     
     def _on_data(self,data):
         self._set_last_activity_time()
@@ -2070,7 +2275,9 @@ class Message():
         try:
             self._temp_msg["length"]=0
             self._temp_msg["read"]=0
-            self._temp_msg["data"]=utils.Bytes()
+            self._temp_msg["header"]=utils.Bytes()
+            self._temp_msg["discard"]=False
+            self._temp_msg["data"].reset()
         finally:
             self._conn._semaphore.release()
             
@@ -2080,37 +2287,87 @@ class Message():
     def _fire_msg(self, msg):
         None
     
-    def _send_conn(self,conn,data):
-        pos=0
-        tosnd=len(data)
+    def new_send_channel(self, priority, props=None):
+        if priority is None:
+            priority=communication.PRIORITY_NORMAL
+        appnm=None
+        rate=0
+        if props is not None and "module" in props:
+            appnm=props["module"]
+            apprates=self._agent._get_config('send_rate_apps', None)
+            if apprates is not None and appnm in apprates:
+                rate=apprates[appnm]
+        return self._send_scheduler.new_channel(priority, appnm, rate)
+    
+    def get_send_queue_depth(self):
+        return self._send_scheduler.get_queue_depth()
+    
+    def _send_conn(self,conn,data,chl=None,p=0,ln=None,frmsz=None):
+        if chl is None:
+            chl=self._send_channel
+        btsz = chl.get_batch_size()
+        if frmsz is not None and btsz>=communication.SEND_BATCH_SIZE:
+            #FRAME GRANDI: SE PIU' GRANDE DEL BUFFER DI INVIO DELLA CONNESSIONE IL PAYLOAD NON VIENE COPIATO
+            bfsz = frmsz
+        else:
+            bfsz = communication.calculate_buffer_size(self._bwsendcalc.get_bps())
+            if bfsz>btsz:
+                bfsz=btsz
+        pos=p
+        if ln is None:
+            ln=len(data)-p
+        tosnd=ln
         while tosnd>0:
-            bps = self._bwsendcalc.get_bps()
-            bfsz = communication.calculate_buffer_size(bps)
-            if bfsz is None:
-                bfsz=self._conn.get_send_buffer_size()
-            if bfsz>=tosnd:
-                conn.send(data.new_buffer(pos,tosnd))
-                self._bwsendcalc.add(tosnd)
-                tosnd=0                
-            else:
-                conn.send(data.new_buffer(pos,bfsz))
-                self._bwsendcalc.add(bfsz)
-                tosnd-=bfsz
-                pos+=bfsz
+            #I FRAME SONO RIFERIMENTI A DATA (NESSUNA COPIA) E VENGONO INVIATI A GRUPPI
+            arfrm=[]
+            frmsz=0
+            while tosnd>0 and frmsz<btsz:
+                sz=min(bfsz,tosnd)
+                arfrm.append((data,pos,sz))
+                frmsz+=sz
+                tosnd-=sz
+                pos+=sz
+            chl.acquire(frmsz)
+            try:
+                conn.send_frames(arfrm)
+            finally:
+                chl.release(frmsz)
+            self._bwsendcalc.add(frmsz)
 
     
-    def send_message(self,msg):
+    def _get_compress_level(self,ln):
+        #SOTTO SOGLIA SOLO STORED (IL NODO DECOMPRIME SEMPRE)
+        if ln<self._compress_threshold:
+            return 0
+        if self._compress_level is not None:
+            return self._compress_level
+        bps=self._bwsendcalc.get_bps()
+        if bps==0:
+            return zlib.Z_DEFAULT_COMPRESSION
+        elif bps>=Message._COMPRESS_BPS_FAST:
+            return 1
+        elif bps<=Message._COMPRESS_BPS_SLOW:
+            return 9
+        return zlib.Z_DEFAULT_COMPRESSION
+    
+    def _encode_message(self,msg):
+        appm=utils.Bytes()
+        appm.append_str(json.dumps(msg), "utf8")
+        appm.compress_zlib(self._get_compress_level(len(appm)))
+        appm.insert_int(0, len(appm))
+        return appm
+    
+    def _send_encoded(self,appm):
         while True:
             try:
-                appm=utils.Bytes()
-                appm.append_str(json.dumps(msg), "utf8")
-                appm.compress_zlib()
-                appm.insert_int(0, len(appm))
                 self._send_conn(self._conn, appm)
                 break
             except Exception as e:                
                 if not self._conn.wait_recovery():
                     raise e
+    
+    def send_message(self,msg):
+        self._send_encoded(self._encode_message(msg))
            
     def send_response(self,msg,resp):
         m = {
@@ -2124,12 +2381,16 @@ class Message():
             m["command"] = msg["command"]
         if "requestCount" in msg:
             m["requestCount"] = msg["requestCount"]
+            #LA RISPOSTA CODIFICATA VIENE RIUSATA PER IL RECOVERY
+            appm=self._encode_message(m)
             self._conn._semaphore.acquire()
             try:
-                self._send_response_recovery.append(m)
+                self._send_response_recovery.add(m["requestCount"], appm)
             finally:
                 self._conn._semaphore.release()        
-        self.send_message(m)    
+            self._send_encoded(appm)
+        else:
+            self.send_message(m)    
     
     def is_close(self):
         return self._conn.is_close()
@@ -2144,6 +2405,8 @@ class MainMessage(Message):
     
     def __init__(self, agent, conn):
         Message.__init__(self, agent, conn)
+        #openSession/openConnection NON DEVONO ATTENDERE LE RICHIESTE DELLE SESSIONI
+        self._fire_priority=communication.PRIORITY_INTERACTIVE
     
     def _fire_msg(self, msg):
         try:
@@ -2211,9 +2474,12 @@ class Session(Message):
     
     def __init__(self, agent, conn, idses, perms):
         Message.__init__(self, agent, conn)
+        self._send_scheduler.set_rate(agent._get_config('send_rate_session', 0))
         self._bclose = False
         self._idsession= idses
         self._permissions = perms
+        self._download_stripes_semaphore = threading.Condition()
+        self._download_stripes = {}
 
     def get_idsession(self):
         return self._idsession
@@ -2342,7 +2608,19 @@ class Session(Message):
                 #ret["Cache-Control"] = "no-cache, must-revalidate" NON FUNZIONA PER IE7
                 #ret["Pragma"] = "no-cache"
                 resp["Expires"] = "Sat, 26 Jul 1997 05:00:00 GMT"
-                resp["Length"] = str(fdownload.get_length())
+                resp["Accept-Ranges"] = "bytes"
+                resp["ETag"] = fdownload.get_etag()
+                resp["Last-Modified"] = fdownload.get_last_modified()
+                if fdownload.is_partial():
+                    rng = fdownload.get_range()
+                    if rng[1]>rng[0]:
+                        resp["Content-Range"] = "bytes " + str(rng[0]) + "-" + str(rng[1]-1) + "/" + str(fdownload.get_length())
+                    else:
+                        resp["Content-Range"] = "bytes */" + str(fdownload.get_length())
+                stp = fdownload.get_stripe()
+                if stp is not None:
+                    resp["Stripe"] = str(stp[0]) + "/" + str(stp[1])
+                resp["Length"] = str(fdownload.get_range_length())
             else:
                 raise Exception("Download file not accepted")
         except Exception as e:
@@ -2355,6 +2633,48 @@ class Session(Message):
         resp['requestKey']=msg['requestKey']
         return resp
     
+    def _download_stripe_register(self, sid, idx, cnt, etag):
+        #TUTTE LE CONNESSIONI DELLO STESSO DOWNLOAD DEVONO LEGGERE LA STESSA VERSIONE DEL FILE
+        #L'ETAG RESTA REGISTRATO FINO AL COMPLETAMENTO DI TUTTI GLI INDICI (O FINO A download_stripe_ttl SENZA CONNESSIONI)
+        self._download_stripes_semaphore.acquire()
+        try:
+            tm=time.time()
+            ttl=self._agent._get_config('download_stripe_ttl', Download.STRIPE_TTL)
+            for k in self._download_stripes.keys():
+                stp=self._download_stripes[k]
+                if len(stp["active"])==0 and (tm-stp["time"]>ttl or tm<stp["time"]):
+                    del self._download_stripes[k]
+            if sid in self._download_stripes:
+                stp=self._download_stripes[sid]
+                if stp["count"]!=cnt:
+                    raise Exception("Download stripe count not valid.")
+                if stp["etag"]!=etag:
+                    raise Exception("Download stripe file changed.")
+                if idx in stp["active"] or idx in stp["done"]:
+                    raise Exception("Download stripe already requested.")
+            else:
+                stp={"count":cnt, "etag":etag, "active":set(), "done":set()}
+                self._download_stripes[sid]=stp
+            stp["active"].add(idx)
+            stp["time"]=tm
+        finally:
+            self._download_stripes_semaphore.release()
+    
+    def _download_stripe_unregister(self, sid, idx, bdone):
+        #UNO STRIPE NON COMPLETATO PUO' ESSERE RICHIESTO DI NUOVO
+        self._download_stripes_semaphore.acquire()
+        try:
+            if sid in self._download_stripes:
+                stp=self._download_stripes[sid]
+                stp["active"].discard(idx)
+                if bdone:
+                    stp["done"].add(idx)
+                stp["time"]=time.time()
+                if len(stp["done"])>=stp["count"]:
+                    del self._download_stripes[sid]
+        finally:
+            self._download_stripes_semaphore.release()
+    
     def _upload(self, msg):
         rid=msg["idRaw"]
         fupload = None
@@ -2370,6 +2690,7 @@ class Session(Message):
             self._agent.invoke_app(msg['module'],  "upload",  self,  fupload)
             if not fupload.is_accept():
                 raise Exception("Upload file not accepted")
+            resp["Offset"] = str(fupload.get_offset())
         except Exception as e:
             try:
                 fupload.close()
@@ -2410,6 +2731,7 @@ class WebSocket:
                 self._on_close = events["on_close"]
             if "on_data" in events:
                 self._on_data = events["on_data"]
+        self._send_channel=self._parent.new_send_channel(priority, self._props)
         self._len=-1
         self._data=None
         self._baccept=True
@@ -2418,6 +2740,9 @@ class WebSocket:
     def is_accept(self):
         return self._baccept
     
+    def get_send_queue_depth(self):
+        return self._send_channel.get_queue_depth()
+    
     def get_properties(self):
         return self._props
     
@@ -2477,7 +2802,7 @@ class WebSocket:
                     dtsend.append_bytes(utils.Bytes(data))
                 else:
                     dtsend.append_bytes(data)
-            self._parent._send_conn(self._conn,dtsend)
+            self._parent._send_conn(self._conn,dtsend,self._send_channel)
        
     def _on_close_conn(self):
         self._destroy(True)
@@ -2529,11 +2854,15 @@ class WebSocketSimulate:
         self._pst_data=utils.Bytes()
         self._qry_or_pst="qry"
         self._send_list=[]
+        self._send_channel=self._parent.new_send_channel(priority, self._props)
         self._baccept=True
     
     def is_accept(self):
         return self._baccept
     
+    def get_send_queue_depth(self):
+        return self._send_channel.get_queue_depth()
+    
     def get_properties(self):
         return self._props
     
@@ -2656,7 +2985,7 @@ class WebSocketSimulate:
         if ln>0:
             bts.append_bytes(utils.Bytes(dt))
         
-        self._parent._send_conn(self._conn,bts)
+        self._parent._send_conn(self._conn,bts,self._send_channel)
         
     
     def send_string(self,data):
@@ -2714,6 +3043,13 @@ class WebSocketSimulate:
                 
 
 class Download():
+    STRIPE_COUNT_MAX = 16
+    STRIPE_ALIGN = 64*1024
+    STRIPE_TTL = 60*60
+    BLOCK_SIZE_MIN = 32*1024
+    BLOCK_SIZE_MAX = 1024*1024
+    BLOCK_SIZE_ZERO_COPY_MIN = 128*1024
+    MMAP_WINDOW_SIZE = 16*1024*1024
 
     def __init__(self, parent, conn, props):
         self._parent=parent
@@ -2723,16 +3059,29 @@ class Download():
         self._props=props
         self._semaphore = threading.Condition()
         self._baccept=False
+        self._stripe_id=None
+        self._stripe_request=None
+        self._stripe_done=False
 
     def accept(self, path):
         self._path=path
         self._name=utils.path_basename(self._path)
-        self._length=utils.path_size(self._path)
+        st=utils.path_stat(self._path)
+        self._length=st.st_size
+        self._mtime=st.st_mtime
+        self._etag="\"" + "%x-%x-%x" % (st.st_ino, st.st_size, int(st.st_mtime*1000000)) + "\""
+        self._range_start=0
+        self._range_end=self._length
+        self._parse_range()
+        self._parse_stripe()
         self._calcbps=communication.BandwidthCalculator()        
+        self._send_channel=self._parent.new_send_channel(communication.PRIORITY_BULK, self._props)
         self._bclose = False
         self._status="T"
+        #ULTIMA OPERAZIONE CHE PUO' FALLIRE: SE accept SOLLEVA UN'ECCEZIONE L'INDICE NON RESTA REGISTRATO
+        self._stripe_register()
         self._baccept=True
-        self._agent._task_pool.execute(self.run)
+        self._agent._task_pool.execute_priority(communication.PRIORITY_BULK, self.run)
     
     def is_accept(self):
         return self._baccept
@@ -2752,31 +3101,196 @@ class Download():
     def get_length(self):
         return self._length
     
+    def get_range(self):
+        return (self._range_start, self._range_end)
+    
+    def get_range_length(self):
+        return self._range_end-self._range_start
+    
+    def is_partial(self):
+        return self._range_start>0 or self._range_end<self._length
+    
+    def get_etag(self):
+        return self._etag
+    
+    def get_last_modified(self):
+        return email.utils.formatdate(self._mtime, usegmt=True)
+    
     def get_bps(self):
         return self._calcbps.get_bps()
     
     def get_status(self):
         return self._status   
     
+    def _parse_range(self):
+        #FORMATO HTTP: bytes=INIZIO-FINE (FINE INCLUSA), bytes=INIZIO- , bytes=-ULTIMI
+        srng=get_prop(self._props, "range", None)
+        if srng is None or srng=="":
+            return
+        #SE IL FILE E' CAMBIATO (ETAG O DATA MODIFICA) INVIA IL FILE COMPLETO
+        sifrng=get_prop(self._props, "ifRange", None)
+        if sifrng is not None and sifrng!="":
+            if sifrng!=self._etag and sifrng!=self.get_last_modified():
+                return
+        srng=srng.strip()
+        if not srng.startswith("bytes="):
+            raise Exception("Download range not valid.")
+        srng=srng[6:]
+        if "," in srng:
+            raise Exception("Download multiple ranges not supported.")
+        ar=srng.split("-")
+        if len(ar)!=2:
+            raise Exception("Download range not valid.")
+        try:
+            if ar[0].strip()=="":
+                #ULTIMI N BYTES
+                n=long(ar[1])
+                if n<=0:
+                    raise Exception("")
+                st=max(0, self._length-n)
+                en=self._length
+            else:
+                st=long(ar[0])
+                if ar[1].strip()=="":
+                    en=self._length
+                else:
+                    en=min(self._length, long(ar[1])+1)
+        except:
+            raise Exception("Download range not valid.")
+        if st<0 or st>=self._length or en<=st:
+            raise Exception("Download range not satisfiable.")
+        self._range_start=st
+        self._range_end=en
+    
+    def _parse_stripe(self):
+        #MODALITA' STRIPE: IL VIEWER APRE N CONNESSIONI RAW PER LO STESSO FILE (STESSO stripeId)
+        #OGNUNA INVIA UN INTERVALLO DISGIUNTO E IL VIEWER RICOMPONE I DATI CON Content-Range
+        sid=get_prop(self._props, "stripeId", None)
+        if sid is None or sid=="":
+            return
+        try:
+            cnt=int(get_prop(self._props, "stripeCount", 1))
+            idx=int(get_prop(self._props, "stripeIndex", 0))
+        except:
+            raise Exception("Download stripe not valid.")
+        if cnt<1 or cnt>self._agent._get_config('download_stripe_max', Download.STRIPE_COUNT_MAX):
+            raise Exception("Download stripe count not valid.")
+        if idx<0 or idx>=cnt:
+            raise Exception("Download stripe index not valid.")
+        #CONFINI ALLINEATI A STRIPE_ALIGN (CON FILE PICCOLI ALCUNI INTERVALLI POSSONO ESSERE VUOTI)
+        sz=self._range_end-self._range_start
+        st=self._range_start+((idx*sz/cnt)/Download.STRIPE_ALIGN)*Download.STRIPE_ALIGN
+        if idx==cnt-1:
+            en=self._range_end
+        else:
+            en=self._range_start+(((idx+1)*sz/cnt)/Download.STRIPE_ALIGN)*Download.STRIPE_ALIGN
+        self._stripe_request=(sid, idx, cnt)
+        self._range_start=st
+        self._range_end=en
+    
+    def _stripe_register(self):
+        if self._stripe_request is not None:
+            sid, idx, cnt = self._stripe_request
+            self._parent._download_stripe_register(sid, idx, cnt, self._etag)
+            self._stripe_id=sid
+            self._stripe_index=idx
+            self._stripe_count=cnt
+    
+    def get_stripe(self):
+        if self._stripe_id is None:
+            return None
+        return (self._stripe_index, self._stripe_count)
+    
+    def _stripe_unregister(self):
+        if self._stripe_id is not None:
+            try:
+                self._parent._download_stripe_unregister(self._stripe_id, self._stripe_index, self._stripe_done)
+            except:
+                None
+    
+    def _is_file_changed(self):
+        try:
+            st=utils.path_stat(self._path)
+            return st.st_size!=self._length or st.st_mtime!=self._mtime
+        except:
+            return True
+    
+    def _is_zero_copy(self):
+        #SOLO SU WINDOWS: SU LINUX/MAC UN FILE TRONCATO DA UN ALTRO PROCESSO MENTRE E' MAPPATO (ES. LOGROTATE COPYTRUNCATE)
+        #GENERA SIGBUS DURANTE LA LETTURA E TERMINA L'AGENT; SU WINDOWS IL TRONCAMENTO DI UN FILE MAPPATO FALLISCE
+        #SOLO SU CONNESSIONI NON CIFRATE (CON SSL I DATI VENGONO COMUNQUE COPIATI)
+        if not is_windows() or not self._agent._get_config('download_zero_copy', True):
+            return False
+        try:
+            return not self._conn.is_secure()
+        except:
+            return False
+    
+    def _get_block_size(self):
+        #BLOCCO PARI A CIRCA 100MS DI TRASFERIMENTO
+        return communication.calculate_buffer_size(self._calcbps.get_bps(), Download.BLOCK_SIZE_MIN, Download.BLOCK_SIZE_MAX)
+    
     def run(self):
         fl=None
+        mm=None
         try:
             fl = utils.file_open(self._path, 'rb')
-            bsz=32*1024
+            bzc=self._is_zero_copy()
+            pos=self._range_start
+            if not bzc and pos>0:
+                fl.seek(pos)
+            rem=self._range_end-self._range_start
+            mmp=0
+            mml=0
             while not self.is_close():
-                bts = utils.file_read(fl,bsz)
-                ln = len(bts)
-                if ln==0:
-                    self._status="C"
+                if rem==0:
+                    #VERIFICA CHE IL FILE NON SIA STATO MODIFICATO DURANTE L'INVIO
+                    if self._is_file_changed():
+                        self._status="E"
+                    else:
+                        self._status="C"
+                        self._stripe_done=True
                     break
-                self._parent._set_last_activity_time()
-                self._parent._send_conn(self._conn,bts)
+                bsz=self._get_block_size()
+                if bzc:
+                    #BLOCCHI PIU' GRANDI DEL BUFFER DI INVIO DELLA CONNESSIONE (ALTRIMENTI VENGONO COPIATI)
+                    bsz=max(bsz, Download.BLOCK_SIZE_ZERO_COPY_MIN)
+                    if mm is None or pos>=mmp+mml:
+                        if mm is not None:
+                            mm.close()
+                            mm=None
+                        try:
+                            mmp=(pos/utils.mmap_granularity())*utils.mmap_granularity()
+                            mml=min(Download.MMAP_WINDOW_SIZE, self._range_end-mmp)
+                            mm=utils.mmap_file(fl, mmp, mml)
+                        except:
+                            #MMAP NON DISPONIBILE: LETTURA STANDARD
+                            bzc=False
+                            fl.seek(pos)
+                            continue
+                        bts=utils.mmap_bytes(mm)
+                    ln=min(bsz, rem, mmp+mml-pos)
+                    self._parent._set_last_activity_time()
+                    self._parent._send_conn(self._conn,bts,self._send_channel,pos-mmp,ln,ln)
+                else:
+                    bts = utils.file_read(fl,min(bsz,rem))
+                    ln = len(bts)
+                    if ln==0:
+                        #FILE TRONCATO DURANTE L'INVIO
+                        self._status="E"
+                        break
+                    self._parent._set_last_activity_time()
+                    self._parent._send_conn(self._conn,bts,self._send_channel)
+                pos+=ln
+                rem-=ln
                 self._calcbps.add(ln)
                 #print "DOWNLOAD - NAME:" + self._name + " SZ: " + str(len(s)) + " LEN: " + str(self._calcbps.get_transfered()) +  "  BPS: " + str(self._calcbps.get_bps())
         except Exception:
             self._status="E"
         finally:
             self.close()
+            if mm is not None:
+                mm.close()
             if fl is not None:
                 fl.close()
         if self._conn is not None:
@@ -2794,30 +3308,42 @@ class Download():
         self._parent._set_last_activity_time()        
     
     def _on_close_conn(self):
+        bunreg=False
         self._semaphore.acquire()
         try:
             if not self._bclose:
                 if self._status=="T":
                     self._status="E"
                 self._bclose=True
+                bunreg=True
         finally:
             self._semaphore.release()
+        if bunreg:
+            self._stripe_unregister()
     
     def close(self):
+        bunreg=False
         self._semaphore.acquire()
         try:
             if not self._bclose:
                 if self._status=="T":
                     self._status="C"
                 self._bclose=True
+                bunreg=True
         finally:
             self._semaphore.release()
+        if bunreg:
+            self._stripe_unregister()
         if not self._baccept and self._conn is not None:
             self._conn.close()
             self._conn = None
 
 
 class Upload():
+    WRITE_BUFFER_SIZE = 8*1024*1024
+    FSYNC_NONE = "none"
+    FSYNC_FILE = "file"
+    FSYNC_FULL = "full"
 
     def __init__(self, parent, conn, props):
         self._parent=parent
@@ -2827,6 +3353,13 @@ class Upload():
         self._props=props
         self._semaphore = threading.Condition()
         self._baccept=False
+        self._writer=None
+        self._upload_key=None
+        self._discard_partial=False
+        self._file_closed=False
+        self._offset=0
+        self._tmpname=None
+        self._fltmp=None
 
     def accept(self, path):
         self._path=path
@@ -2835,36 +3368,129 @@ class Upload():
             raise Exception("upload file length in none.")
         self._length=long(self._props['length'])
         self._calcbps=communication.BandwidthCalculator() 
+        self._send_channel=self._parent.new_send_channel(communication.PRIORITY_BULK, self._props)
             
-        sprnpath=utils.path_dirname(path)    
-        while True:
-            r="".join([random.choice("0123456789") for x in xrange(6)])            
-            self._tmpname=sprnpath + utils.path_sep + "temporary" + r + ".dwsupload";
-            if not utils.path_exists(self._tmpname):
-                utils.file_open(self._tmpname, 'wb').close() #Crea il file per imposta i permessi
-                self._agent.get_osmodule().fix_file_permissions("CREATE_FILE",self._tmpname)
-                self._fltmp = utils.file_open(self._tmpname, 'wb')
-                break
+        #RIPRESA: IL FILE PARZIALE E' IDENTIFICATO DA PERCORSO DI DESTINAZIONE E ID UPLOAD DEL CLIENT
+        uid=get_prop(self._props, "uploadId", None)
+        tmpname=None
+        if uid is not None and uid!="" and self._agent._get_config('upload_resume', True):
+            self._upload_key=hashlib.sha1((path + u"\n" + uid).encode("utf-8")).hexdigest()
+            tmpname, uold = self._agent._acquire_upload_partial(self._upload_key, self)
+            if uold is not None:
+                #IL CLIENT SI E' RICONNESSO PRIMA CHE LA VECCHIA CONNESSIONE FOSSE CHIUSA
+                uold._on_close_conn()
+                uold._wait_file_closed()
+        if tmpname is not None:
+            self._tmpname=tmpname
+            try:
+                self._fltmp = utils.file_open(self._tmpname, 'r+b')
+                self._offset=utils.file_size(self._fltmp)
+                soff=get_prop(self._props, "offset", None)
+                if soff is not None and soff!="":
+                    #IL CLIENT PUO' RIPARTIRE DA UNA POSIZIONE PRECEDENTE
+                    soff=long(soff)
+                    if soff<0 or soff>self._offset:
+                        raise Exception("upload offset not valid.")
+                    if soff<self._offset:
+                        self._fltmp.truncate(soff)
+                        self._offset=soff
+                self._fltmp.seek(self._offset)
+            except Exception as e:
+                self._remove_temp_file()
+                raise e
+        else:
+            try:
+                sprnpath=utils.path_dirname(path)    
+                while True:
+                    r="".join([random.choice("0123456789") for x in xrange(6)])            
+                    tmpname=sprnpath + utils.path_sep + "temporary" + r + ".dwsupload";
+                    if not utils.path_exists(tmpname):
+                        utils.file_open(tmpname, 'wb').close() #Crea il file per imposta i permessi
+                        self._tmpname=tmpname
+                        self._agent.get_osmodule().fix_file_permissions("CREATE_FILE",self._tmpname)
+                        self._fltmp = utils.file_open(self._tmpname, 'wb')
+                        break
+                if self._upload_key is not None:
+                    self._agent._set_upload_partial(self._upload_key, self._tmpname)
+            except Exception as e:
+                self._remove_temp_file()
+                raise e
         try:
             self._bclose = False
             self._status="T"
             self._enddatafile=False
-            self._baccept=True
             self._last_time_transfered = 0
+            #SCRITTURA DIFFERITA: I DATI RICEVUTI VENGONO SCRITTI SU DISCO DA UN THREAD DEDICATO
+            self._write_queue=collections.deque()
+            self._write_queued=0
+            self._write_buffer_size=self._agent._get_config('upload_write_buffer_size', Upload.WRITE_BUFFER_SIZE)
+            self._written=self._offset
+            self._fsync=self._agent._get_config('upload_fsync', Upload.FSYNC_FILE)
+            #VERIFICA INTEGRITA' (DIGEST ESADECIMALE INVIATO DAL CLIENT)
+            self._hash=None
+            self._digest=get_prop(self._props, "digest", None)
+            if self._digest is not None and self._digest!="":
+                alg=get_prop(self._props, "digestAlgorithm", "sha256").lower()
+                if alg not in hashlib.algorithms:
+                    raise Exception("upload digest algorithm not supported.")
+                self._hash=hashlib.new(alg)
+                self._digest=self._digest.lower()
+            self._preallocated=False
+            #UN FILE PARZIALE DEVE AVERE LA DIMENSIONE DEI DATI RICEVUTI (NESSUNA PREALLOCAZIONE)
+            if self._length>0 and self._upload_key is None and self._agent._get_config('upload_preallocate', True):
+                try:
+                    utils.file_preallocate(self._fltmp, self._length)
+                    self._preallocated=True
+                except:
+                    None
+            self._baccept=True
+            self._writer=threading.Thread(target=self._write_run, name="UploadWriter")
+            self._writer.daemon=True
+            self._writer.start()
         except Exception as e:
+            self._baccept=False
             self._remove_temp_file()
             raise e
         
     def _remove_temp_file(self):
+        self._semaphore.acquire()
         try:
-            self._fltmp.close()
-        except:
-            None
+            try:
+                self._fltmp.close()
+            except:
+                None
+            #GLI UPLOAD RIPRENDIBILI INTERROTTI MANTENGONO IL FILE PARZIALE (RIMOSSO DOPO upload_partial_ttl)
+            if self._upload_key is not None and not self._discard_partial and self._tmpname is not None and utils.path_exists(self._tmpname):
+                try:
+                    self._agent._release_upload_partial(self._upload_key, self, self._tmpname)
+                except:
+                    None
+            else:
+                try:
+                    if self._tmpname is not None and utils.path_exists(self._tmpname):
+                        utils.path_remove(self._tmpname)
+                except:
+                    None
+                if self._upload_key is not None:
+                    try:
+                        self._agent._remove_upload_partial(self._upload_key, self)
+                    except:
+                        None
+            self._file_closed=True
+            self._semaphore.notifyAll()
+        finally:
+            self._semaphore.release()
+    
+    def _wait_file_closed(self):
+        self._semaphore.acquire()
         try:
-            if utils.path_exists(self._tmpname):
-                utils.path_remove(self._tmpname)
-        except:
-            None        
+            while not self._file_closed:
+                self._semaphore.wait(0.5)
+        finally:
+            self._semaphore.release()
+    
+    def get_offset(self):
+        return self._offset
     
     def is_accept(self):
         return self._baccept
@@ -2879,7 +3505,7 @@ class Upload():
         return self._path
     
     def get_transfered(self):
-        return self._calcbps.get_transfered()
+        return self._offset+self._calcbps.get_transfered()
     
     def get_length(self):
         return self._length
@@ -2895,38 +3521,118 @@ class Upload():
         self._semaphore.acquire()
         try:
             if not self._bclose:
-                if self._status == "T":
+                if self._status == "T" and not self._enddatafile:
                     if data[0]==ord('C'): 
+                        #IL FILE VIENE COMPLETATO DAL THREAD DI SCRITTURA
                         self._enddatafile=True;
-                        #SCRIVE FILE
-                        try:
-                            self._fltmp.close()
-                            if utils.path_exists(self._path):
-                                if utils.path_isdir(self._path):
-                                    raise Exception("")
-                                else:
-                                    utils.path_remove(self._path)
-                            shutil.move(self._tmpname, self._path)
-                            self._status = "C"
-                            bts = utils.Bytes()
-                            bts.append_str(self._status, "utf8")
-                            self._parent._send_conn(self._conn,bts)
-                        except Exception:
-                            self._status = "E"
-                            bts = utils.Bytes()
-                            bts.append_str(self._status, "utf8")
-                            self._parent._send_conn(self._conn,bts)
-                        self.close()
+                        self._semaphore.notifyAll()
                     else: #if data[0]=='D': 
-                        data=data.new_buffer(1)
-                        utils.file_write(self._fltmp, data)
-                        self._calcbps.add(len(data))
+                        #ATTENDE SOLO SE IL BUFFER E' PIENO (IL DISCO NON TIENE IL PASSO)
+                        while not self._bclose and self._status=="T" and self._write_queued>=self._write_buffer_size:
+                            self._semaphore.wait(0.5)
+                        if not self._bclose and self._status=="T":
+                            data=data.new_buffer(1)
+                            self._write_queue.append(data)
+                            self._write_queued+=len(data)
+                            self._calcbps.add(len(data))
+                            self._semaphore.notifyAll()
                         #print "UPLOAD - NAME:" + self._name + " LEN: " + str(self._calcbps.get_transfered()) +  "  BPS: " + str(self._calcbps.get_bps())
                         
         except:
             self._status = "E"
+            self._semaphore.notifyAll()
+        finally:
+            self._semaphore.release()
+    
+    def _write_run(self):
+        bok=False
+        try:
+            if self._hash is not None and self._offset>0:
+                self._hash_partial()
+            while True:
+                bts=None
+                self._semaphore.acquire()
+                try:
+                    while not self._bclose and self._status=="T" and len(self._write_queue)==0 and not self._enddatafile:
+                        self._semaphore.wait(0.5)
+                    if self._bclose or self._status!="T":
+                        break
+                    if len(self._write_queue)>0:
+                        bts=self._write_queue.popleft()
+                        self._write_queued-=len(bts)
+                        self._semaphore.notifyAll()
+                finally:
+                    self._semaphore.release()
+                if bts is None:
+                    self._complete_file()
+                    bok=True
+                    break
+                utils.file_write(self._fltmp, bts)
+                if self._hash is not None:
+                    bts.hash_update(self._hash)
+                self._written+=len(bts)
+        except Exception as e:
+            self._agent.write_except(e, "Upload " + self._name + ": ")
+        self._write_end(bok)
+    
+    def _hash_partial(self):
+        #RIPRESA: IL DIGEST COMPRENDE ANCHE I DATI GIA' RICEVUTI
+        fl = utils.file_open(self._tmpname, 'rb')
+        try:
+            rem=self._offset
+            while rem>0 and not self.is_close():
+                bts = utils.file_read(fl, min(1024*1024, rem))
+                if len(bts)==0:
+                    raise Exception("upload partial file truncated.")
+                bts.hash_update(self._hash)
+                rem-=len(bts)
+        finally:
+            fl.close()
+    
+    def _complete_file(self):
+        #SCRIVE FILE
+        if self._preallocated and self._written!=self._length:
+            self._fltmp.truncate(self._written)
+        if self._fsync!=Upload.FSYNC_NONE:
+            utils.file_sync(self._fltmp)
+        self._fltmp.close()
+        if self._hash is not None and self._hash.hexdigest()!=self._digest:
+            #DATI NON VALIDI: IL FILE PARZIALE NON PUO' ESSERE RIPRESO
+            self._discard_partial=True
+            raise Exception("upload digest not valid.")
+        if utils.path_exists(self._path):
+            if utils.path_isdir(self._path):
+                raise Exception("upload path is a directory.")
+            else:
+                utils.path_remove(self._path)
+        shutil.move(self._tmpname, self._path)
+        if self._fsync==Upload.FSYNC_FULL:
+            utils.path_sync(utils.path_dirname(self._path))
+    
+    def _write_end(self, bok):
+        self._semaphore.acquire()
+        try:
+            if self._status=="T" and (bok or not self._bclose):
+                if bok:
+                    self._status="C"
+                else:
+                    self._status="E"
+            if self._bclose:
+                return
+            sts=self._status
         finally:
             self._semaphore.release()
+        try:
+            bts = utils.Bytes()
+            bts.append_str(sts, "utf8")
+            self._parent._send_conn(self._conn,bts,self._send_channel)
+        except:
+            None
+        self.close()
+    
+    def _join_writer(self):
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
         
     def is_close(self):
         ret = True
@@ -2943,8 +3649,14 @@ class Upload():
             try:
                 #print "UPLOAD - ONCLOSE"
                 self._bclose=True
+                self._semaphore.notifyAll()
+            finally:
+                self._semaphore.release()
+            self._join_writer()
+            self._semaphore.acquire()
+            try:
                 self._remove_temp_file()
-                if not self._enddatafile:
+                if self._status=="T":
                     self._status = "E"
             finally:
                 self._semaphore.release()
@@ -2958,15 +3670,21 @@ class Upload():
             self._semaphore.acquire()
             try:
                 self._bclose=True
+                self._semaphore.notifyAll()
+            finally:
+                self._semaphore.release()
+            self._join_writer()
+            self._semaphore.acquire()
+            try:
                 self._remove_temp_file()
-                self._status  = "C"
+                if self._status=="T":
+                    self._status  = "C"
             finally:
                 self._semaphore.release()
             if self._conn is not None:
                 self._conn.close()
                 self._conn = None
 
-
 main = None
 
 def ctrlHandler(ctrlType):
@@ -15,11 +15,31 @@ import xml.etree.ElementTree
 import os
 import base64
 import math
+import select
+import heapq
+import errno
+import collections
+import logging
 import utils
 from Queue import Queue
 
+try:
+    import fcntl
+except:
+    None
+
 BUFFER_SIZE_MAX = 32*1024
 BUFFER_SIZE_MIN = 1024
+SEND_BATCH_SIZE = 64*1024
+SEND_PRIORITY_AGING = 0.5
+
+PRIORITY_BULK = 0
+PRIORITY_NORMAL = 5
+PRIORITY_INTERACTIVE = 10
+
+POLICY_BLOCK="block"
+POLICY_CALLER_RUNS="callerruns"
+POLICY_REJECT="reject"
 
 
 SIZE_INTEGER=math.pow(2,32)
@@ -35,6 +55,14 @@ _proxy_detected["semaphore"]=threading.Condition()
 _proxy_detected["check"] = False
 _proxy_detected["info"] = None
 
+IO_MODE_THREAD="thread"
+IO_MODE_REACTOR="reactor"
+
+_io_reactor = {}
+_io_reactor["semaphore"]=threading.Condition()
+_io_reactor["mode"]=None
+_io_reactor["instance"]=None
+
 def calculate_buffer_size(bps,szmin=BUFFER_SIZE_MIN,szmax=BUFFER_SIZE_MAX):
     buffsz=int(0.1*float(bps))
     if buffsz<szmin:
@@ -296,6 +324,51 @@ def set_cacerts_path(path):
     global _cacerts_path
     _cacerts_path=path
 
+def _write_except(e, tx=u""):
+    #LOGGER RADICE CONFIGURATO DALL'AGENT (STESSO FORMATO DI write_except)
+    try:
+        msg=unicode(threading.current_thread().name) + u" " + tx + utils.exception_to_string(e) + u"\n" + utils.get_stacktrace_string()
+        logging.getLogger().error(msg)
+    except:
+        None
+
+def is_reactor_available():
+    if is_windows():
+        return False
+    return hasattr(select, 'epoll') or hasattr(select, 'poll')
+
+def set_io_mode(mode):
+    if mode is not None and mode!=IO_MODE_THREAD and mode!=IO_MODE_REACTOR:
+        raise Exception("Invalid io mode.")
+    _io_reactor["semaphore"].acquire()
+    try:
+        _io_reactor["mode"]=mode
+    finally:
+        _io_reactor["semaphore"].release()
+
+def get_io_mode():
+    _io_reactor["semaphore"].acquire()
+    try:
+        mode=_io_reactor["mode"]
+    finally:
+        _io_reactor["semaphore"].release()
+    if mode is None:
+        mode=IO_MODE_REACTOR
+    if mode==IO_MODE_REACTOR and not is_reactor_available():
+        mode=IO_MODE_THREAD
+    return mode
+
+def _get_reactor():
+    _io_reactor["semaphore"].acquire()
+    try:
+        if _io_reactor["instance"] is None:
+            rct=ConnectionReactor()
+            rct.start()
+            _io_reactor["instance"]=rct
+        return _io_reactor["instance"]
+    finally:
+        _io_reactor["semaphore"].release()
+
 def _connect_socket(host, port, proxy_info):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
@@ -714,32 +787,51 @@ class Counter:
 
 class Worker(threading.Thread):
     
-    def __init__(self, parent,  queue, i):
+    def __init__(self, parent, i, core):
         self._parent = parent
         threading.Thread.__init__(self, name=self._parent.get_name() + "_" + str(i))
         self.daemon=True
-        self._queue=queue
+        self._core=core
         
     def run(self):
-        while not self._parent._destroy:
-            func, args, kargs = self._queue.get()
-            if func is not None:
-                try: 
-                    func(*args, **kargs)
-                except Exception as e: 
-                    self._parent.fire_except(e)
-                self._queue.task_done()
+        self._parent._worker_run(self)
     
+
 class ThreadPool():
     
-    def __init__(self, name, queue_size, core_size , fexcpt):
-            self._destroy=False
-            self._name=name
-            self._fexcpt=fexcpt
-            self._queue = Queue(queue_size)
+    def __init__(self, name, queue_size, core_size , fexcpt, max_size=None, policy=POLICY_CALLER_RUNS, keep_alive=60.0):
+        self._lock = threading.RLock()
+        self._semaphore = threading.Condition(self._lock)
+        self._semaphore_full = threading.Condition(self._lock)
+        self._destroy=False
+        self._name=name
+        self._fexcpt=fexcpt
+        self._queue_size=queue_size
+        self._core_size=core_size
+        if max_size is None or max_size<core_size:
+            max_size=core_size
+        self._max_size=max_size
+        self._policy=policy
+        self._keep_alive=keep_alive
+        self._queues={}
+        self._priorities=[]
+        self._queued=0
+        self._workers=[]
+        self._worker_seq=0
+        self._idle=0
+        self._active=0
+        self._completed=0
+        self._rejected=0
+        self._caller_runs=0
+        self._wait_time_tot=0.0
+        self._wait_time_max=0.0
+        self._exec_time_tot=0.0
+        self._semaphore.acquire()
+        try:
             for i in range(core_size):
-                self._worker = Worker(self, self._queue, i)
-                self._worker.start()
+                self._add_worker(True)
+        finally:
+            self._semaphore.release()
     
     def get_name(self):
         return self._name 
@@ -747,13 +839,158 @@ class ThreadPool():
     def fire_except(self, e):
         if self._fexcpt is not None:
             self._fexcpt(e)
+    
+    def _add_worker(self, core):
+        wrk = Worker(self, self._worker_seq, core)
+        self._worker_seq+=1
+        self._workers.append(wrk)
+        wrk.start()
+    
+    def _poll(self):
+        for p in self._priorities:
+            q=self._queues[p]
+            if len(q)>0:
+                self._queued-=1
+                return q.popleft()
+        return None
+    
+    def _run_task(self, func, args, kargs):
+        tm=get_time()
+        try: 
+            func(*args, **kargs)
+        except Exception as e: 
+            self.fire_except(e)
+        return get_time()-tm
+    
+    def _worker_run(self, wrk):
+        while True:
+            itm=None
+            self._semaphore.acquire()
+            try:
+                tmidle=get_time()
+                while True:
+                    itm=self._poll()
+                    if itm is not None:
+                        break
+                    if self._destroy or (not wrk._core and get_time()-tmidle>=self._keep_alive):
+                        self._workers.remove(wrk)
+                        self._semaphore_full.notifyAll()
+                        return
+                    self._idle+=1
+                    try:
+                        if wrk._core:
+                            self._semaphore.wait()
+                        else:
+                            self._semaphore.wait(self._keep_alive)
+                    finally:
+                        self._idle-=1
+                self._active+=1
+                wt=get_time()-itm[3]
+                if wt>0:
+                    self._wait_time_tot+=wt
+                    if wt>self._wait_time_max:
+                        self._wait_time_max=wt
+                self._semaphore_full.notify()
+            finally:
+                self._semaphore.release()
+            et=self._run_task(itm[0], itm[1], itm[2])
+            self._semaphore.acquire()
+            try:
+                self._active-=1
+                self._completed+=1
+                if et>0:
+                    self._exec_time_tot+=et
+            finally:
+                self._semaphore.release()
 
     def execute(self, func, *args, **kargs):
-        if not self._destroy:
-            self._queue.put([func, args, kargs])
+        return self.execute_priority(PRIORITY_NORMAL, func, *args, **kargs)
+    
+    def execute_priority(self, priority, func, *args, **kargs):
+        bcallerruns=False
+        self._semaphore.acquire()
+        try:
+            if self._destroy:
+                return False
+            while self._queued>=self._queue_size and self._idle==0 and len(self._workers)>=self._max_size:
+                if self._policy==POLICY_REJECT:
+                    self._rejected+=1
+                    raise Exception("Task rejected: thread pool " + self._name + " is full.")
+                elif self._policy==POLICY_CALLER_RUNS:
+                    self._caller_runs+=1
+                    bcallerruns=True
+                    break
+                self._semaphore_full.wait()
+                if self._destroy:
+                    return False
+            if not bcallerruns:
+                if priority not in self._queues:
+                    self._queues[priority]=collections.deque()
+                    self._priorities=sorted(self._queues.keys(), reverse=True)
+                self._queues[priority].append((func, args, kargs, get_time()))
+                self._queued+=1
+                if self._queued>self._idle and len(self._workers)<self._max_size:
+                    self._add_worker(False)
+                else:
+                    self._semaphore.notify()
+        finally:
+            self._semaphore.release()
+        if bcallerruns:
+            #BACKPRESSURE: IL CHIAMANTE ESEGUE IL TASK
+            self._run_task(func, args, kargs)
+        return True
+    
+    def get_metrics(self):
+        self._semaphore.acquire()
+        try:
+            m={}
+            m["threads"]=len(self._workers)
+            m["coreSize"]=self._core_size
+            m["maxSize"]=self._max_size
+            m["idle"]=self._idle
+            m["active"]=self._active
+            m["queued"]=self._queued
+            m["completed"]=self._completed
+            m["rejected"]=self._rejected
+            m["callerRuns"]=self._caller_runs
+            m["waitTimeMax"]=self._wait_time_max
+            if self._completed>0:
+                m["waitTimeAvg"]=self._wait_time_tot/self._completed
+                m["execTimeAvg"]=self._exec_time_tot/self._completed
+            else:
+                m["waitTimeAvg"]=0.0
+                m["execTimeAvg"]=0.0
+            return m
+        finally:
+            self._semaphore.release()
     
-    def destroy(self):
-        self._destroy=True #DA GESTIRE
+    def join(self, timeout=None):
+        #ATTENDE LA TERMINAZIONE DEI WORKER (DOPO destroy)
+        cnt=Counter()
+        for wrk in list(self._workers):
+            if wrk is threading.current_thread():
+                continue
+            if timeout is None:
+                wrk.join()
+            else:
+                tm=timeout-(cnt.get_value()/1000.0)
+                if tm<=0:
+                    return False
+                wrk.join(tm)
+        return len([w for w in self._workers if w is not threading.current_thread()])==0
+    
+    def destroy(self, timeout=None):
+        #I TASK GIA' IN CODA VENGONO COMPLETATI PRIMA DI CHIUDERE I WORKER
+        self._semaphore.acquire()
+        try:
+            self._destroy=True
+            self._semaphore.notifyAll()
+            self._semaphore_full.notifyAll()
+        finally:
+            self._semaphore.release()
+        if timeout is not None:
+            return self.join(timeout)
+        return True
 
 
 class QueueTask():
@@ -761,7 +998,7 @@ class QueueTask():
     def __init__(self, tpool):
         self._task_pool=tpool
         self._semaphore = threading.Condition()
-        self.list = []
+        self.list = collections.deque()
         self.running = False
         
     
@@ -773,7 +1010,7 @@ class QueueTask():
                 if len(self.list)==0:
                     self.running = False
                     break;
-                func = self.list.pop(0)
+                func = self.list.popleft()
             finally:
                 self._semaphore.release()
             func();
@@ -807,7 +1044,7 @@ class BandwidthCalculator:
         self._bps=0
         self._check_intervall=ckint
         self._calc_intervall=ccint
-        self._calc_ar=[]
+        self._calc_ar=collections.deque()
         self._calc_elapsed=0
         self._calc_transfered=0
     
@@ -846,7 +1083,7 @@ class BandwidthCalculator:
                 self._calc_elapsed+=elapsed
                 self._calc_transfered+=transfered
                 while len(self._calc_ar)>1 and self._calc_elapsed>self._calc_intervall:
-                    ar = self._calc_ar.pop(0)
+                    ar = self._calc_ar.popleft()
                     self._calc_elapsed-=ar["elapsed"]
                     self._calc_transfered-=ar["transfered"]
                 self._bps=int(float(self._calc_transfered)*(1.0/self._calc_elapsed))
@@ -863,83 +1100,184 @@ class BandwidthCalculator:
         finally:
             self._semaphore.release()
 
-'''
-class BandwidthLimiter:
+class TokenBucket:
+    #NON SINCRONIZZATO: USATO SOTTO IL SEMAFORO DI SendScheduler
     
-    def __init__(self,sync=True):
-        if sync:
-            self._semaphore = threading.Condition()
-        else:
-            self._semaphore = None
-        self._last_time=0
-        self._bandlimit=0
-        self._last_wait=0
-        self._buffsz=0        
-        self.set_bandlimit(0)
-     
-     
-    def _semaphore_acquire(self):
-        if self._semaphore is not None:
-            self._semaphore.acquire()
+    def __init__(self, rate=0, burst=0):
+        self._tokens=0.0
+        self._last_time=get_time()
+        self.set_rate(rate, burst)
+    
+    def set_rate(self, rate, burst=0):
+        if rate is None or rate<0:
+            rate=0
+        self._rate=rate
+        if burst<=0:
+            burst=max(int(rate*0.25),BUFFER_SIZE_MIN)
+        self._burst=burst
+        if self._tokens>self._burst:
+            self._tokens=float(self._burst)
+    
+    def get_rate(self):
+        return self._rate
+    
+    def get_burst(self):
+        return self._burst
+    
+    def _refill(self, tm):
+        if tm<self._last_time:
+            self._last_time=tm
+        self._tokens=min(float(self._burst),self._tokens+(tm-self._last_time)*self._rate)
+        self._last_time=tm
+    
+    def get_waittime(self, tm):
+        if self._rate<=0:
+            return 0.0
+        self._refill(tm)
+        if self._tokens>0:
+            return 0.0
+        return max(-self._tokens/float(self._rate),0.001)
+    
+    def consume(self, c):
+        if self._rate>0:
+            #PUO' ANDARE IN DEBITO: IL PROSSIMO INVIO ATTENDE
+            self._tokens-=c
+
+
+class SendChannel:
     
-    def _semaphore_release(self):
-        if self._semaphore is not None:
+    def __init__(self, scheduler, priority, bucket):
+        self._scheduler=scheduler
+        self._priority=priority
+        self._bucket=bucket
+        self._queued=0
+    
+    def get_priority(self):
+        return self._priority
+    
+    def get_queue_depth(self):
+        return self._scheduler._get_channel_queue_depth(self)
+    
+    def get_batch_size(self):
+        return self._scheduler._get_batch_size(self)
+    
+    def acquire(self, c):
+        self._scheduler._acquire(self, c)
+    
+    def release(self, c):
+        self._scheduler._release(self, c)
+
+
+class SendScheduler:
+    
+    def __init__(self, rate=0):
+        self._semaphore = threading.Condition()
+        self._bucket=TokenBucket(rate)
+        self._groups={}
+        self._waiting={}
+        self._sending={}
+        self._queued=0
+    
+    def new_channel(self, priority=PRIORITY_NORMAL, group=None, rate=0):
+        #I CANALI DELLO STESSO GRUPPO (ES. APP) CONDIVIDONO IL LIMITE DI BANDA
+        self._semaphore.acquire()
+        try:
+            if group is None:
+                bk=TokenBucket(rate)
+            elif group in self._groups:
+                bk=self._groups[group]
+                bk.set_rate(rate)
+            else:
+                bk=TokenBucket(rate)
+                self._groups[group]=bk
+            return SendChannel(self, priority, bk)
+        finally:
             self._semaphore.release()
     
-    def get_bandlimit(self):
-        self._semaphore_acquire()
+    def set_rate(self, rate):
+        self._semaphore.acquire()
         try:
-            return self._bandlimit
+            self._bucket.set_rate(rate)
+            self._semaphore.notifyAll()
         finally:
-            self._semaphore_release()
-        
-    def set_bandlimit(self,pbps):
-        self._semaphore_acquire()
+            self._semaphore.release()
+    
+    def get_queue_depth(self):
+        self._semaphore.acquire()
         try:
-            if self._bandlimit==pbps:
-                return
-            if pbps>0:
-                self._bandlimit=pbps
-                self._buffsz=calculate_buffer_size(pbps)
-            else:
-                self._bandlimit=0
-                self._buffsz=BUFFER_SIZE_MAX
+            return {"bytes": self._queued, "waiting": dict(self._waiting), "sending": dict(self._sending)}
         finally:
-            self._semaphore_release()
-        
-    def get_buffer_size(self):
-        self._semaphore_acquire()
+            self._semaphore.release()
+    
+    def _get_channel_queue_depth(self, chl):
+        self._semaphore.acquire()
         try:
-            return self._buffsz
+            return chl._queued
         finally:
-            self._semaphore_release()
+            self._semaphore.release()
     
-    def get_waittime(self, c):
-        self._semaphore_acquire()
+    def _get_batch_size(self, chl):
+        self._semaphore.acquire()
         try:
-            tm=get_time() 
-            timeout = 0
-            if c > 0:
-                if self._bandlimit > 0:
-                    if tm>=self._last_time:
-                        elapsed = (tm - self._last_time) - self._last_wait
-                        maxt = float(self._bandlimit)*elapsed
-                        timeout = float(c-maxt)/float(self._bandlimit) 
-                        self._last_wait=timeout
-                        if self._last_wait<-1.0:
-                            self._last_wait=0.0
-                        self._last_time=tm
-                        if timeout < 0.0:
-                            timeout=0.0
-                    else:
-                        self._last_time=tm 
-                        self._last_wait=0.0
-            return timeout
+            sz=SEND_BATCH_SIZE
+            for bk in [self._bucket, chl._bucket]:
+                if bk.get_rate()>0 and bk.get_burst()<sz:
+                    sz=bk.get_burst()
+            return sz
         finally:
-            self._semaphore_release()
-            
-'''
-            
+            self._semaphore.release()
+    
+    def _has_precedence(self, p):
+        #SOLO GLI INVII IN ATTESA: UN INVIO IN CORSO PUO' ESSERE BLOCCATO SU UN SOCKET DIVERSO (ES. VIEWER NON RISPONDE)
+        for k in self._waiting:
+            if k>p and self._waiting[k]>0:
+                return True
+        return False
+    
+    def _acquire(self, chl, c):
+        p=chl._priority
+        self._semaphore.acquire()
+        try:
+            self._waiting[p]=self._waiting.get(p,0)+1
+            self._queued+=c
+            chl._queued+=c
+            try:
+                tmstart=get_time()
+                while True:
+                    #PRIORITA' STRETTA: ATTENDE SE CI SONO INVII PIU' IMPORTANTI IN CODA
+                    #MA NON OLTRE SEND_PRIORITY_AGING (EVITA CHE UN FLUSSO CONTINUO BLOCCHI GLI ALTRI CANALI)
+                    if self._has_precedence(p):
+                        elp=get_time()-tmstart
+                        if elp>=0 and elp<SEND_PRIORITY_AGING:
+                            self._semaphore.wait(SEND_PRIORITY_AGING-elp)
+                            continue
+                    tm=get_time()
+                    wt=max(self._bucket.get_waittime(tm),chl._bucket.get_waittime(tm))
+                    if wt>0:
+                        self._semaphore.wait(wt)
+                        continue
+                    break
+                self._bucket.consume(c)
+                chl._bucket.consume(c)
+                self._sending[p]=self._sending.get(p,0)+1
+            finally:
+                self._waiting[p]-=1
+                self._queued-=c
+                chl._queued-=c
+                self._semaphore.notifyAll()
+        finally:
+            self._semaphore.release()
+    
+    def _release(self, chl, c):
+        p=chl._priority
+        self._semaphore.acquire()
+        try:
+            self._sending[p]-=1
+            self._semaphore.notifyAll()
+        finally:
+            self._semaphore.release()
+
+
 class ConnectionCheckAlive(threading.Thread):
     _KEEPALIVE_INTERVALL = 30
     _KEEPALIVE_THRESHOLD = 5
@@ -1001,78 +1339,148 @@ class ConnectionCheckAlive(threading.Thread):
             self._connection.fire_close(True)        
         #print "Thread alive stopped: " + str(self._connection)
 
+def _ws_unmask(data, key):
+    #XOR DEL PAYLOAD CON LA CHIAVE RIPETUTA (CHIAVE A ZERO: NESSUNA MODIFICA)
+    if key!=bytearray(4):
+        for i in xrange(len(data)):
+            data[i]^=key[i % 4]
+
+
+class ConnectionBuffer():
+    _SIZE = 64*1024
+    _READ_MIN = 4*1024
+    
+    def __init__(self):
+        self._buffer=bytearray(ConnectionBuffer._SIZE)
+        self._view=memoryview(self._buffer)
+        self._start=0
+        self._end=0
+        self._need=0
+    
+    def _prepare(self):
+        ln=self._end-self._start
+        if ln==0:
+            self._start=0
+            self._end=0
+        sz=len(self._buffer)
+        if self._need>sz:
+            #FRAME PIU' GRANDE DEL BUFFER
+            while sz<self._need:
+                sz*=2
+        elif ln==0 and sz>ConnectionBuffer._SIZE:
+            sz=ConnectionBuffer._SIZE
+        if sz!=len(self._buffer):
+            appbf=bytearray(sz)
+            appbf[0:ln]=buffer(self._buffer,self._start,ln)
+            self._buffer=appbf
+            self._view=memoryview(self._buffer)
+            self._start=0
+            self._end=ln
+        elif self._start>0 and (sz-self._end<ConnectionBuffer._READ_MIN or self._start+self._need>sz):
+            #SPOSTA I DATI RIMANENTI ALL'INIZIO
+            self._buffer[0:ln]=self._view[self._start:self._end].tobytes()
+            self._start=0
+            self._end=ln
+    
+    def _recv_into(self, sock):
+        sz=len(self._buffer)-self._end
+        if sz==0:
+            return 0
+        n=sock.recv_into(self._view[self._end:], sz)
+        if n is None:
+            n=0
+        self._end+=n
+        return n
+    
+    def recv(self, sock):
+        self._prepare()
+        if self._recv_into(sock)==0:
+            return False
+        #SSL PUO' AVERE DATI GIA' DECIFRATI NON VISIBILI AL POLLER
+        if hasattr(sock, 'pending'):
+            while sock.pending()>0:
+                self._prepare()
+                if self._recv_into(sock)==0:
+                    break
+        return True
+    
+    def parse_frames(self):
+        #RITORNA LISTA DI utils.Bytes; None INDICA FRAME CLOSE
+        frames=[]
+        dt=self._buffer
+        p=self._start
+        ln=self._end
+        self._need=0
+        while ln-p>=2:
+            bt0=dt[p]
+            bt1=dt[p+1]
+            #BIT MASK: CHIAVE DI 4 BYTE DOPO LA LUNGHEZZA (I FRAME DEL NODO NORMALMENTE NON SONO MASCHERATI)
+            bmask=(bt1 & 0x80)!=0
+            bt1=bt1 & 0x7F
+            hdsz=2
+            lendt=0
+            if bt1 <= 125:
+                lendt=bt1
+            elif bt1 == 126:
+                hdsz=4
+                if ln-p<hdsz:
+                    break
+                lendt=struct.unpack_from('!H',dt,p+2)[0]
+            elif bt1 == 127:
+                #LUNGHEZZA A 4 BYTE COME IN Connection._write_ws_header
+                hdsz=6
+                if ln-p<hdsz:
+                    break
+                lendt=struct.unpack_from('!I',dt,p+2)[0]
+            if bmask:
+                hdsz+=4
+            if ln-p<hdsz+lendt:
+                self._need=hdsz+lendt
+                break
+            if bt1==0:
+                p+=hdsz
+                if bt0 == 136: #CLOSE
+                    frames.append(None)
+                    break
+                #PONG O ALTRO
+                continue
+            #UNICA COPIA: IL PAYLOAD PUO' ESSERE TRATTENUTO DA CHI LO RICEVE
+            bts=utils.Bytes(buffer(dt,p+hdsz,lendt))
+            if bmask:
+                _ws_unmask(bts._pydata, dt[p+hdsz-4:p+hdsz])
+            frames.append(bts)
+            p+=hdsz+lendt
+        self._start=p
+        return frames
+
+
 class ConnectionReader(threading.Thread):
     
     def __init__(self, conn):
         threading.Thread.__init__(self, name="ConnectionReader")
         self.daemon=True
         self._connection = conn
-
-    def _read_fully(self, sock, ln):
-        data = []
-        cnt=0
-        while ln > cnt:
-            s = sock.recv(ln-cnt)
-            if s is None or len(s) == 0:
-                return ''
-            self._connection._tdalive.reset();
-            data.append(s)
-            cnt+=len(s)
-        return ''.join(data)
-        
     
     def run(self):
         #print "Thread read started: " + str(self._connection)        
         bfireclose=False
         bconnLost=True
         sock = self._connection.get_socket()
+        rbuf = ConnectionBuffer()
         try:
-            while not self._connection.is_shutdown():
-                data = self._read_fully(sock, 2)
-                if len(data) == 0:
+            bend=False
+            while not bend and not self._connection.is_shutdown():
+                if not rbuf.recv(sock):
                     bfireclose=not self._connection.is_close()
                     break
-                else:
-                    lendt=0;
-                    bt1=ord(data[1]);
-                    if bt1 <= 125:
-                        if bt1 > 0:
-                            lendt = bt1;
-                        else:
-                            bt0=ord(data[0]);
-                            if bt0 == 136: #CLOSE  
-                                bconnLost=False                              
-                                bfireclose=not self._connection.is_close()
-                                break
-                            elif bt0 == 138: #PONG
-                                #print "SESSION - PONG RICEVUTO!"
-                                continue
-                            else:
-                                continue    
-                    elif bt1 == 126:
-                        data = self._read_fully(sock, 2)
-                        if len(data) == 0:
-                            bfireclose=not self._connection.is_close()
-                            break
-                        lendt=struct.unpack('!H',data)[0]
-                    elif bt1 == 127:
-                        data = self._read_fully(sock, 4)
-                        if len(data) == 0:
-                            bfireclose=not self._connection.is_close()
-                            break
-                        lendt=struct.unpack('!I',data)[0]
-                    #Legge data
-                    if lendt>0:
-                        data = self._read_fully(sock, lendt)
-                        if len(data) == 0:
-                            bfireclose=not self._connection.is_close()
-                            break
-                    elif lendt==0:
-                        data=""
-                    else:
+                self._connection._tdalive.reset();
+                for dt in rbuf.parse_frames():
+                    if dt is None:
+                        bconnLost=False
                         bfireclose=not self._connection.is_close()
+                        bend=True
                         break
-                    self._connection.fire_data(utils.Bytes(data))
+                    self._connection.fire_data(dt)
                     
         except Exception as e:
             bfireclose=not self._connection.is_close()
@@ -1080,11 +1488,260 @@ class ConnectionReader(threading.Thread):
             self._connection.fire_except(e) 
         self._connection.shutdown()
         if bfireclose is True:
-            self._connection.fire_close(bconnLost)        
+            self._connection.fire_close(bconnLost)
         #print "Thread read stopped: " + str(self._connection)
-        
+
+
+class ReactorChannel():
+
+    def __init__(self, conn):
+        self._connection=conn
+        self._sock=conn.get_socket()
+        self._fd=self._sock.fileno()
+        self._buffer=ConnectionBuffer()
+        self._armed=False
+        self._keepalive_time=get_time()
+        self._keepalive_send=False
+        self._keepalive_gen=0
+
+    def get_connection(self):
+        return self._connection
+
+    def _recv(self):
+        return self._buffer.recv(self._sock)
+
+    def _parse_frames(self):
+        return self._buffer.parse_frames()
+
+
+class ConnectionReactor(threading.Thread):
+    _OPER_REGISTER = 0
+    _OPER_UNREGISTER = 1
+    _OPER_ARM = 2
+    _OPER_KEEPALIVE = 3
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="ConnectionReactor")
+        self.daemon=True
+        self._semaphore = threading.Condition()
+        #POLICY_BLOCK: CON POOL PIENO IL REACTOR ATTENDE (CALLER_RUNS ESEGUIREBBE _read BLOCCANTE NEL THREAD DEL REACTOR)
+        self._task_pool = ThreadPool("ConnectionIO", 1000, 4, None, 200, POLICY_BLOCK)
+        self._channels = {}
+        self._opers = []
+        self._timers = []
+        self._timers_seq = 0
+        self._last_time = get_time()
+        self._wakeup_send = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in [self._wakeup_r, self._wakeup_w]:
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._poller_ms = False
+            self._event_read = select.EPOLLIN | select.EPOLLPRI
+        else:
+            self._poller = select.poll()
+            self._poller_ms = True
+            self._event_read = select.POLLIN | select.POLLPRI
+        self._poller.register(self._wakeup_r, self._event_read)
+
+    def register(self, conn):
+        chl = ReactorChannel(conn)
+        self._add_oper(ConnectionReactor._OPER_REGISTER, chl)
+        return chl
+
+    def unregister(self, chl):
+        self._add_oper(ConnectionReactor._OPER_UNREGISTER, chl)
+
+    def _add_oper(self, op, chl):
+        bwakeup=False
+        self._semaphore.acquire()
+        try:
+            self._opers.append((op, chl))
+            if not self._wakeup_send:
+                self._wakeup_send=True
+                bwakeup=True
+        finally:
+            self._semaphore.release()
+        if bwakeup:
+            try:
+                os.write(self._wakeup_w, "W")
+            except OSError:
+                None
+
+    def _add_timer(self, chl, tm):
+        self._timers_seq+=1
+        heapq.heappush(self._timers, (tm, self._timers_seq, chl, chl._keepalive_gen))
+
+    def _arm(self, chl):
+        if not chl._armed and self._channels.get(chl._fd) is chl:
+            self._poller.register(chl._fd, self._event_read)
+            chl._armed=True
+
+    def _disarm(self, chl):
+        if chl._armed:
+            chl._armed=False
+            try:
+                self._poller.unregister(chl._fd)
+            except:
+                None
+
+    def _keepalive_reset(self, chl):
+        chl._keepalive_time=get_time()
+        chl._keepalive_send=False
+        chl._keepalive_gen+=1
+        self._add_timer(chl, chl._keepalive_time + (ConnectionCheckAlive._KEEPALIVE_INTERVALL-ConnectionCheckAlive._KEEPALIVE_THRESHOLD))
+
+    def _process_opers(self):
+        self._semaphore.acquire()
+        try:
+            appopers=self._opers
+            self._opers=[]
+            self._wakeup_send=False
+        finally:
+            self._semaphore.release()
+        try:
+            while True:
+                os.read(self._wakeup_r, 1024)
+        except OSError:
+            None
+        for op, chl in appopers:
+            try:
+                if op==ConnectionReactor._OPER_REGISTER:
+                    old=self._channels.get(chl._fd)
+                    if old is not None:
+                        self._disarm(old)
+                    self._channels[chl._fd]=chl
+                    self._keepalive_reset(chl)
+                    self._arm(chl)
+                elif op==ConnectionReactor._OPER_UNREGISTER:
+                    self._remove_channel(chl)
+                elif op==ConnectionReactor._OPER_ARM:
+                    self._arm(chl)
+                elif op==ConnectionReactor._OPER_KEEPALIVE:
+                    if chl._keepalive_send and self._channels.get(chl._fd) is chl:
+                        self._keepalive_reset(chl)
+            except Exception as e:
+                #ES. fd CHIUSO DOPO L'ACCODAMENTO: VIENE CHIUSO SOLO QUESTO CANALE, LE ALTRE OPERAZIONI PROSEGUONO
+                _write_except(e, u"ConnectionReactor operation error: ")
+                self._remove_channel(chl)
+                if op!=ConnectionReactor._OPER_UNREGISTER:
+                    self._task_pool.execute(self._close_channel, chl)
+
+    def _remove_channel(self, chl):
+        if self._channels.get(chl._fd) is chl:
+            self._disarm(chl)
+            del self._channels[chl._fd]
+        chl._keepalive_gen+=1
+
+    def _process_timers(self):
+        tm=get_time()
+        if tm<self._last_time: #Cambiato orario pc
+            delta=tm-self._last_time
+            self._timers=[(t[0]+delta, t[1], t[2], t[3]) for t in self._timers]
+            for chl in self._channels.values():
+                chl._keepalive_time+=delta
+        self._last_time=tm
+        while len(self._timers)>0:
+            tmr=self._timers[0]
+            if tmr[0]>tm:
+                return tmr[0]-tm
+            heapq.heappop(self._timers)
+            chl=tmr[2]
+            if tmr[3]!=chl._keepalive_gen or self._channels.get(chl._fd) is not chl:
+                continue
+            if not chl._keepalive_send:
+                chl._keepalive_send=True
+                self._add_timer(chl, chl._keepalive_time + (ConnectionCheckAlive._KEEPALIVE_INTERVALL+ConnectionCheckAlive._KEEPALIVE_THRESHOLD))
+                self._task_pool.execute(self._send_keep_alive, chl)
+            else:
+                chl._keepalive_gen+=1
+                self._disarm(chl)
+                del self._channels[chl._fd]
+                self._task_pool.execute(self._close_channel, chl)
+        return None
+
+    def _poll(self, tmout):
+        if self._poller_ms:
+            if tmout is not None:
+                tmout=int(math.ceil(tmout*1000.0))
+        elif tmout is None:
+            tmout=-1
+        try:
+            return self._poller.poll(tmout)
+        except (IOError, select.error) as e:
+            if e.args[0]==errno.EINTR:
+                return []
+            raise e
+
+    def run(self):
+        while True:
+            try:
+                self._process_opers()
+                tmout=self._process_timers()
+                for fd, ev in self._poll(tmout):
+                    if fd==self._wakeup_r:
+                        continue
+                    chl=self._channels.get(fd)
+                    if chl is not None and chl._armed:
+                        self._disarm(chl)
+                        self._task_pool.execute(self._read, chl)
+            except Exception as e:
+                _write_except(e, u"ConnectionReactor error: ")
+                time.sleep(0.1)
+
+    def _send_keep_alive(self, chl):
+        try:
+            conn=chl.get_connection()
+            if not conn.is_close():
+                conn._send_ws_ping()
+        except Exception:
+            None
+
+    def _close_channel(self, chl):
+        conn=chl.get_connection()
+        bfireclose=not conn.is_close()
+        conn.shutdown()
+        if bfireclose is True:
+            conn.fire_close(True)
+
+    def _read(self, chl):
+        conn=chl.get_connection()
+        bend=False
+        bfireclose=False
+        bconnLost=True
+        try:
+            if conn.is_shutdown():
+                return
+            if not chl._recv():
+                bend=True
+                bfireclose=not conn.is_close()
+            else:
+                if chl._keepalive_send:
+                    self._add_oper(ConnectionReactor._OPER_KEEPALIVE, chl)
+                for dt in chl._parse_frames():
+                    if dt is None:
+                        bend=True
+                        bconnLost=False
+                        bfireclose=not conn.is_close()
+                        break
+                    conn.fire_data(dt)
+        except Exception as e:
+            bend=True
+            bfireclose=not conn.is_close()
+            conn.fire_except(e)
+        if bend:
+            conn.shutdown()
+            if bfireclose is True:
+                conn.fire_close(bconnLost)
+        elif not conn.is_shutdown():
+            self._add_oper(ConnectionReactor._OPER_ARM, chl)
+
 
 class Connection:
+    _HEADER_SIZE_MAX = 10
+    _SEND_BUFFER_SIZE = SEND_BATCH_SIZE + 1024
             
     def __init__(self, events):
         self._close=True
@@ -1106,6 +1763,9 @@ class Connection:
         self._sock = None
         self._tdalive = None
         self._tdread = None
+        self._reactor_channel = None
+        self._header_buffer = utils.Bytes(bytearray(Connection._HEADER_SIZE_MAX))
+        self._send_buffer = None
                 
             
     def open(self, prop, proxy_info):
@@ -1146,13 +1806,17 @@ class Connection:
             self._close=False
             self._sock.settimeout(None)
             
-            #Avvia thread alive
-            self._tdalive = ConnectionCheckAlive(self)
-            self._tdalive.start()
-    
-            #Avvia thread lettura
-            self._tdread = ConnectionReader(self)
-            self._tdread.start()
+            if get_io_mode()==IO_MODE_REACTOR:
+                #Registra il socket nel reactor (lettura e keepalive)
+                self._reactor_channel = _get_reactor().register(self)
+            else:
+                #Avvia thread alive
+                self._tdalive = ConnectionCheckAlive(self)
+                self._tdalive.start()
+        
+                #Avvia thread lettura
+                self._tdread = ConnectionReader(self)
+                self._tdread.start()
             return resp            
                             
         except Exception as e:
@@ -1162,9 +1826,18 @@ class Connection:
     def get_socket(self):
         return self._sock
     
+    def is_secure(self):
+        return isinstance(self._sock, ssl.SSLSocket)
+    
    
-    def send(self, data):
-        self._send_ws_data(data)        
+    def send(self, data, p=0, ln=None):
+        if ln is None:
+            ln=len(data)-p
+        self._send_ws_data([(data, p, ln)])
+    
+    def send_frames(self, ardata):
+        #ARDATA: LISTA DI Bytes O (Bytes, pos, len); OGNI ELEMENTO E' UN FRAME
+        self._send_ws_data(ardata)
         
     def fire_data(self, dt):
         if self._on_data is not None:
@@ -1188,70 +1861,69 @@ class Connection:
         if self._on_except is not None:
             self._on_except(e) 
     
-    def _send_ws_data(self,data):
+    def _write_ws_header(self, bts, p, opcode, length):
+        b0 = 0x80 | (opcode % 128)
+        rnd=0 #random.randint(0,2147483647)
+        if length <= 125:
+            bts.pack_into("!BBI", p, b0, 0x80 | length, rnd)
+            return 6
+        elif length <= 0xFFFF:
+            bts.pack_into("!BBHI", p, b0, 0xFE, length, rnd)
+            return 8
+        else:
+            bts.pack_into("!BBII", p, b0, 0xFF, length, rnd)
+            return 10
+    
+    def _send_ws_data(self, ardata):
         self._semaphore_send.acquire()
         try:
-            bts = utils.Bytes()
-            b0 = 0;
-            b0 |= 1 << 7;
-            b0 |= 0x2 % 128;
-            length = len(data);
-            if length <= 125:
-                bts.append_byte(b0)
-                bts.append_byte(0x80 | length)
-            elif length <= 0xFFFF:
-                bts.append_byte(b0)
-                bts.append_byte(0xFE)
-                bts.append_byte(length >> 8 & 0xFF)
-                bts.append_byte(length & 0xFF)
-            else: 
-                bts.append_byte(b0)
-                bts.append_byte(0xFF)
-                bts.append_int(length)
-    
-            rnd=0
-            bts.append_int(rnd)
-            bts.append_bytes(data)
             if self._sock is None:
                 raise Exception('connection closed.')
-            utils.socket_sendall(self._sock,bts,0,len(bts))
+            if self._send_buffer is None:
+                self._send_buffer = utils.Bytes(bytearray(Connection._SEND_BUFFER_SIZE))
+            bts = self._send_buffer
+            bp = 0
+            for itm in ardata:
+                if isinstance(itm, tuple):
+                    data, p, ln = itm
+                else:
+                    data, p, ln = itm, 0, len(itm)
+                if bp+Connection._HEADER_SIZE_MAX+ln>Connection._SEND_BUFFER_SIZE:
+                    bbig = Connection._HEADER_SIZE_MAX+ln>Connection._SEND_BUFFER_SIZE
+                    if bp>0 and (not bbig or bp+Connection._HEADER_SIZE_MAX>Connection._SEND_BUFFER_SIZE):
+                        utils.socket_sendall(self._sock,bts,0,bp)
+                        bp=0
+                    if bbig:
+                        #PAYLOAD GRANDE: HEADER (INSIEME AI FRAME IN CODA) POI PAYLOAD SENZA COPIA
+                        bp+=self._write_ws_header(bts, bp, 0x2, ln)
+                        utils.socket_sendall(self._sock,bts,0,bp)
+                        utils.socket_sendall(self._sock,data,p,ln)
+                        bp=0
+                        continue
+                bp+=self._write_ws_header(bts, bp, 0x2, ln)
+                if ln>0:
+                    bts.set_bytes(bp, data, p, ln)
+                    bp+=ln
+            if bp>0:
+                utils.socket_sendall(self._sock,bts,0,bp)
         finally:
             self._semaphore_send.release()
-        
-            
-    def _send_ws_close(self):
+    
+    def _send_ws_control(self, opcode):
         self._semaphore_send.acquire()
         try:
-            bts = utils.Bytes()
-            b0 = 0;
-            b0 |= 1 << 7;
-            b0 |= 0x8 % 128;
-            bts.append_byte(b0)
-            bts.append_byte(0x80 | 0)
-            rnd=0 #random.randint(0,2147483647)
-            bts.append_int(rnd)
             if self._sock is None:
                 raise Exception('connection closed.')
-            utils.socket_sendall(self._sock,bts,0,len(bts))
+            ln=self._write_ws_header(self._header_buffer, 0, opcode, 0)
+            utils.socket_sendall(self._sock,self._header_buffer,0,ln)
         finally:
             self._semaphore_send.release()
+            
+    def _send_ws_close(self):
+        self._send_ws_control(0x8)
     
     def _send_ws_ping(self):
-        self._semaphore_send.acquire()
-        try:
-            bts = utils.Bytes()
-            b0 = 0
-            b0 |= 1 << 7;
-            b0 |= 0x9 % 128;
-            bts.append_byte(b0)
-            bts.append_byte(0x80 | 0)
-            rnd=0 #random.randint(0,2147483647)
-            bts.append_int(rnd)
-            if self._sock is None:
-                raise Exception('connection closed.')
-            utils.socket_sendall(self._sock,bts,0,len(bts))
-        finally:
-            self._semaphore_send.release()
+        self._send_ws_control(0x9)
         
 
     def is_close(self):
@@ -1329,6 +2001,11 @@ class Connection:
             #    self._tdread.join(5000)
             self._tdread = None
             
+            #Rimuove il socket dal reactor
+            if self._reactor_channel is not None:
+                _get_reactor().unregister(self._reactor_channel)
+                self._reactor_channel = None
+            
             try:                
                 self._sock.shutdown(socket.SHUT_RDWR)
             except:
@@ -1338,6 +2015,7 @@ class Connection:
             except:
                 None
             self._sock = None
+            self._send_buffer = None
             self._prop = None
             self._proxy_info = None
         
\ No newline at end of file
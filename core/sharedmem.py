@@ -18,6 +18,8 @@ import random
 import json
 import utils
 import threading
+import select
+import errno
 import _multiprocessing
 import multiprocessing.synchronize
 import multiprocessing.forking
@@ -46,9 +48,31 @@ import native
 # SIDE 1 CREA IL FILE
 
 
+#FORMATO V2 (RING SPSC)
+# 80 byte condition handle
+# 80: 4 byte magic DWS2, 4 byte capacita' di ogni ring (potenza di 2, nativo)
+# SIDE 1 parte da 128, SIDE 2 da 320:
+#   +0 stato, +1 keepalive, +4 pid (come V1)
+#   +64 contatore write del proprio ring (8 byte nativo, allineato)
+#   +128 contatore read del ring dell'altro lato (8 byte nativo, allineato)
+# DATA: ring side 1 a 4096, ring side 2 a 4096+capacita'
+# I CONTATORI SONO MONOTONI: posizione = contatore & (capacita'-1)
+# OGNI CONTATORE E' SCRITTO DA UN SOLO LATO
+# I CONTATORI SONO PUBBLICATI CON SCRITTURE ORDINARIE (struct.pack_into) SENZA BARRIERE DI MEMORIA:
+# E' CORRETTO SOLO SU x86-64 (STORE NON RIORDINATI TRA LORO E SCRITTURE DA 8 BYTE ALLINEATE ATOMICHE)
+# SU ALTRE ARCHITETTURE (ARM, x86 A 32 BIT) IL DEFAULT RESTA V1
+
+
 CONDITION_SIZE_BYTE=80
 SHAREDMEM_PATH="sharedmem"
 
+STREAM_V2_MAGIC="DWS2"
+STREAM_V2_SIDE_POS=[128, 320]
+STREAM_V2_DATA_POS=4096
+STREAM_V2_CAPACITY=512*1024
+STREAM_V2_CAPACITY_MIN=4096
+STREAM_V2_TOKEN_VIEW_MIN=64*1024
+
 _sharememmap={}
 _sharememmap["semaphore"] = threading.Condition()
 
@@ -262,6 +286,130 @@ class Condition(multiprocessing.synchronize.Condition):
             self._lock.destroy()
             self._semlock=None   
 
+def is_notifier_available():
+    return not utils.is_windows() and hasattr(os, "mkfifo")
+
+def get_stream_default_version():
+    #V2 SOLO SU x86-64 CON PROCESSO A 64 BIT (VEDI FORMATO V2)
+    if struct.calcsize("P")==8 and platform.machine().lower() in ["x86_64", "amd64", "x64"]:
+        return 2
+    return 1
+
+
+class StreamNotifier():
+    #NOTIFICA TRAMITE FIFO CON NOME (UNA PER LATO): OGNI LATO ATTENDE SULLA PROPRIA
+    #E SCRIVE SU QUELLA DELL'ALTRO LATO DOPO OGNI AGGIORNAMENTO DEI PUNTATORI
+    #PIU' THREAD DELLO STESSO LATO (ES. LETTORE E SCRITTORE) POSSONO ATTENDERE: UNO SOLO ESEGUE select
+    #SULLA FIFO E DOPO LA LETTURA RISVEGLIA GLI ALTRI CON notify_all (COME LA Condition CONDIVISA)
+    
+    def __init__(self, name, side):
+        self._path_read=self._get_path(name, side)
+        if side==1:
+            self._path_write=self._get_path(name, 2)
+        else:
+            self._path_write=self._get_path(name, 1)
+        self._fdread=None
+        self._fdkeep=None
+        self._fdwrite=None
+        self._semaphore=threading.Condition()
+        self._reading=False
+    
+    def _get_path(self, name, side):
+        return SHAREDMEM_PATH + utils.path_sep + "stream_" + name + "_" + str(side) + ".fifo"
+    
+    def create(self, fixperm=None):
+        for pth in [self._path_read, self._path_write]:
+            if utils.path_exists(pth):
+                utils.path_remove(pth)
+            os.mkfifo(pth, 0o600)
+            if fixperm is not None:
+                fixperm(pth)
+        self._open_read()
+    
+    def open(self):
+        if not utils.path_exists(self._path_read) or not utils.path_exists(self._path_write):
+            return False
+        self._open_read()
+        return True
+    
+    def is_other_ready(self):
+        #L'ALTRO LATO HA APERTO LA PROPRIA FIFO IN LETTURA (ENXIO SE NESSUN LETTORE)
+        if self._fdwrite is not None:
+            return True
+        try:
+            self._fdwrite=os.open(self._path_write, os.O_WRONLY | os.O_NONBLOCK)
+            return True
+        except OSError as e:
+            if e.errno!=errno.ENXIO:
+                raise e
+            return False
+    
+    def _open_read(self):
+        self._fdread=os.open(self._path_read, os.O_RDONLY | os.O_NONBLOCK)
+        #TIENE APERTO UN WRITER PER EVITARE EOF CONTINUI SE L'ALTRO LATO CHIUDE
+        self._fdkeep=os.open(self._path_read, os.O_WRONLY | os.O_NONBLOCK)
+    
+    def notify(self):
+        try:
+            if self._fdwrite is None:
+                self._fdwrite=os.open(self._path_write, os.O_WRONLY | os.O_NONBLOCK)
+            os.write(self._fdwrite, "N")
+        except OSError as e:
+            #ENXIO: L'ALTRO LATO NON HA ANCORA APERTO; EAGAIN: NOTIFICA GIA' PENDENTE
+            if e.errno!=errno.ENXIO and e.errno!=errno.EAGAIN:
+                raise e
+    
+    def wait(self, timeout):
+        self._semaphore.acquire()
+        try:
+            if self._reading:
+                #UN ALTRO THREAD E' IN select: ATTENDE LA FINE DELLA SUA ATTESA (AL MASSIMO IL SUO TIMEOUT)
+                self._semaphore.wait()
+                return
+            self._reading=True
+        finally:
+            self._semaphore.release()
+        try:
+            try:
+                r, w, x = select.select([self._fdread], [], [], timeout)
+            except select.error as e:
+                if e[0]!=errno.EINTR:
+                    raise e
+                return
+            if len(r)>0:
+                try:
+                    os.read(self._fdread, 4096)
+                except OSError as e:
+                    if e.errno!=errno.EAGAIN:
+                        raise e
+        finally:
+            self._semaphore.acquire()
+            try:
+                self._reading=False
+                self._semaphore.notify_all()
+            finally:
+                self._semaphore.release()
+    
+    def close(self):
+        for fd in [self._fdread, self._fdkeep, self._fdwrite]:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except:
+                    None
+        self._fdread=None
+        self._fdkeep=None
+        self._fdwrite=None
+    
+    def destroy(self):
+        for pth in [self._path_read, self._path_write]:
+            try:
+                if utils.path_exists(pth):
+                    utils.path_remove(pth)
+            except:
+                None
+
+
 class Stream():
         
     def __init__(self):
@@ -272,15 +420,26 @@ class Stream():
     def _is_init(self):
         return self._binit
         
-    def create(self,fixperm=None):
+    def create(self,fixperm=None,capacity=None,version=None):
         self._semaphore.acquire()
         try:
             if self._binit==True:
                 raise Exception("Shared file already initialized.")
             self._side=1
-            self._mapfile = sharedmem_manager.createStream(fixperm)
+            if version is None:
+                version=get_stream_default_version()
+            self._version=version
+            if self._version==2:
+                if capacity is None:
+                    capacity=STREAM_V2_CAPACITY
+                self._capacity=STREAM_V2_CAPACITY_MIN
+                while self._capacity<capacity:
+                    self._capacity*=2
+                self._mapfile = sharedmem_manager.createStream(fixperm, STREAM_V2_DATA_POS+2*self._capacity)
+            else:
+                self._mapfile = sharedmem_manager.createStream(fixperm)
             self._size = self._mapfile.get_size()
-            self._initialize()
+            self._initialize(fixperm)
             return self._mapfile.get_name()
         finally:
             self._semaphore.release() 
@@ -294,6 +453,10 @@ class Stream():
             
             self._mapfile = sharedmem_manager.openStream(fname)
             self._size=self._mapfile.get_size()
+            self._version=1
+            if self._size>=STREAM_V2_DATA_POS and self._mapfile.get_view(CONDITION_SIZE_BYTE,4)[:]==STREAM_V2_MAGIC:
+                self._version=2
+                self._capacity=self._mapfile.unpack_from("=I", CONDITION_SIZE_BYTE+4)[0]
             self._initialize()
         finally:
             self._semaphore.release() 
@@ -358,7 +521,7 @@ class Stream():
         finally:
             self._semaphore.release()
         
-    def _initialize(self):
+    def _initialize(self, fixperm=None):
         try:
             self._binit=True
             self._terminate_time=0
@@ -366,7 +529,29 @@ class Stream():
             self._side_size=(self._size-CONDITION_SIZE_BYTE)/2
             self._condition_shared=None
             self._condition_shared_pos=0
-            if self._side==1:
+            self._notifier=None
+            self._notifier_checked=False
+            if is_notifier_available():
+                #SE IL LATO 1 HA CREATO LE FIFO NON SERVONO I SEMAFORI CONDIVISI
+                appntf=StreamNotifier(self._mapfile.get_name(), self._side)
+                if self._side==1:
+                    try:
+                        appntf.create(fixperm)
+                        self._notifier=appntf
+                    except:
+                        appntf.close()
+                        appntf.destroy()
+                else:
+                    #SE LE FIFO NON SI POSSONO APRIRE (ES. EACCES) USA I SEMAFORI CONDIVISI
+                    #IL LATO 1 SE NE ACCORGE IN _check_notifier E CREA I SEMAFORI
+                    try:
+                        if appntf.open():
+                            self._notifier=appntf
+                    except:
+                        appntf.close()
+            if self._version==2:
+                self._init_positions_v2()
+            elif self._side==1:
                 self._state_pos=CONDITION_SIZE_BYTE+0
                 self._alive_pos=CONDITION_SIZE_BYTE+1            
                 self._pid_pos=CONDITION_SIZE_BYTE+2
@@ -396,7 +581,9 @@ class Stream():
             self._last_write_time=long(time.time() * 1000)        
             self._mapfile.seek(0)
             self._mapfile.write(struct.pack("!qiqqiqqiqqiq", -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1))
-            if self._side==1:
+            if self._version==2:
+                self._init_header_v2()
+            elif self._side==1:
                 self._mapfile.seek(CONDITION_SIZE_BYTE)
                 self._mapfile.write(struct.pack('!cciii','C','K',os.getpid(),0,0))            
                 self._mapfile.seek(CONDITION_SIZE_BYTE+self._side_size)
@@ -405,23 +592,91 @@ class Stream():
             elif self._side==2:
                 self._mapfile.seek(CONDITION_SIZE_BYTE+self._side_size)            
                 self._mapfile.write(struct.pack('!cciii','C','K',os.getpid(),0,0))
+                self._notify()
         except Exception as ex:
+            if self._notifier is not None:
+                self._notifier.close()
+                if self._side==1:
+                    self._notifier.destroy()
             self._mapfile.close()
             self._mapfile.destroy()
             raise ex
         sharedmem_manager.add(self); 
+    
+    def _init_positions_v2(self):
+        if self._side==1:
+            spos=STREAM_V2_SIDE_POS[0]
+            opos=STREAM_V2_SIDE_POS[1]
+            self._write_data_pos=STREAM_V2_DATA_POS
+            self._read_data_pos=STREAM_V2_DATA_POS+self._capacity
+        else:
+            spos=STREAM_V2_SIDE_POS[1]
+            opos=STREAM_V2_SIDE_POS[0]
+            self._write_data_pos=STREAM_V2_DATA_POS+self._capacity
+            self._read_data_pos=STREAM_V2_DATA_POS
+        self._state_pos=spos
+        self._alive_pos=spos+1
+        self._pid_pos=spos+4
+        self._write_cnt_pos=spos+64
+        self._read_cnt_pos=spos+128
+        self._state_other_pos=opos
+        self._alive_other_pos=opos+1
+        self._pid_other_pos=opos+4
+        self._write_cnt_other_pos=opos+64
+        self._read_cnt_other_pos=opos+128
+        self._mask=self._capacity-1
+    
+    def _init_header_v2(self):
+        if self._side==1:
+            self._mapfile.seek(CONDITION_SIZE_BYTE)
+            self._mapfile.write(STREAM_V2_MAGIC)
+            self._mapfile.pack_into("=I", CONDITION_SIZE_BYTE+4, self._capacity)
+            for spos, st, pid in [(STREAM_V2_SIDE_POS[0], 'C', os.getpid()), (STREAM_V2_SIDE_POS[1], 'W', -1)]:
+                self._mapfile.seek(spos)
+                self._mapfile.write(struct.pack('!cc', st, 'K'))
+                self._mapfile.pack_into("!i", spos+4, pid)
+                self._mapfile.pack_into("=Q", spos+64, 0)
+                self._mapfile.pack_into("=Q", spos+128, 0)
+            self._waitconn_tm=long(time.time() * 1000)
+        else:
+            self._mapfile.seek(self._state_pos)
+            self._mapfile.write(struct.pack('!cc', 'C', 'K'))
+            self._mapfile.pack_into("!i", self._pid_pos, os.getpid())
+            self._notify()
         
+    def _create_condition_shared(self, cpid):
+        self._condition_shared=Condition()    
+        lp=self._condition_shared.create(cpid);
+        self._mapfile.pack_into("!qiqqiqqiqqiq", self._condition_shared_pos, lp[0][0], lp[0][1], lp[0][2], lp[1][0], lp[1][1], lp[1][2], lp[2][0], lp[2][1], lp[2][2], lp[3][0], lp[3][1], lp[3][2])
+    
+    def _check_notifier(self):
+        #LATO 1: QUANDO IL LATO 2 E' CONNESSO VERIFICA CHE ABBIA APERTO LE FIFO
+        #SE NON LE HA APERTE CREA I SEMAFORI CONDIVISI (RITORNA True)
+        cpid=self._mapfile.unpack_from("!i", self._pid_other_pos)[0]
+        if cpid==-1:
+            return False
+        if self._notifier.is_other_ready():
+            self._notifier_checked=True
+            return False
+        if self._condition_shared is None:
+            self._create_condition_shared(cpid)
+        return True
+    
     def _initlock(self):    
+        if self._notifier is not None:
+            if self._side!=1 or self._notifier_checked or not self._check_notifier():
+                return
+            #IL LATO 2 USA I SEMAFORI: PASSA AI SEMAFORI FUORI DAI CICLI DI ATTESA
+            self._notifier.close()
+            self._notifier.destroy()
+            self._notifier=None
         while self._condition_shared is None:
             if self._side==1:
                 #LEGGE PID REMOTO PER CREARE LOCK
                 self._mapfile.seek(self._pid_other_pos)
                 cpid=struct.unpack('!i', self._mapfile.read(4))[0]
                 if cpid!=-1:                                                            
-                    self._condition_shared=Condition()    
-                    lp=self._condition_shared.create(cpid);
-                    self._mapfile.seek(self._condition_shared_pos)
-                    self._mapfile.write(struct.pack("!qiqqiqqiqqiq", lp[0][0], lp[0][1], lp[0][2], lp[1][0], lp[1][1], lp[1][2], lp[2][0], lp[2][1], lp[2][2], lp[3][0], lp[3][1], lp[3][2]))
+                    self._create_condition_shared(cpid)
                     
             elif self._side==2:
                 #LEGGE LOCKID PER CONNETTESI AI LOCK
@@ -436,8 +691,36 @@ class Stream():
                         lp.append((applp[9],applp[10],applp[11]))
                         self._condition_shared=Condition()    
                         self._condition_shared.connect(lp)
-                                                    
-            time.sleep(0.2)
+            
+            if self._condition_shared is None:
+                time.sleep(0.2)
+    
+    def _wait_acquire(self):
+        if self._notifier is None:
+            self._condition_shared.acquire()
+    
+    def _wait_release(self):
+        if self._notifier is None:
+            self._condition_shared.release()
+    
+    def _wait(self, timeout):
+        if self._notifier is not None:
+            if self._side==1 and not self._notifier_checked:
+                #PUBBLICA I SEMAFORI ANCHE SE IL LATO 1 E' GIA' IN ATTESA (IL CAMBIO AVVIENE IN _initlock)
+                self._check_notifier()
+            self._notifier.wait(timeout)
+        elif self._condition_shared is not None:
+            self._condition_shared.wait(timeout)
+        else:
+            time.sleep(timeout)
+    
+    def _notify(self):
+        if self._notifier is not None:
+            self._notifier.notify()
+        elif self._condition_shared is not None:
+            self._condition_shared.acquire()
+            self._condition_shared.notify_all()
+            self._condition_shared.release()
 
         
     def _terminate(self):
@@ -452,6 +735,12 @@ class Stream():
                 self._mapfile.close()                
             except Exception as e:
                 serr+="Error shared file close: " + str(e) + ";"
+            if self._notifier is not None:
+                try:
+                    self._notifier.notify()
+                except:
+                    None
+                self._notifier.close()
             if self._condition_shared is not None:
                 self._condition_shared.destroy()
             if (serr!=""):
@@ -466,6 +755,8 @@ class Stream():
                     try:
                         self._terminate_retry+=1
                         self._mapfile.destroy()
+                        if self._notifier is not None:
+                            self._notifier.destroy()
                     except Exception as e:
                         if self._terminate_retry>=5:
                             raise e
@@ -482,6 +773,10 @@ class Stream():
             if self._mapfile is not None:
                 self._mapfile.seek(self._state_pos)
                 self._mapfile.write('X')
+                try:
+                    self._notify()
+                except:
+                    None
                 
     def close(self):
         self._semaphore.acquire()
@@ -560,20 +855,23 @@ class Stream():
             self._close()
             raise Exception("Shared file closed. (2)")
         while othstate=="W":
-            time.sleep(0.2)
+            self._wait(0.2)
             if not self._is_init():
                 raise Exception("Shared file closed. (3)");
             locstate, othstate = self._get_state()
             if locstate=="X" or othstate=="X" or othstate=="T":
                 self._close()
                 raise Exception("Shared file closed. (4)")
+        if self._version==2:
+            self._write_v2(data)
+            return
         pw=self._get_pointer(self._write_pnt_pos)
         apps=data
         dtpos=0
         towrite=len(apps)                
         while towrite>0:
             #Attende lettura da parte dell'altro side
-            self._condition_shared.acquire()
+            self._wait_acquire()
             try:
                 while True:
                     pr=self._get_pointer(self._write_pnt_pos+4)
@@ -585,7 +883,7 @@ class Stream():
                     elif pr<pw:
                         if self._write_limit-self._write_data_pos-pw+pr>1:
                             break
-                    self._condition_shared.wait(0.5)
+                    self._wait(0.5)
                     
                     #VERIFICA CHIUSURA
                     if not self._is_init():
@@ -595,7 +893,7 @@ class Stream():
                         self._close()
                         raise Exception("Shared file closed. (6)")       
             finally:
-                self._condition_shared.release()
+                self._wait_release()
             
             self._semaphore.acquire()
             try:
@@ -641,17 +939,129 @@ class Stream():
                 self._semaphore.release()
                 
             #NOTIFICA IL CAMBIAMENTO
-            self._condition_shared.acquire()
-            self._condition_shared.notify_all()
-            self._condition_shared.release()
+            self._notify()
+                
+    def _write_v2(self, data):
+        #UN SOLO SCRITTORE PER RING: NESSUN LOCK SUI DATI
+        wc=self._mapfile.unpack_from("=Q", self._write_cnt_pos)[0]
+        dtpos=0
+        towrite=len(data)
+        while towrite>0:
+            self._wait_acquire()
+            try:
+                while True:
+                    rc=self._mapfile.unpack_from("=Q", self._read_cnt_other_pos)[0]
+                    free=self._capacity-(wc-rc)
+                    if free>0:
+                        break
+                    self._wait(0.5)
+                    
+                    #VERIFICA CHIUSURA
+                    if not self._is_init():
+                        raise Exception("Shared file closed. (5)");
+                    locstate, othstate = self._get_state()
+                    if locstate=="X" or othstate=="X" or othstate=="T":
+                        self._close()
+                        raise Exception("Shared file closed. (6)")
+            finally:
+                self._wait_release()
+            
+            pos=wc & self._mask
+            appsz=min(towrite, free, self._capacity-pos)
+            self._mapfile.write_at(self._write_data_pos+pos, data, dtpos, appsz)
+            wc+=appsz
+            dtpos+=appsz
+            towrite-=appsz
+            #IL CONTATORE VIENE AGGIORNATO SOLO DOPO LA COPIA DEI DATI
+            self._mapfile.pack_into("=Q", self._write_cnt_pos, wc)
+            
+            #NOTIFICA IL CAMBIAMENTO
+            self._notify()
+    
+    def _wait_readable_v2(self, timeout):
+        #RITORNA (contatore read, byte disponibili) None SE CHIUSO, 0 byte SE TIMEOUT
+        rc=self._mapfile.unpack_from("=Q", self._read_cnt_pos)[0]
+        tm=long(time.time() * 1000)
+        self._wait_acquire()
+        try:
+            while True:
+                wc=self._mapfile.unpack_from("=Q", self._write_cnt_other_pos)[0]
+                if wc!=rc:
+                    return rc, wc-rc
+                #VERIFICA CHIUSURA
+                locstate, appstate = self._get_state()
+                if not self._is_init() or appstate=="X" or appstate=="T":
+                    self._close();
+                    return None
+                self._wait(0.5)
                 
+                #VERIFICA TIMEOUT
+                elapsed=long(time.time() * 1000)-tm
+                if timeout>0:
+                    if elapsed<0: #Cambiato orario pc
+                        tm=long(time.time() * 1000)
+                    elif elapsed>=timeout:
+                        return rc, 0
+        finally:
+            self._wait_release()
+    
+    def _read_v2(self, timeout, maxbyte, dtread):
+        appw=self._wait_readable_v2(timeout)
+        if appw is None:
+            return None
+        rc, avail = appw
+        if avail==0:
+            return ""
+        if maxbyte>0 and avail>maxbyte:
+            avail=maxbyte
+        pos=rc & self._mask
+        appsz=min(avail, self._capacity-pos)
+        self._mapfile.read_at(self._read_data_pos+pos, dtread, appsz)
+        if avail>appsz:
+            self._mapfile.read_at(self._read_data_pos, dtread, avail-appsz)
+        self._mapfile.pack_into("=Q", self._read_cnt_pos, rc+avail)
+        
+        #NOTIFICA IL CAMBIAMENTO
+        self._notify()
+        return dtread
+    
+    def read_view(self,timeout=0,maxbyte=0): #0 infinite
+        #RITORNA UN buffer SULLA PARTE CONTIGUA LEGGIBILE SENZA COPIA
+        #IL buffer RESTA VALIDO FINO A read_commit (POI LO SPAZIO PUO' ESSERE RISCRITTO DALL'ALTRO LATO)
+        if not self._is_init():
+            return None
+        if self._version!=2:
+            raise Exception("Shared file view not supported.")
+        self._initlock()
+        appw=self._wait_readable_v2(timeout)
+        if appw is None:
+            return None
+        rc, avail = appw
+        if avail==0:
+            return ""
+        if maxbyte>0 and avail>maxbyte:
+            avail=maxbyte
+        pos=rc & self._mask
+        return self._mapfile.get_view(self._read_data_pos+pos, min(avail, self._capacity-pos))
+    
+    def read_commit(self,sz):
+        if not self._is_init():
+            return
+        rc=self._mapfile.unpack_from("=Q", self._read_cnt_pos)[0]
+        self._mapfile.pack_into("=Q", self._read_cnt_pos, rc+sz)
+        
+        #NOTIFICA IL CAMBIAMENTO
+        self._notify()
+    
     def read(self,timeout=0,maxbyte=0): #0 infinite
         if not self._is_init():
             return None
         self._initlock()
+        if self._version==2:
+            return self._read_v2(timeout, maxbyte, utils.Bytes())
         pr=self._get_pointer(self._read_pnt_pos)
         tm=long(time.time() * 1000)
-        self._condition_shared.acquire()
+        self._wait_acquire()
         try:
             while True:
                 pw=self._get_pointer(self._read_pnt_pos-4)
@@ -662,7 +1072,7 @@ class Stream():
                 if not self._is_init() or appstate=="X" or appstate=="T":
                     self._close();
                     return None
-                self._condition_shared.wait(0.5)
+                self._wait(0.5)
                             
                 #VERIFICA TIMEOUT
                 elapsed=long(time.time() * 1000)-tm
@@ -672,7 +1082,7 @@ class Stream():
                     elif elapsed>=timeout:
                         return ""
         finally:
-            self._condition_shared.release()
+            self._wait_release()
         
         dtread = utils.Bytes()
         self._semaphore.acquire()
@@ -713,9 +1123,7 @@ class Stream():
             self._semaphore.release()
         
         #NOTIFICA IL CAMBIAMENTO
-        self._condition_shared.acquire()
-        self._condition_shared.notify_all()
-        self._condition_shared.release()
+        self._notify()
         return dtread;
     
     def write_token(self,data):
@@ -724,20 +1132,41 @@ class Stream():
         dtwrite.append_bytes(data)
         self.write(dtwrite)
     
+    def _read_into(self, bts, sz):
+        while len(bts)<sz:
+            if self._version==2 and self._is_init():
+                self._initlock()
+                if self._read_v2(0, sz-len(bts), bts) is None:
+                    return False
+            else:
+                bf=self.read(maxbyte=sz-len(bts))
+                if bf==None:
+                    return False
+                bts.append_bytes(bf)
+        return True
+    
     def read_token(self):
         bfl = utils.Bytes()
-        while len(bfl)<4:
-            bf=self.read(maxbyte=4-len(bfl))
-            if bf==None:
-                return None
-            bfl.append_bytes(bf)
+        if not self._read_into(bfl, 4):
+            return None
         ln=bfl.get_int()
+        if self._version==2 and ln>=STREAM_V2_TOKEN_VIEW_MIN:
+            return self._read_token_view(ln)
+        bfret = utils.Bytes()
+        if not self._read_into(bfret, ln):
+            return None
+        return bfret
+    
+    def _read_token_view(self, ln):
+        #TOKEN GRANDI (FRAME): OGNI PARTE CONTIGUA DEL RING E' COPIATA DALLA VISTA DIRETTAMENTE NEL TOKEN
+        #(UNA SOLA COPIA, NESSUNA STRINGA INTERMEDIA COME mmap.read) E LO SPAZIO E' RILASCIATO CON read_commit
         bfret = utils.Bytes()
         while len(bfret)<ln:
-            bf=self.read(maxbyte=ln-len(bfret))
-            if bf==None:
+            vw=self.read_view(maxbyte=ln-len(bfret))
+            if vw is None:
                 return None
-            bfret.append_bytes(bf)
+            bfret._pydata+=vw
+            self.read_commit(len(vw))
         return bfret
 
 class Property():
@@ -891,6 +1320,8 @@ class MapFile():
     
     def __init__(self):
         self._mmap=None
+        self._mmap_addr=None
+        self._size=MapFile._SIZE
         self.bcreate=False
         self.bdestroy=True
         
@@ -921,9 +1352,9 @@ class MapFile():
                     if self.fd!=-1:
                         self.ftype="M"
                         try:
-                            os.ftruncate(self.fd,MapFile._SIZE)
+                            os.ftruncate(self.fd,self._size)
                             stats=os.fstat(self.fd)
-                            if stats.st_size!=MapFile._SIZE:
+                            if stats.st_size!=self._size:
                                 raise Exception("Invalid stat size.")
                             self._prepare_map()
                             self.bdestroy=False
@@ -953,7 +1384,7 @@ class MapFile():
             self.fpath=SHAREDMEM_PATH + utils.path_sep + self.fname + ".shm"
             if not utils.path_exists(self.fpath):
                 with utils.file_open(self.fpath, "wb") as f:
-                    f.write(" "*MapFile._SIZE)
+                    f.write(" "*self._size)
                 if fixperm is not None:
                     fixperm(self.fpath)
                 self.file=utils.file_open(self.fpath, "r+b")
@@ -962,7 +1393,9 @@ class MapFile():
                 self.bdestroy=False                
                 break
     
-    def create(self,fixperm):
+    def create(self,fixperm,size=None):
+        if size is not None:
+            self._size=size
         try:
             self._create_mem(fixperm)
         except:
@@ -972,7 +1405,10 @@ class MapFile():
         
     def open(self, name):
         self.ftype=name[0]
-        self.fname=name[1:]        
+        self.fname=name[1:]
+        if "@" in self.fname:
+            self.fname, appsz = self.fname.split("@",1)
+            self._size=int(appsz)
         if self.ftype=="F":
             self.fpath=sharedmem_manager.getPath(self.fname)
             if not utils.path_exists(self.fpath):
@@ -985,7 +1421,7 @@ class MapFile():
                     if self.fd!=-1:
                         #print "open fd: " + str(self.fd) + " " + self.fname                
                         stats=os.fstat(self.fd)
-                        if stats.st_size!=MapFile._SIZE:
+                        if stats.st_size!=self._size:
                             raise Exception("Invalid map size.")
                     else:
                         raise Exception("Invalid fd.")
@@ -996,11 +1432,13 @@ class MapFile():
     def _prepare_map(self):
         if self.ftype=="F":
             self._mmap=mmap.mmap(self.file.fileno(), 0)
+            self._size=len(self._mmap)
         elif self.ftype=="M":
             if not utils.is_windows():
-                self._mmap=mmap.mmap(self.fd, MapFile._SIZE)
+                self._mmap=mmap.mmap(self.fd, self._size)
             else:                
-                self._mmap=mmap.mmap(0, MapFile._SIZE, "Global\\" + self.fname)
+                self._mmap=mmap.mmap(0, self._size, "Global\\" + self.fname)
+        self._mmap_addr=ctypes.addressof(ctypes.c_char.from_buffer(self._mmap))
     
     def seek(self, p):
         self._mmap.seek(p)
@@ -1011,9 +1449,27 @@ class MapFile():
     def read(self, sz):
         return self._mmap.read(sz)
     
+    #ACCESSO DIRETTO PER OFFSET (NON USA IL CURSORE DEL MMAP)
+    def write_at(self, mp, bts, p, ln):
+        if ln>0:
+            ctypes.memmove(self._mmap_addr+mp, (ctypes.c_char*ln).from_buffer(bts._pydata, p), ln)
+    
+    def read_at(self, mp, bts, ln):
+        bts._pydata+=buffer(self._mmap, mp, ln)
+    
+    def get_view(self, mp, ln):
+        return buffer(self._mmap, mp, ln)
+    
+    def pack_into(self, fmt, mp, *args):
+        struct.pack_into(fmt, self._mmap, mp, *args)
+    
+    def unpack_from(self, fmt, mp):
+        return struct.unpack_from(fmt, self._mmap, mp)
+    
     def close(self):
         serr=""
         try:
+            self._mmap_addr=None
             if self._mmap is not None:
                 self._mmap.close()
                 self._mmap = None            
@@ -1048,10 +1504,12 @@ class MapFile():
                         MapFile._memlistname.remove(self.fname)
                     
     def get_name(self):
+        if self._size!=MapFile._SIZE:
+            return self.ftype + self.fname + "@" + str(self._size)
         return self.ftype + self.fname
     
     def get_size(self):
-        return MapFile._SIZE
+        return self._size
     
 
 class Manager(threading.Thread):
@@ -1070,9 +1528,9 @@ class Manager(threading.Thread):
         finally:
             self._semaphore.release()
     
-    def createStream(self,fixperm):
+    def createStream(self,fixperm,size=None):
         s = MapFile()
-        s.create(fixperm)
+        s.create(fixperm,size)
         return s
     
     def openStream(self, fname):
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import struct
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+import communication
+
+
+class FakeSocket():
+
+    #CONSEGNA I BLOCCHI UNO PER VOLTA (UNA recv_into PER BLOCCO, SPEZZATO SE IL BUFFER E' PIU' PICCOLO)
+    def __init__(self, chunks):
+        self._chunks=list(chunks)
+
+    def recv_into(self, view, sz):
+        if len(self._chunks)==0:
+            return 0
+        c=self._chunks[0]
+        n=min(sz, len(c))
+        view[0:n]=c[:n]
+        if n<len(c):
+            self._chunks[0]=c[n:]
+        else:
+            self._chunks.pop(0)
+        return n
+
+
+def ws_frame(payload, opcode=2, mask=None, lenfmt=None):
+    ln=len(payload)
+    bm=0
+    if mask is not None:
+        bm=0x80
+    if lenfmt is None:
+        if ln<=125:
+            lenfmt="B"
+        elif ln<=0xFFFF:
+            lenfmt="H"
+        else:
+            lenfmt="I"
+    if lenfmt=="B":
+        hd=struct.pack("!BB", 0x80 | opcode, bm | ln)
+    elif lenfmt=="H":
+        hd=struct.pack("!BBH", 0x80 | opcode, bm | 126, ln)
+    else:
+        hd=struct.pack("!BBI", 0x80 | opcode, bm | 127, ln)
+    if mask is not None:
+        hd+=mask
+        payload="".join([chr(ord(c) ^ ord(mask[i % 4])) for i, c in enumerate(payload)])
+    return hd+payload
+
+
+def read_all(cb, sock):
+    arret=[]
+    while cb.recv(sock):
+        for dt in cb.parse_frames():
+            if dt is None:
+                arret.append(None)
+            else:
+                arret.append(str(dt._pydata))
+    return arret
+
+
+class TestConnectionBuffer(unittest.TestCase):
+
+    def test_small_frame(self):
+        cb=communication.ConnectionBuffer()
+        self.assertEqual(read_all(cb, FakeSocket([ws_frame("hello")])), ["hello"])
+
+    def test_header_split(self):
+        #HEADER SPEZZATO IN OGNI PUNTO, ANCHE DENTRO LA LUNGHEZZA ESTESA E LA CHIAVE
+        for lenfmt in ["B", "H", "I"]:
+            for mask in [None, "\x01\x02\x03\x04"]:
+                frm=ws_frame("abcdefghij", mask=mask, lenfmt=lenfmt)
+                for i in range(1, len(frm)):
+                    cb=communication.ConnectionBuffer()
+                    self.assertEqual(read_all(cb, FakeSocket([frm[:i], frm[i:]])), ["abcdefghij"], (lenfmt, mask, i))
+
+    def test_byte_by_byte(self):
+        frm=ws_frame("x"*300)+ws_frame("y"*70000)+ws_frame("z")
+        cb=communication.ConnectionBuffer()
+        self.assertEqual(read_all(cb, FakeSocket(list(frm))), ["x"*300, "y"*70000, "z"])
+
+    def test_length_16(self):
+        for ln in [126, 1000, 0xFFFF]:
+            cb=communication.ConnectionBuffer()
+            self.assertEqual(read_all(cb, FakeSocket([ws_frame("a"*ln)])), ["a"*ln])
+
+    def test_length_127(self):
+        #IL FORMATO 127 DEL NODO HA LA LUNGHEZZA A 4 BYTE
+        for ln in [5, 0x10000, 300000]:
+            cb=communication.ConnectionBuffer()
+            self.assertEqual(read_all(cb, FakeSocket([ws_frame("b"*ln, lenfmt="I")])), ["b"*ln])
+
+    def test_masked(self):
+        cb=communication.ConnectionBuffer()
+        frms=ws_frame("masked payload", mask="\x12\x34\x56\x78")+ws_frame("k"*200, mask="\x00\x00\x00\x00")
+        self.assertEqual(read_all(cb, FakeSocket([frms])), ["masked payload", "k"*200])
+
+    def test_agent_header(self):
+        #FRAME SCRITTI DA Connection._write_ws_header (MASCHERATI CON CHIAVE 0)
+        for ln in [10, 1000, 70000]:
+            bts=utils.Bytes(bytearray(10+ln))
+            hdsz=communication.Connection._write_ws_header.im_func(None, bts, 0, 2, ln)
+            bts._pydata[hdsz:hdsz+ln]="q"*ln
+            cb=communication.ConnectionBuffer()
+            self.assertEqual(read_all(cb, FakeSocket([str(bts._pydata[0:hdsz+ln])])), ["q"*ln])
+
+    def test_multiple_frames(self):
+        frms=ws_frame("one")+ws_frame("")+ws_frame("two"*100)+ws_frame("three"*2000)+struct.pack("!BB", 136, 0)+ws_frame("after")
+        cb=communication.ConnectionBuffer()
+        cb.recv(FakeSocket([frms]))
+        arret=[str(dt._pydata) if dt is not None else None for dt in cb.parse_frames()]
+        #FRAME VUOTO IGNORATO, CLOSE TERMINA IL PARSING
+        self.assertEqual(arret, ["one", "two"*100, "three"*2000, None])
+
+    def test_compaction(self):
+        #DATI RIMANENTI SPOSTATI ALL'INIZIO QUANDO LO SPAZIO LIBERO IN CODA E' INSUFFICIENTE
+        first=ws_frame("f"*(communication.ConnectionBuffer._SIZE-communication.ConnectionBuffer._READ_MIN))
+        second=ws_frame("s"*5000)
+        cb=communication.ConnectionBuffer()
+        sock=FakeSocket([first+second[:10], second[10:]])
+        self.assertTrue(cb.recv(sock))
+        self.assertEqual([str(dt._pydata) for dt in cb.parse_frames()], ["f"*(communication.ConnectionBuffer._SIZE-communication.ConnectionBuffer._READ_MIN)])
+        self.assertTrue(cb._start>0)
+        self.assertTrue(cb.recv(sock))
+        self.assertEqual(len(cb._buffer), communication.ConnectionBuffer._SIZE)
+        self.assertEqual([str(dt._pydata) for dt in cb.parse_frames()], ["s"*5000])
+
+    def test_growth(self):
+        #FRAME PIU' GRANDE DEL BUFFER: IL BUFFER CRESCE E TORNA ALLA DIMENSIONE INIZIALE QUANDO SVUOTATO
+        big=ws_frame("g"*200000)
+        cb=communication.ConnectionBuffer()
+        sock=FakeSocket([big, ws_frame("small")])
+        self.assertTrue(cb.recv(sock))
+        self.assertEqual(cb.parse_frames(), [])
+        self.assertEqual(cb._need, len(big))
+        while cb._end-cb._start<len(big):
+            self.assertTrue(cb.recv(sock))
+        self.assertTrue(len(cb._buffer)>=len(big))
+        self.assertEqual([str(dt._pydata) for dt in cb.parse_frames()], ["g"*200000])
+        self.assertTrue(cb.recv(sock))
+        self.assertEqual(len(cb._buffer), communication.ConnectionBuffer._SIZE)
+        self.assertEqual([str(dt._pydata) for dt in cb.parse_frames()], ["small"])
+
+    def test_payload_not_shared(self):
+        #IL PAYLOAD E' UNA COPIA: RESTA VALIDO DOPO IL RIUSO DEL BUFFER
+        cb=communication.ConnectionBuffer()
+        sock=FakeSocket([ws_frame("keep"), ws_frame("over")])
+        cb.recv(sock)
+        first=cb.parse_frames()[0]
+        cb.recv(sock)
+        cb.parse_frames()
+        self.assertEqual(str(first._pydata), "keep")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agent
+
+
+class FakeTaskPool():
+
+    def __init__(self):
+        self.tasks=[]
+
+    def execute(self, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+    def execute_priority(self, priority, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+
+class FakeAgent():
+
+    def __init__(self):
+        self._task_pool=FakeTaskPool()
+
+    def _get_config(self, key, default=None):
+        return default
+
+
+class FakeParent():
+
+    def __init__(self):
+        self._agent=FakeAgent()
+        self.stripes=[]
+
+    def new_send_channel(self, priority, props=None):
+        return None
+
+    def _download_stripe_register(self, sid, idx, cnt, etag):
+        self.stripes.append((sid, idx, cnt, etag))
+
+
+class FakeConnection():
+
+    def set_events(self, evts):
+        None
+
+
+class TestDownloadRange(unittest.TestCase):
+
+    def setUp(self):
+        self._tmppath=tempfile.mkdtemp(prefix="test_download_")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmppath, True)
+
+    def _file(self, size, name="data.bin"):
+        path=os.path.join(self._tmppath, name)
+        f=open(path, "wb")
+        try:
+            f.write("d"*size)
+        finally:
+            f.close()
+        return path
+
+    def _accept(self, path, props):
+        dwn=agent.Download(FakeParent(), FakeConnection(), props)
+        dwn.accept(path)
+        return dwn
+
+    def _range(self, size, srng, ifrng=None):
+        props={"range": srng}
+        if ifrng is not None:
+            props["ifRange"]=ifrng
+        return self._accept(self._file(size), props)
+
+    def test_no_range(self):
+        dwn=self._accept(self._file(1000), {})
+        self.assertEqual(dwn.get_range(), (0, 1000))
+        self.assertFalse(dwn.is_partial())
+        dwn=self._accept(self._file(1000), {"range": ""})
+        self.assertFalse(dwn.is_partial())
+
+    def test_ranges(self):
+        #(RANGE, (INIZIO, FINE ESCLUSA))
+        tests=[
+            ("bytes=0-99", (0, 100)),
+            ("bytes=100-199", (100, 200)),
+            ("bytes=999-999", (999, 1000)),
+            ("bytes=500-5000", (500, 1000)),
+            ("bytes=0-", (0, 1000)),
+            ("bytes=400-", (400, 1000)),
+            ("bytes=-1", (999, 1000)),
+            ("bytes=-300", (700, 1000)),
+            ("bytes=-5000", (0, 1000)),
+            (" bytes=10-19 ", (10, 20)),
+        ]
+        for srng, rng in tests:
+            dwn=self._range(1000, srng)
+            self.assertEqual(dwn.get_range(), rng, srng)
+            self.assertEqual(dwn.get_range_length(), rng[1]-rng[0], srng)
+            self.assertEqual(dwn.get_length(), 1000)
+        self.assertTrue(self._range(1000, "bytes=0-998").is_partial())
+        self.assertFalse(self._range(1000, "bytes=0-").is_partial())
+        self.assertFalse(self._range(1000, "bytes=0-999").is_partial())
+
+    def test_unsatisfiable(self):
+        for srng in ["bytes=1000-", "bytes=1000-2000", "bytes=5000-5001", "bytes=20-10"]:
+            try:
+                self._range(1000, srng)
+                self.fail(srng)
+            except Exception as e:
+                self.assertEqual(str(e), "Download range not satisfiable.", srng)
+
+    def test_not_valid(self):
+        tests=[
+            ("items=0-10", "Download range not valid."),
+            ("bytes=0-10,20-30", "Download multiple ranges not supported."),
+            ("bytes=10", "Download range not valid."),
+            ("bytes=a-b", "Download range not valid."),
+            ("bytes=-0", "Download range not valid."),
+            ("bytes=-", "Download range not valid."),
+            ("bytes=1-2-3", "Download range not valid."),
+        ]
+        for srng, msg in tests:
+            try:
+                self._range(1000, srng)
+                self.fail(srng)
+            except Exception as e:
+                self.assertEqual(str(e), msg, srng)
+
+    def test_zero_length(self):
+        dwn=self._accept(self._file(0), {})
+        self.assertEqual(dwn.get_range(), (0, 0))
+        self.assertFalse(dwn.is_partial())
+        #UN FILE VUOTO NON HA INTERVALLI SODDISFACIBILI
+        for srng in ["bytes=0-", "bytes=0-10", "bytes=-10"]:
+            try:
+                self._range(0, srng)
+                self.fail(srng)
+            except Exception as e:
+                self.assertEqual(str(e), "Download range not satisfiable.", srng)
+
+    def test_if_range_etag(self):
+        path=self._file(1000)
+        etag=self._accept(path, {}).get_etag()
+        dwn=self._accept(path, {"range": "bytes=100-", "ifRange": etag})
+        self.assertEqual(dwn.get_range(), (100, 1000))
+        self.assertTrue(dwn.is_partial())
+
+    def test_if_range_date(self):
+        path=self._file(1000)
+        lm=self._accept(path, {}).get_last_modified()
+        dwn=self._accept(path, {"range": "bytes=-10", "ifRange": lm})
+        self.assertEqual(dwn.get_range(), (990, 1000))
+
+    def test_if_range_mismatch(self):
+        #ETAG DIVERSO (FILE CAMBIATO): INTERVALLO IGNORATO, FILE COMPLETO
+        path=self._file(1000)
+        etag=self._accept(path, {}).get_etag()
+        for sifrng in ["\"other\"", "Sat, 26 Jul 1997 05:00:00 GMT"]:
+            dwn=self._accept(path, {"range": "bytes=100-199", "ifRange": sifrng})
+            self.assertEqual(dwn.get_range(), (0, 1000), sifrng)
+            self.assertFalse(dwn.is_partial())
+        #ANCHE UN INTERVALLO NON SODDISFACIBILE NON E' UN ERRORE
+        dwn=self._accept(path, {"range": "bytes=5000-", "ifRange": "\"other\""})
+        self.assertEqual(dwn.get_range(), (0, 1000))
+        #FILE MODIFICATO DOPO LA PRIMA RICHIESTA: L'ETAG PRECEDENTE NON CORRISPONDE PIU'
+        f=open(path, "ab")
+        try:
+            f.write("more")
+        finally:
+            f.close()
+        dwn=self._accept(path, {"range": "bytes=100-199", "ifRange": etag})
+        self.assertEqual(dwn.get_range(), (0, 1004))
+        self.assertNotEqual(dwn.get_etag(), etag)
+
+    def test_range_with_stripe(self):
+        #GLI INDICI STRIPE DIVIDONO L'INTERVALLO RICHIESTO
+        sz=4*agent.Download.STRIPE_ALIGN
+        path=self._file(sz)
+        arrng=[]
+        for idx in range(2):
+            dwn=self._accept(path, {"range": "bytes=1000-", "stripeId": "S", "stripeCount": 2, "stripeIndex": idx})
+            arrng.append(dwn.get_range())
+        self.assertEqual(arrng[0][0], 1000)
+        self.assertEqual(arrng[0][1], arrng[1][0])
+        self.assertEqual(arrng[1][1], sz)
+
+
+if __name__ == "__main__":
+    unittest.main()
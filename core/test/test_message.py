@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import json
+import zlib
+import struct
+import random
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+import agent
+
+
+class FakeTaskPool():
+
+    def __init__(self):
+        self.tasks=[]
+
+    def execute(self, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+    def execute_priority(self, priority, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+
+class FakeAgent():
+
+    def __init__(self, config=None):
+        self._config=config or {}
+        self._task_pool=FakeTaskPool()
+        self.errors=[]
+
+    def _get_config(self, key, default=None):
+        return self._config.get(key, default)
+
+    def write_err(self, msg):
+        self.errors.append(msg)
+
+    def write_except(self, e, tx=u""):
+        self.errors.append(tx + utils.exception_to_string(e))
+
+
+class FakeConnection():
+
+    def __init__(self):
+        self._semaphore=threading.Condition()
+        self._allow_recovery=False
+
+    def set_events(self, evts):
+        None
+
+
+def encode(msg, level=6):
+    dt=zlib.compress(json.dumps(msg), level)
+    return struct.pack("!I", len(dt)) + dt
+
+
+def split_random(s, rnd, maxsz):
+    ar=[]
+    p=0
+    while p<len(s):
+        n=rnd.randint(1, maxsz)
+        ar.append(s[p:p+n])
+        p+=n
+    return ar
+
+
+class TestZlibDecompressor(unittest.TestCase):
+
+    def test_chunks(self):
+        rnd=random.Random(1)
+        src="".join([chr(rnd.randint(0, 20)) for i in range(200000)])
+        cmp=zlib.compress(src)
+        for maxsz in [1, 7, 1000, len(cmp)]:
+            dc=utils.ZlibDecompressor()
+            for c in split_random(cmp, rnd, maxsz):
+                dc.decompress(utils.Bytes(c))
+            dc.flush()
+            self.assertEqual(len(dc), len(src))
+            self.assertEqual(str(dc._pydata[0:len(dc)]), src)
+
+    def test_offset(self):
+        cmp=zlib.compress("offset data")
+        bts=utils.Bytes("XXX" + cmp + "YYY")
+        dc=utils.ZlibDecompressor()
+        dc.decompress(bts, 3, len(cmp))
+        dc.flush()
+        self.assertEqual(dc.to_str(), u"offset data")
+
+    def test_max_size(self):
+        cmp=zlib.compress("a"*10001)
+        dc=utils.ZlibDecompressor(10000)
+        self.assertRaises(Exception, dc.decompress, utils.Bytes(cmp))
+        #AL LIMITE ESATTO NON SOLLEVA ECCEZIONI
+        dc=utils.ZlibDecompressor(10001)
+        dc.decompress(utils.Bytes(cmp))
+        dc.flush()
+        self.assertEqual(len(dc), 10001)
+
+    def test_reset(self):
+        dc=utils.ZlibDecompressor(retainsize=1024)
+        dc.decompress(utils.Bytes(zlib.compress("small")))
+        dc.flush()
+        buf=dc._pydata
+        dc.reset()
+        self.assertEqual(len(dc), 0)
+        self.assertTrue(dc._pydata is buf)
+        dc.decompress(utils.Bytes(zlib.compress("b"*5000)))
+        dc.flush()
+        dc.reset()
+        #BUFFER OLTRE retainsize RILASCIATO
+        self.assertEqual(len(dc._pydata), 0)
+        dc.decompress(utils.Bytes(zlib.compress("again")))
+        dc.flush()
+        self.assertEqual(dc.to_str(), u"again")
+
+
+class TestMessageStream(unittest.TestCase):
+
+    def _new_message(self, config=None):
+        agt=FakeAgent(config)
+        msg=agent.Message(agt, FakeConnection())
+        return agt, msg
+
+    def _received(self, agt):
+        return [t[1][0] for t in agt._task_pool.tasks]
+
+    def test_split_anywhere(self):
+        #OGNI PUNTO DI DIVISIONE, ANCHE DENTRO L'HEADER DELLA LUNGHEZZA
+        arm=[{"name": "a", "v": 1}, {"name": "b", "v": "x"*3000}, {"name": "c"}]
+        data="".join([encode(m) for m in arm])
+        for i in range(1, len(data)):
+            agt, msg=self._new_message()
+            msg.on_data_message(utils.Bytes(data[:i]))
+            msg.on_data_message(utils.Bytes(data[i:]))
+            self.assertEqual(self._received(agt), arm, i)
+            self.assertEqual(agt.errors, [])
+
+    def test_random_frames(self):
+        rnd=random.Random(2)
+        arm=[{"name": "m" + str(i), "data": "".join([chr(rnd.randint(65, 70)) for j in range(rnd.randint(0, 20000))])} for i in range(30)]
+        data="".join([encode(m, rnd.randint(0, 9)) for m in arm])
+        for maxsz in [3, 100, 5000]:
+            agt, msg=self._new_message()
+            for c in split_random(data, rnd, maxsz):
+                msg.on_data_message(utils.Bytes(c))
+            self.assertEqual(self._received(agt), arm)
+
+    def test_several_in_one_frame(self):
+        arm=[{"name": "n", "n": i} for i in range(10)]
+        agt, msg=self._new_message()
+        msg.on_data_message(utils.Bytes("".join([encode(m) for m in arm])))
+        self.assertEqual(self._received(agt), arm)
+
+    def test_max_size_length(self):
+        #LUNGHEZZA DICHIARATA OLTRE IL LIMITE: MESSAGGIO SCARTATO, IL SUCCESSIVO E' LETTO
+        big={"name": "big", "data": os.urandom(3000).encode("hex")}
+        agt, msg=self._new_message({"message_size_max": 1000})
+        data=encode(big)+encode({"name": "next"})
+        for c in split_random(data, random.Random(3), 500):
+            msg.on_data_message(utils.Bytes(c))
+        self.assertEqual(self._received(agt), [{"name": "next"}])
+        self.assertEqual(len(agt.errors), 1)
+
+    def test_max_size_decompressed(self):
+        #COMPRESSO SOTTO IL LIMITE MA DECOMPRESSO OLTRE: SCARTATO DOPO L'ERRORE
+        agt, msg=self._new_message({"message_size_max": 1000})
+        data=encode({"name": "bomb", "data": "a"*100000})+encode({"name": "next"})
+        self.assertTrue(len(data)<1000)
+        for c in split_random(data, random.Random(4), 50):
+            msg.on_data_message(utils.Bytes(c))
+        self.assertEqual(self._received(agt), [{"name": "next"}])
+        self.assertEqual(len(agt.errors), 1)
+
+    def test_discard_after_error(self):
+        #DATI NON zlib: ERRORE, IL RESTO DEL MESSAGGIO VIENE IGNORATO E IL SUCCESSIVO E' LETTO
+        bad="not zlib data at all"*10
+        data=struct.pack("!I", len(bad)) + bad + encode({"name": "ok"})
+        for maxsz in [1, 13, len(data)]:
+            agt, msg=self._new_message()
+            for c in split_random(data, random.Random(5), maxsz):
+                msg.on_data_message(utils.Bytes(c))
+            self.assertEqual(self._received(agt), [{"name": "ok"}])
+            self.assertEqual(len(agt.errors), 1)
+
+    def test_invalid_json(self):
+        dt=zlib.compress("{invalid")
+        data=struct.pack("!I", len(dt)) + dt + encode({"name": "ok"})
+        agt, msg=self._new_message()
+        msg.on_data_message(utils.Bytes(data))
+        self.assertEqual(self._received(agt), [{"name": "ok"}])
+        self.assertEqual(len(agt.errors), 1)
+
+    def test_recovery_clears_partial(self):
+        #RICONNESSIONE A META' MESSAGGIO: LO STATO PARZIALE VIENE AZZERATO
+        data=encode({"name": "lost", "data": "z"*1000})
+        agt, msg=self._new_message()
+        msg.on_data_message(utils.Bytes(data[:len(data)/2]))
+        msg._on_recovery()
+        msg.on_data_message(utils.Bytes(encode({"name": "after"})))
+        self.assertEqual(self._received(agt), [{"name": "after"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
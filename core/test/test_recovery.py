@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+'''
+This Source Code Form is subject to the terms of the Mozilla
+Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+'''
+import sys
+import os
+import json
+import zlib
+import struct
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+import agent
+
+
+class FakeTaskPool():
+
+    def __init__(self):
+        self.tasks=[]
+
+    def execute(self, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+    def execute_priority(self, priority, func, *args, **kargs):
+        self.tasks.append((func, args))
+
+    def run_all(self):
+        while len(self.tasks)>0:
+            func, args = self.tasks.pop(0)
+            func(*args)
+
+
+class FakeAgent():
+
+    def __init__(self, config=None):
+        self._config=config or {}
+        self._task_pool=FakeTaskPool()
+        self.errors=[]
+
+    def _get_config(self, key, default=None):
+        return self._config.get(key, default)
+
+    def write_err(self, msg):
+        self.errors.append(msg)
+
+    def write_except(self, e, tx=u""):
+        self.errors.append(tx + utils.exception_to_string(e))
+
+
+class FakeConnection():
+
+    def __init__(self):
+        self._semaphore=threading.Condition()
+        self._allow_recovery=False
+
+    def set_events(self, evts):
+        None
+
+
+def encode(msg):
+    dt=zlib.compress(json.dumps(msg))
+    return struct.pack("!I", len(dt)) + dt
+
+
+def decode(appm):
+    dt=str(appm._pydata[0:len(appm)])
+    return json.loads(zlib.decompress(dt[4:]))
+
+
+class TestRecoveryBuffer(unittest.TestCase):
+
+    def test_trim(self):
+        rb=agent.RecoveryBuffer(0)
+        for rc in range(1, 11):
+            rb.add(rc, "x"*rc)
+        rb.trim(4)
+        self.assertEqual(rb.get_all(), ["x"*rc for rc in range(5, 11)])
+        self.assertEqual(rb.get_metrics()["bytes"], sum(range(5, 11)))
+        #trim GIA' APPLICATO O INFERIORE: NESSUN EFFETTO
+        rb.trim(2)
+        self.assertEqual(rb.get_metrics()["count"], 6)
+        rb.trim(100)
+        self.assertEqual(rb.get_all(), [])
+        self.assertEqual(rb.get_metrics()["bytes"], 0)
+
+    def test_order(self):
+        #L'ORDINE DI REINVIO E' QUELLO DI INSERIMENTO, trim SEGUE IL requestCount
+        rb=agent.RecoveryBuffer(0)
+        for rc in [3, 1, 5, 2, 4]:
+            rb.add(rc, str(rc))
+        self.assertEqual(rb.get_all(), ["3", "1", "5", "2", "4"])
+        rb.trim(2)
+        self.assertEqual(rb.get_all(), ["3", "5", "4"])
+
+    def test_replace(self):
+        rb=agent.RecoveryBuffer(0)
+        rb.add(1, "a"*10)
+        rb.add(2, "b"*10)
+        rb.add(1, "c"*3)
+        self.assertEqual(rb.get_metrics()["bytes"], 13)
+        self.assertEqual(rb.get_metrics()["count"], 2)
+        rb.trim(1)
+        self.assertEqual(rb.get_all(), ["b"*10])
+
+    def test_size_limit(self):
+        #OLTRE IL LIMITE IN BYTE SONO SCARTATE LE RISPOSTE PIU' VECCHIE
+        rb=agent.RecoveryBuffer(100)
+        for rc in range(1, 8):
+            rb.add(rc, chr(64+rc)*30)
+        self.assertEqual(rb.get_all(), [chr(64+rc)*30 for rc in range(5, 8)])
+        m=rb.get_metrics()
+        self.assertEqual(m["bytes"], 90)
+        self.assertEqual(m["dropped"], 4)
+        self.assertTrue(m["bytes"]<=m["bytesMax"])
+
+    def test_size_limit_single(self):
+        #UNA SINGOLA RISPOSTA OLTRE IL LIMITE VIENE COMUNQUE MANTENUTA
+        rb=agent.RecoveryBuffer(100)
+        rb.add(1, "a"*10)
+        rb.add(2, "b"*500)
+        self.assertEqual(rb.get_all(), ["b"*500])
+        self.assertEqual(rb.get_metrics()["dropped"], 1)
+        rb.add(3, "c")
+        self.assertEqual(rb.get_all(), ["c"])
+
+    def test_dropped_then_trim(self):
+        #LE CHIAVI SCARTATE PER DIMENSIONE RESTANO NELLO HEAP E VENGONO IGNORATE DA trim
+        rb=agent.RecoveryBuffer(50)
+        for rc in range(1, 6):
+            rb.add(rc, "z"*20)
+        rb.trim(4)
+        self.assertEqual(rb.get_all(), ["z"*20])
+        self.assertEqual(rb.get_metrics()["bytes"], 20)
+        rb.trim(5)
+        self.assertEqual(rb.get_metrics()["count"], 0)
+        self.assertEqual(rb.get_metrics()["bytes"], 0)
+
+    def test_heap_rebuild(self):
+        rb=agent.RecoveryBuffer(1000)
+        for rc in range(1, 5001):
+            rb.add(rc, "p"*10)
+        self.assertEqual(rb.get_metrics()["count"], 100)
+        rb.trim(4900)
+        self.assertTrue(len(rb._heap)<=2*len(rb._items)+64)
+        self.assertEqual(sorted(rb._heap), range(4901, 5001))
+        rb.trim(5000)
+        self.assertEqual(rb.get_all(), [])
+
+    def test_resent_metric(self):
+        rb=agent.RecoveryBuffer(0)
+        rb.add(1, "a")
+        rb.add(2, "b")
+        rb.get_all()
+        rb.get_all()
+        self.assertEqual(rb.get_metrics()["resent"], 4)
+
+
+class TestMessageRecovery(unittest.TestCase):
+
+    def _new_message(self, config=None):
+        agt=FakeAgent(config)
+        msg=agent.Message(agt, FakeConnection())
+        sent=[]
+        msg._send_conn=lambda conn, data: sent.append(decode(data))
+        return agt, msg, sent
+
+    def _request(self, rc):
+        return {"name": "request", "requestKey": "K" + str(rc), "requestCount": rc}
+
+    def test_replay_after_reconnect(self):
+        agt, msg, sent = self._new_message()
+        for rc in range(1, 6):
+            msg.send_response(self._request(rc), {"v": rc})
+        self.assertEqual([m["requestCount"] for m in sent], [1, 2, 3, 4, 5])
+        del sent[:]
+        #IL NODO HA RICEVUTO FINO A 3: DOPO LA RICONNESSIONE VENGONO REINVIATE 4 E 5
+        msg.on_data_message(utils.Bytes(encode({"name": "recovery", "cntRequestReceived": 3, "status": "end"})))
+        agt._task_pool.run_all()
+        self.assertEqual([(m["requestCount"], m["content"]["v"]) for m in sent], [(4, 4), (5, 5)])
+        self.assertEqual(msg.get_recovery_metrics()["count"], 2)
+        self.assertEqual(msg.get_recovery_metrics()["resent"], 2)
+
+    def test_ack_without_end(self):
+        #SENZA status=end LE RISPOSTE CONFERMATE VENGONO SOLO RIMOSSE
+        agt, msg, sent = self._new_message()
+        for rc in range(1, 4):
+            msg.send_response(self._request(rc), {"v": rc})
+        del sent[:]
+        msg.on_data_message(utils.Bytes(encode({"name": "recovery", "cntRequestReceived": 2})))
+        agt._task_pool.run_all()
+        self.assertEqual(sent, [])
+        self.assertEqual(msg.get_recovery_metrics()["count"], 1)
+
+    def test_replay_size_limit(self):
+        agt, msg, sent = self._new_message({"recovery_buffer_size_max": 1})
+        for rc in range(1, 4):
+            msg.send_response(self._request(rc), {"v": rc})
+        del sent[:]
+        msg.on_data_message(utils.Bytes(encode({"name": "recovery", "cntRequestReceived": 0, "status": "end"})))
+        agt._task_pool.run_all()
+        self.assertEqual([m["requestCount"] for m in sent], [3])
+        self.assertEqual(msg.get_recovery_metrics()["dropped"], 2)
+
+    def test_response_without_count(self):
+        agt, msg, sent = self._new_message()
+        msg.send_response({"name": "request", "requestKey": "X"}, {"v": 0})
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(msg.get_recovery_metrics()["count"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,6 +17,9 @@ import platform
 import traceback
 import time
 import base64
+import hashlib
+import ctypes
+import mmap as pymmap
 
 path_sep=os.sep
 line_sep=os.linesep
@@ -237,6 +240,39 @@ def file_read(f, n):
 def file_write(f,b):
     f.write(buffer(b._pydata))
 
+def file_size(f):
+    return os.fstat(f.fileno()).st_size
+
+def file_sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+def file_preallocate(f, ln):
+    #RISERVA LO SPAZIO SU DISCO (LA DIMENSIONE DEL FILE DIVENTA ln)
+    f.flush()
+    if is_linux():
+        try:
+            lc=ctypes.CDLL(None)
+            fn=getattr(lc, "posix_fallocate64", None)
+            if fn is None:
+                fn=lc.posix_fallocate
+            if fn(f.fileno(), ctypes.c_int64(0), ctypes.c_int64(ln))==0:
+                return
+        except:
+            None
+    p=f.tell()
+    f.truncate(ln)
+    f.seek(p)
+
+def path_sync(pth):
+    #RENDE PERSISTENTI LE OPERAZIONI SULLA CARTELLA (ES. RENAME)
+    if not is_windows():
+        fd=os.open(_path_fix(pth), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
 
 
 ########
@@ -248,6 +284,19 @@ def mmap_write(mmap,bts,p,ln):
 def mmap_read(mmap,sz):
     return Bytes(buffer(mmap.read(sz)))
 
+def mmap_file(f, p, ln):
+    #SOLA LETTURA (p DEVE ESSERE MULTIPLO DI mmap_granularity())
+    return pymmap.mmap(f.fileno(), ln, access=pymmap.ACCESS_READ, offset=p)
+
+def mmap_granularity():
+    return pymmap.ALLOCATIONGRANULARITY
+
+def mmap_bytes(mmap):
+    #Bytes CHE FA RIFERIMENTO ALLA MAPPA (NESSUNA COPIA)
+    b=Bytes()
+    b._pydata=mmap
+    return b
+
 
 
 
@@ -305,8 +354,8 @@ class Bytes():
     def decode_base64(self):
         self._pydata=bytearray(base64.b64decode(buffer(self._pydata)))
     
-    def compress_zlib(self):
-        self._pydata=bytearray(zlib.compress(buffer(self._pydata)))
+    def compress_zlib(self, level=-1):
+        self._pydata=bytearray(zlib.compress(buffer(self._pydata), level))
     
     def decompress_zlib(self):
         self._pydata=bytearray(zlib.decompress(buffer(self._pydata)))
@@ -314,6 +363,31 @@ class Bytes():
     def get_int(self):
         return struct.unpack('!i', self._pydata)[0]
     
+    def pack_into(self, fmt, p, *args):
+        struct.pack_into(fmt, self._pydata, p, *args)
+    
+    def append_pack(self, fmt, *args):
+        self._pydata+=struct.pack(fmt, *args)
+    
+    def unpack_from(self, fmt, p):
+        return struct.unpack_from(fmt, self._pydata, p)
+    
+    def set_bytes(self, p, bts, bp=0, ln=None):
+        #COPIA SENZA RIDIMENSIONARE IL BUFFER
+        if ln is None:
+            ln=len(bts._pydata)-bp
+        self._pydata[p:p+ln]=buffer(bts._pydata,bp,ln)
+    
+    def digest(self, alg="sha1", p=0, l=None):
+        if l is None:
+            l=len(self._pydata)-p
+        return hashlib.new(alg, buffer(self._pydata,p,l)).digest()
+    
+    def hash_update(self, h, p=0, l=None):
+        if l is None:
+            l=len(self._pydata)-p
+        h.update(buffer(self._pydata,p,l))
+    
     def new_buffer(self,p=None,l=None):
         if p is None:
             p=0
@@ -325,3 +399,55 @@ class Bytes():
         return self._pydata[i]
                
     
+
+
+class ZlibDecompressor():
+    
+    def __init__(self, maxsize=0, retainsize=1024*1024):
+        self._pydata=bytearray()
+        self._len=0
+        self._maxsize=maxsize
+        self._retainsize=retainsize
+        self._pyobj=None
+    
+    def __len__(self):
+        return self._len
+    
+    def reset(self):
+        #IL BUFFER VIENE RIUSATO SE NON TROPPO GRANDE
+        self._pyobj=None
+        self._len=0
+        if len(self._pydata)>self._retainsize:
+            self._pydata=bytearray()
+    
+    def decompress(self, bts, p=0, ln=None):
+        if ln is None:
+            ln=len(bts._pydata)-p
+        if self._pyobj is None:
+            self._pyobj=zlib.decompressobj()
+        dt=buffer(bts._pydata,p,ln)
+        while len(dt)>0:
+            if self._maxsize>0:
+                self._write(self._pyobj.decompress(dt,self._maxsize-self._len+1))
+                dt=self._pyobj.unconsumed_tail
+            else:
+                self._write(self._pyobj.decompress(dt))
+                dt=""
+    
+    def flush(self):
+        if self._pyobj is not None:
+            self._write(self._pyobj.flush())
+    
+    def _write(self, s):
+        n=len(s)
+        if n==0:
+            return
+        if self._maxsize>0 and self._len+n>self._maxsize:
+            raise Exception("Decompressed data exceeds the maximum size.")
+        if self._len+n>len(self._pydata):
+            self._pydata+=bytearray(max(self._len+n-len(self._pydata),len(self._pydata)))
+        self._pydata[self._len:self._len+n]=s
+        self._len+=n
+    
+    def to_str(self, enc="utf8"):
+        return codecs.decode(buffer(self._pydata,0,self._len),enc)
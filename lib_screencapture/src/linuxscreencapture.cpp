@@ -42,6 +42,11 @@ ScreenCaptureNative::ScreenCaptureNative(DWDebugger* dbg) {
     fclose(file);
 
     loadXrandr("/usr/lib");
+
+	handleXdamage=NULL;
+	damage=None;
+	damageEventBase=0;
+	loadXdamage("/usr/lib");
 }
 
 
@@ -50,6 +55,10 @@ ScreenCaptureNative::~ScreenCaptureNative() {
 		dlclose(handleXrandr);
 		handleXrandr=NULL;
 	}
+	if (handleXdamage) {
+		dlclose(handleXdamage);
+		handleXdamage=NULL;
+	}
 }
 
 bool ScreenCaptureNative::loadXrandrCheck(string s) {
@@ -124,6 +133,112 @@ bool ScreenCaptureNative::loadXrandr(string s){
 	return bret;
 }
 
+bool ScreenCaptureNative::loadXdamageCheck(string s) {
+	transform(s.begin(), s.end(), s.begin(),::tolower);
+    return (s.substr(0,13)=="libxdamage.so");
+}
+
+bool ScreenCaptureNative::loadXdamage(string s){
+	bool bret=false;
+	DIR *d;
+	struct dirent *dir;
+	d = opendir(s.c_str());
+	if (d) {
+		while ((dir = readdir(d)) != NULL) {
+			string apps="";
+			apps.append(dir->d_name);
+			if (dir->d_type == DT_DIR){
+				if ((apps!=".") && (apps!="..")){
+					apps.clear();
+					apps.append(s);
+					apps.append("/");
+					apps.append(dir->d_name);
+					bret = loadXdamage(apps);
+					if (bret){
+						break;
+					}
+				}
+			}else if (dir->d_type == DT_REG){
+				if (loadXdamageCheck(apps)){
+					apps.clear();
+					apps.append(s);
+					apps.append("/");
+					apps.append(dir->d_name);
+					handleXdamage = dlopen(apps.c_str(), RTLD_LAZY);
+					if (handleXdamage) {
+						callXDamageQueryExtension = (Bool (*)(Display *dpy, int *event_base_return, int *error_base_return))dlsym(handleXdamage, "XDamageQueryExtension");
+						if (dlerror() != NULL)  {
+							dlclose(handleXdamage);
+							handleXdamage=NULL;
+						}
+					}
+					if (handleXdamage) {
+						callXDamageCreate = (Damage (*)(Display *dpy, Drawable drawable, int level))dlsym(handleXdamage, "XDamageCreate");
+						if (dlerror() != NULL)  {
+							dlclose(handleXdamage);
+							handleXdamage=NULL;
+						}
+					}
+					if (handleXdamage) {
+						callXDamageSubtract = (void (*)(Display *dpy, Damage damage, XserverRegion repair, XserverRegion parts))dlsym(handleXdamage, "XDamageSubtract");
+						if (dlerror() != NULL)  {
+							dlclose(handleXdamage);
+							handleXdamage=NULL;
+						}
+					}
+					if (handleXdamage) {
+						bret=true;
+						break;
+					}
+				}
+			}
+		}
+		closedir(d);
+	}
+	return bret;
+}
+
+void ScreenCaptureNative::initDamage(){
+	//Le notifiche BoundingBox arrivano solo quando l'area danneggiata cresce:
+	//dopo ogni XDamageSubtract il server torna a notificare qualsiasi modifica
+	damage=None;
+	damageEventBase=0;
+	if ((handleXdamage) && (xdpy != NULL)) {
+		int errorBase;
+		if ((*callXDamageQueryExtension)(xdpy, &damageEventBase, &errorBase)){
+			damage = (*callXDamageCreate)(xdpy, root, XDamageReportBoundingBox);
+		}
+	}
+}
+
+void ScreenCaptureNative::addDamage(int x, int y, int w, int h){
+	//Distribuisce l'area (coordinate root) sui monitor che la intersecano
+	for(vector<MonitorInfo>::size_type i = 0; (i < monitorsInfo.size()) && (i < screenShotInfo.size()); i++) {
+		MonitorInfo &mi = monitorsInfo[i];
+		ScreenShotInfo &ii = screenShotInfo[i];
+		int x1=max(x,mi.x);
+		int y1=max(y,mi.y);
+		int x2=min(x+w,mi.x+mi.w);
+		int y2=min(y+h,mi.y+mi.h);
+		if ((x1<x2) && (y1<y2)){
+			x1-=mi.x;
+			y1-=mi.y;
+			x2-=mi.x;
+			y2-=mi.y;
+			if (ii.damageArea.width>0){
+				x1=min(x1,ii.damageArea.x);
+				y1=min(y1,ii.damageArea.y);
+				x2=max(x2,ii.damageArea.x+ii.damageArea.width);
+				y2=max(y2,ii.damageArea.y+ii.damageArea.height);
+			}
+			ii.damageArea.x=x1;
+			ii.damageArea.y=y1;
+			ii.damageArea.width=x2-x1;
+			ii.damageArea.height=y2-y1;
+		}
+	}
+}
+
 float ScreenCaptureNative::getCpuUsage(){
 
 	if ((!firstGetCpu) && (cpuCounter.getCounter()<1000)){
@@ -500,7 +615,7 @@ bool ScreenCaptureNative::setXEnvirionment(long actty){
 }
 
 
-bool ScreenCaptureNative::isKeyboardChanged(){
+bool ScreenCaptureNative::processEvents(){
   	bool bret=false;
   	if (xdpy != NULL) {
       	XEvent event;
@@ -516,6 +631,9 @@ bool ScreenCaptureNative::isKeyboardChanged(){
                     	bret=true;
                     }
                 }                
+            }else if ((damage != None) && (event.type == damageEventBase + XDamageNotify)) {
+                XDamageNotifyEvent *e = (XDamageNotifyEvent *) &event;
+                addDamage(e->area.x, e->area.y, e->area.width, e->area.height);
             }
        }
     }
@@ -557,6 +675,7 @@ int ScreenCaptureNative::getMonitorCount() {
 				XCloseDisplay(xdpy);
 				unloadKeyMap();
 			}
+			damage=None;
 			if ((xdpy = XOpenDisplay(NULL)) != NULL) {
               	
               	//for XNextEvent
@@ -575,6 +694,7 @@ int ScreenCaptureNative::getMonitorCount() {
 					XFree(dps);
 				}
 				loadKeyMap();
+				initDamage();
 			}else{
 				activeTTY=0;
 				monitorsCounter.reset();
@@ -631,12 +751,17 @@ int ScreenCaptureNative::getMonitorCount() {
 		for(vector<MonitorInfo>::size_type i = 0; i < monitorsInfo.size(); i++) {
 			if (i>=screenShotInfo.size()){
 				ScreenShotInfo ii;
-				newScreenShotInfo(&ii, monitorsInfo[i].w, monitorsInfo[i].h);
+				newScreenShotInfo(&ii, monitorsInfo[i].x, monitorsInfo[i].y, monitorsInfo[i].w, monitorsInfo[i].h);
 				screenShotInfo.push_back(ii);
 			}else{
 				if ((monitorsInfo[i].w!=screenShotInfo[i].w) || (monitorsInfo[i].h!=screenShotInfo[i].h)){
 					termScreenShotInfo(&screenShotInfo[i]);
-					newScreenShotInfo(&screenShotInfo[i], monitorsInfo[i].w, monitorsInfo[i].h);
+					newScreenShotInfo(&screenShotInfo[i], monitorsInfo[i].x, monitorsInfo[i].y, monitorsInfo[i].w, monitorsInfo[i].h);
+				}else if ((monitorsInfo[i].x!=screenShotInfo[i].x) || (monitorsInfo[i].y!=screenShotInfo[i].y)){
+					//Monitor spostato: l'area danneggiata accumulata non e' piu' valida
+					screenShotInfo[i].x=monitorsInfo[i].x;
+					screenShotInfo[i].y=monitorsInfo[i].y;
+					screenShotInfo[i].damageFull=true;
 				}
 			}
 		}
@@ -649,7 +774,7 @@ int ScreenCaptureNative::getMonitorCount() {
       
 	}
     //Verifica se la tastiera è cambiata 
-  	if (isKeyboardChanged()){
+  	if (processEvents()){
       	unloadKeyMap();
       	loadKeyMap();
     }
@@ -671,10 +796,15 @@ ScreenCaptureNative::MonitorInfo* ScreenCaptureNative::getMonitorInfo(int idx){
 	}
 }
 
-void ScreenCaptureNative::newScreenShotInfo(ScreenShotInfo* ii, int w, int h) {
+void ScreenCaptureNative::newScreenShotInfo(ScreenShotInfo* ii, int x, int y, int w, int h) {
+	ii->x = x;
+	ii->y = y;
 	ii->w = w;
 	ii->h = h;
 	ii->image = NULL;
+	ii->damageFull = true;
+	ii->damageArea.width = 0;
+	ii->shotDamageValid = false;
 	//ii->data161616 = NULL;
 	ii->shotID=-1;
 	ii->intervallCounter.reset();
@@ -772,8 +902,20 @@ long ScreenCaptureNative::captureScreen(int monitor, int distanceFrameMs, CAPTUR
 	}
 
 
-	if ((ii->shotID==0) || (ii->intervallCounter.getCounter()>=distanceFrameMs)) {
-		ii->intervallCounter.reset();        
+	//Con XDamage attivo cattura solo se il monitor ha aree danneggiate
+	bool bdamaged=((damage == None) || (ii->damageFull) || (ii->damageArea.width>0));
+	if ((ii->shotID==0) || ((bdamaged) && (ii->intervallCounter.getCounter()>=distanceFrameMs))) {
+		ii->intervallCounter.reset();
+		if (damage != None){
+			//Azzera la regione prima di XShmGetImage: i danni successivi generano nuove notifiche
+			(*callXDamageSubtract)(xdpy, damage, None, None);
+			ii->shotDamageValid=((ii->shotID>0) && (!ii->damageFull));
+			ii->shotDamageArea=ii->damageArea;
+			ii->damageFull=false;
+			ii->damageArea.width=0;
+		}else{
+			ii->shotDamageValid=false;
+		}
 		XShmGetImage(xdpy, root, ii->image, x, y, AllPlanes);
 		/*
 		destroyImage();
@@ -798,11 +940,48 @@ long ScreenCaptureNative::captureScreen(int monitor, int distanceFrameMs, CAPTUR
 	}else{
 		capimage->bpc=1;
 	}
+	if (ii->shotDamageValid){
+		capchange->push_back(ii->shotDamageArea);
+	}
 	capimage->width = w;
 	capimage->height = h;
 	return ii->shotID;
 }
 
+long ScreenCaptureNative::getShotID(int monitor) {
+	//Ultimo frame catturato del monitor (condiviso da tutte le sessioni)
+	ScreenShotInfo* ii = getScreenShotInfo(monitor);
+	if (ii==NULL) {
+		return -1;
+	}
+	return ii->shotID;
+}
+
+bool ScreenCaptureNative::isDamaged(int monitor) {
+	//Senza XDamage o con i monitor da ricontrollare non e' possibile escludere modifiche
+	if ((xdpy == NULL) || (damage == None) || (firstmonitorscheck) || (monitorsCounter.getCounter()>=MONITORS_INTERVAL)){
+		return true;
+	}
+	if (processEvents()){
+      	unloadKeyMap();
+      	loadKeyMap();
+	}
+	ScreenShotInfo* ii = getScreenShotInfo(monitor);
+	if ((ii==NULL) || (ii->shotID<=0) || (ii->damageFull) || (ii->damageArea.width>0)){
+		return true;
+	}
+	//Il cursore non genera danni ma deve essere aggiornato
+	unsigned int mask_return;
+	Window window_returned;
+	int root_x, root_y, win_x, win_y;
+	if (XQueryPointer(xdpy,root,&window_returned,&window_returned,&root_x,&root_y,&win_x,&win_y,&mask_return)==True){
+		if ((root_x!=cursorX) || (root_y!=cursorY)){
+			return true;
+		}
+	}
+	return false;
+}
+
 bool ScreenCaptureNative::captureCursor(int monitor, int* info, long& id, unsigned char** data) {
 	unsigned int mask_return;
 	Window window_returned;
@@ -33,6 +33,7 @@ using namespace std;
 #include "dirent.h"
 #include "linuxkeysym2ucs.h"
 #include "linuxXrandr.h"
+#include "linuxXdamage.h"
 #include <errno.h>
 #include "dwdebugger.h"
 #include "timecounter.h"
@@ -52,6 +53,8 @@ public:
     void getResolution(int* size);
     long captureScreen(int monitor, int distanceFrameMs, CAPTURE_IMAGE* capimage, vector<CAPTURE_CHANGE_AREA>* capchange, vector<CAPTURE_MOVE_AREA>* capmove);
     bool captureCursor(int monitor, int* info, long& id, unsigned char** data);
+    bool isDamaged(int monitor);
+    long getShotID(int monitor);
     bool getActiveWinPos(long* id, int* info);
     void inputKeyboard(const char* type, const char* key, bool ctrl, bool alt, bool shift, bool command);
 	void inputMouse(int monitor, int x, int y, int button, int wheel, bool ctrl, bool alt, bool shift, bool command);
@@ -75,6 +78,8 @@ private:
 
 	struct ScreenShotInfo{
 		XImage *image;
+		int x;
+		int y;
 		int w;
 		int h;
 		int redlshift;
@@ -85,6 +90,10 @@ private:
 		long shotID;
 		TimeCounter intervallCounter;
 		XShmSegmentInfo m_shmseginfo;
+		bool damageFull; //Area danneggiata sconosciuta: cattura completa
+		CAPTURE_CHANGE_AREA damageArea; //Area danneggiata in attesa di cattura (width=0 nessun danno)
+		bool shotDamageValid;
+		CAPTURE_CHANGE_AREA shotDamageArea; //Area danneggiata che ha prodotto shotID
 	};
 
 	vector<ScreenShotInfo> screenShotInfo;
@@ -106,6 +115,15 @@ private:
 	bool loadXrandrCheck(string s);
 	//void loadXrandr();
 
+	Bool (*callXDamageQueryExtension)(Display *dpy, int *event_base_return, int *error_base_return);
+	Damage (*callXDamageCreate)(Display *dpy, Drawable drawable, int level);
+	void (*callXDamageSubtract)(Display *dpy, Damage damage, XserverRegion repair, XserverRegion parts);
+
+	bool loadXdamage(string s);
+	bool loadXdamageCheck(string s);
+	void initDamage();
+	void addDamage(int x, int y, int w, int h);
+
 
 	Display *xdpy;
 	Window root;
@@ -114,6 +132,9 @@ private:
 	Screen *screen;
 
 	void *handleXrandr;
+	void *handleXdamage;
+	Damage damage;
+	int damageEventBase;
 
 	long cursorID;
 	int cursorX;
@@ -161,7 +182,7 @@ private:
 
 	MonitorInfo* getMonitorInfo(int idx);
 
-	void newScreenShotInfo(ScreenShotInfo* ii, int w, int h);
+	void newScreenShotInfo(ScreenShotInfo* ii, int x, int y, int w, int h);
 	ScreenShotInfo* getScreenShotInfo(int idx);
 	void initScreenShotInfo(ScreenShotInfo* ii);
 	void termScreenShotInfo(ScreenShotInfo* ii);	
@@ -181,7 +202,7 @@ private:
 	void unloadKeyMap();
 	KeyCode createCustomKeyUnicode(int uc);
 	void clearCustomKeyUnicode();
-  	bool isKeyboardChanged();
+  	bool processEvents();
 };
 
 #endif
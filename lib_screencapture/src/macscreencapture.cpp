@@ -271,6 +271,19 @@ long ScreenCaptureNative::captureScreen(int monitor, int distanceFrameMs, CAPTUR
 	return ii->shotID;
 }
 
+bool ScreenCaptureNative::isDamaged(int monitor) {
+	//Notifiche di modifica non disponibili: il confronto avviene sempre
+	return true;
+}
+
+long ScreenCaptureNative::getShotID(int monitor) {
+	ScreenShotInfo* ii = getScreenShotInfo(0);
+	if (ii==NULL) {
+		return -1;
+	}
+	return ii->shotID;
+}
+
 bool ScreenCaptureNative::captureCursor(int monitor, int* info, long& id, unsigned char** data){
 	MonitorInfo* mi = &monitorsInfo[0];
 	if ((mi==NULL) || (mi->factx==-1) || (mi->facty==-1)){
@@ -37,6 +37,8 @@ public:
     void getResolution(int* size);
     long captureScreen(int monitor, int distanceFrameMs, CAPTURE_IMAGE* capimage, vector<CAPTURE_CHANGE_AREA>* capchange, vector<CAPTURE_MOVE_AREA>* capmove);
     bool captureCursor(int monitor, int* info, long& id, unsigned char** data);
+    bool isDamaged(int monitor);
+    long getShotID(int monitor);
     bool getActiveWinPos(long* id, int* info);
     void getCursorPixel(int x, int y, unsigned char* rgba);
     void inputKeyboard(const char* type, const char* key, bool ctrl, bool alt, bool shift, bool command);
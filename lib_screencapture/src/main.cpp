@@ -390,7 +390,7 @@ int sas(){
 
 
 int version(){
-	return 1;
+	return 3;
 }
 
 void freeMemory(void* pnt){
@@ -409,6 +409,14 @@ void difference(int id, int typeFrame, int quality, CallbackDifference cbdiff) {
 	screenCapture.difference(id, typeFrame, quality, cbdiff);
 }
 
+int damaged(int id) {
+	return screenCapture.damaged(id);
+}
+
+void cursor(int id, CallbackDifference cbdiff) {
+	screenCapture.cursor(id, cbdiff);
+}
+
 void term(int id) {
 	screenCapture.terminate(id);
 }
@@ -25,6 +25,8 @@ void freeMemory(void* pnt);
 void init(int id);
 void monitor(int id, int index);
 void difference(int id, int typeFrame, int quality, CallbackDifference cbdiff);
+int damaged(int id);
+void cursor(int id, CallbackDifference cbdiff);
 void term(int id);
 void inputMouse(int id, int x, int y, int button, int wheel, bool ctrl, bool alt, bool shift, bool command);
 void inputKeyboard(int id, const char* type, const char* key, bool ctrl, bool alt, bool shift, bool command);
@@ -297,7 +297,34 @@ void ScreenCapture::differenceCursor(SESSION &ses, CAPTURE_IMAGE &capimage,Callb
 	dwdbg->print("ScreenCapture::prepareCursor#END");
 }
 
-void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage,CallbackDifference cbdiff){
+void ScreenCapture::differenceArea(SESSION &ses, bool firstdata, vector<CAPTURE_CHANGE_AREA> &capchange, DIFFRECT &area){
+	//Senza aree notificate confronta tutto il frame
+	area.x1=0;
+	area.y1=0;
+	area.x2=ses.shotw-1;
+	area.y2=ses.shoth-1;
+	if ((!firstdata) && (capchange.size()>0)){
+		area.x1=ses.shotw;
+		area.y1=ses.shoth;
+		area.x2=-1;
+		area.y2=-1;
+		for(vector<CAPTURE_CHANGE_AREA>::size_type i = 0; i < capchange.size(); i++) {
+			CAPTURE_CHANGE_AREA &ca = capchange[i];
+			int x1=max(ca.x,0);
+			int y1=max(ca.y,0);
+			int x2=min(ca.x+ca.width,(int)ses.shotw)-1;
+			int y2=min(ca.y+ca.height,(int)ses.shoth)-1;
+			if ((x1<=x2) && (y1<=y2)){
+				area.x1=min(area.x1,x1);
+				area.y1=min(area.y1,y1);
+				area.x2=max(area.x2,x2);
+				area.y2=max(area.y2,y2);
+			}
+		}
+	}
+}
+
+void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage, vector<CAPTURE_CHANGE_AREA> &capchange, CallbackDifference cbdiff){
 	int gapmin=50;
 	unsigned long sz = (ses.shotw*ses.shoth);
 	bool firstdata = false;
@@ -306,6 +333,8 @@ void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage,C
 		ses.data = (unsigned char*)malloc((sz*3) * sizeof(unsigned char));
 		firstdata = true;
 	}
+	DIFFRECT area;
+	differenceArea(ses, firstdata, capchange, area);
 	//detect changes and make blocks
 	vector<DIFFRECT>ardiff;
 	DIFFRECT drcur = DIFFRECT();
@@ -316,7 +345,7 @@ void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage,C
 	unsigned long inew=0;
 	unsigned long ip=0;
 	unsigned long cntsz=0;
-	for (int y=0;y<ses.shoth;y++){
+	for (int y=area.y1;y<=area.y2;y++){
 		if ((drcur.y2!=-1) && ((y-drcur.y2>=gapmin) || (cntsz>=TJPEG_SPLIT_SIZE))){
 			ardiff.push_back(drcur);
 			drcur = DIFFRECT();
@@ -325,8 +354,9 @@ void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage,C
 			drcur.x2=-1;
 			drcur.y2=-1;
 		}
-		inew=y*capimage.bpr;
-		for (int x=0;x<ses.shotw;x++){
+		inew=(y*capimage.bpr)+(area.x1*capimage.bpc);
+		ip=((y*ses.shotw)+area.x1)*3;
+		for (int x=area.x1;x<=area.x2;x++){
 			getRGB(capimage, inew, rgb);
 			if ((firstdata==true) || (rgb.red!=ses.data[ip]) || (rgb.green!=ses.data[ip+1]) || (rgb.blue!=ses.data[ip+2])){
 				ses.data[ip]=rgb.red;
@@ -407,7 +437,7 @@ void ScreenCapture::differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage,C
 }
 
 
-void ScreenCapture::differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimage,CallbackDifference cbdiff){
+void ScreenCapture::differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimage, vector<CAPTURE_CHANGE_AREA> &capchange, CallbackDifference cbdiff){
 	bool firstdata = false;
 	unsigned long sz = (ses.shotw*ses.shoth);
 	CAPTURE_RGB rgb;
@@ -415,6 +445,8 @@ void ScreenCapture::differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimag
 		ses.data = (unsigned char*)malloc((sz*3) * sizeof(unsigned char));
 		firstdata = true;
 	}
+	DIFFRECT area;
+	differenceArea(ses, firstdata, capchange, area);
 
 	int indataSize=20480;//+(pcnt*3);
 	unsigned char indata[indataSize];
@@ -459,20 +491,30 @@ void ScreenCapture::differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimag
 		fh=0;
 		int szbold=szb;
 		for (int y=fy;y<ses.shoth;y++){
-			for (int x=0;x<ses.shotw;x++){
-				getRGB(capimage, inew, rgb);
-				if ((firstdata==true) || (rgb.red!=ses.data[idata]) || (rgb.green!=ses.data[idata+1]) || (rgb.blue!=ses.data[idata+2])){
-					ses.data[idata] = rgb.red;
-					ses.data[idata+1] = rgb.green;
-					ses.data[idata+2] = rgb.blue;
-					unsigned short idxcl = getPaletteColorIndexfromRGB(rgb, ses.palette);
-					shortToArray(indata,szb,idxcl);
-					bchanged=true;
+			if ((y<area.y1) || (y>area.y2)){
+				//Riga fuori dall'area modificata: resta trasparente
+				szb+=ses.shotw*2;
+				inew+=ses.shotw*capimage.bpc;
+				idata+=ses.shotw*3;
+				ip+=ses.shotw;
+			}else{
+				for (int x=0;x<ses.shotw;x++){
+					if ((x>=area.x1) && (x<=area.x2)){
+						getRGB(capimage, inew, rgb);
+						if ((firstdata==true) || (rgb.red!=ses.data[idata]) || (rgb.green!=ses.data[idata+1]) || (rgb.blue!=ses.data[idata+2])){
+							ses.data[idata] = rgb.red;
+							ses.data[idata+1] = rgb.green;
+							ses.data[idata+2] = rgb.blue;
+							unsigned short idxcl = getPaletteColorIndexfromRGB(rgb, ses.palette);
+							shortToArray(indata,szb,idxcl);
+							bchanged=true;
+						}
+					}
+					szb+=2;
+					inew+=capimage.bpc;
+					idata+=3;
+					ip++;
 				}
-				szb+=2;
-				inew+=capimage.bpc;
-				idata+=3;
-				ip++;
 			}
 			if (!bchanged){
 				szb=szbold;
@@ -562,6 +604,10 @@ void ScreenCapture::monitor(int id, int index){
 		return;
 	}
 	SESSION &ses = itmap->second;
+	if (ses.monitor!=index){
+		//Frame di un altro monitor: le aree modificate non sono confrontabili
+		ses.shotID=-1;
+	}
 	ses.monitor=index;
 }
 
@@ -664,6 +710,10 @@ void ScreenCapture::difference(int id, int typeFrame, int quality, CallbackDiffe
 				}
 
 				if (ses.shotID != shotID) {
+					//Le aree modificate sono relative al frame precedente
+					if (ses.shotID != shotID-1){
+						capchange.clear();
+					}
 					ses.shotID = shotID;
 					if (ses.typeFrame!=typeFrame){
 						ses.typeFrame=typeFrame;
@@ -677,10 +727,10 @@ void ScreenCapture::difference(int id, int typeFrame, int quality, CallbackDiffe
 						loadQuality(&ses);
 					}
 					if (ses.typeFrame==TYPE_FRAME_PALETTE_V1){
-						differenceFrameTPALETTE(ses, capimg, cbdiff);
+						differenceFrameTPALETTE(ses, capimg, capchange, cbdiff);
 					}else if (ses.typeFrame==TYPE_FRAME_TJPEG_V1){
 						if(tjInstance != NULL){
-							differenceFrameTJPEG(ses, capimg, cbdiff);
+							differenceFrameTJPEG(ses, capimg, capchange, cbdiff);
 						}
 					}
 					dwdbg->print("ScreenCapture::prepareTokens");
@@ -693,6 +743,42 @@ void ScreenCapture::difference(int id, int typeFrame, int quality, CallbackDiffe
 	dwdbg->print("ScreenCapture::difference#End");
 }
 
+void ScreenCapture::cursor(int id, CallbackDifference cbdiff){
+	//Solo il cursore: nessuna cattura dello schermo
+	dwdbg->print("ScreenCapture::cursor#Start");
+	map<int,SESSION>::iterator itmap = hmSession.find(id);
+	if (itmap==hmSession.end()){
+		dwdbg->print("ScreenCapture::cursor#IDNOTFOUND");
+		return;
+	}
+	SESSION &ses = itmap->second;
+	int mc = captureNative.getMonitorCount();
+	if ((mc>0) && (ses.monitor>=0) && (ses.monitor<=mc)){
+		CAPTURE_IMAGE capimg;
+		differenceCursor(ses, capimg, cbdiff);
+	}
+	dwdbg->print("ScreenCapture::cursor#End");
+}
+
+int ScreenCapture::damaged(int id){
+	map<int,SESSION>::iterator itmap = hmSession.find(id);
+	if (itmap==hmSession.end()){
+		return 1;
+	}
+	SESSION &ses = itmap->second;
+	if ((ses.shotID==-1) || (ses.monitorCount<=0) || (ses.monitor<0) || (ses.screenLocked)){
+		return 1;
+	}
+	//Le aree danneggiate sono del monitor e vengono azzerate dalla prima sessione che cattura:
+	//una sessione che non ha ancora confrontato l'ultimo frame del monitor deve farlo
+	if (ses.shotID!=captureNative.getShotID(ses.monitor)){
+		return 1;
+	}
+	if (captureNative.isDamaged(ses.monitor)){
+		return 1;
+	}
+	return 0;
+}
 
 void ScreenCapture::initSession(int id){
 	hmSession[id].shotID=-1;
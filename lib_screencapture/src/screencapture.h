@@ -8,6 +8,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #include <math.h>
 #include <map>
 #include <vector>
+#include <algorithm>
 #include <iostream>
 #include "timecounter.h"
 #include "util.h"
@@ -32,6 +33,8 @@ public:
 	void terminate(int id);
 	void monitor(int id, int index);
 	void difference(int id, int typeFrame, int quality, CallbackDifference cbdiff);
+	int damaged(int id);
+	void cursor(int id, CallbackDifference cbdiff);
 	void inputKeyboard(int id, const char* type, const char* key, bool ctrl, bool alt, bool shift, bool command);
 	void inputMouse(int id, int x, int y, int button, int wheel, bool ctrl, bool alt, bool shift, bool command);
 	wchar_t* copyText(int id);
@@ -100,8 +103,9 @@ private:
 	void loadQuality(SESSION* ses);
 
 	void resizeDiffBufferIfNeed(int needsz);
-	void differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage, CallbackDifference cbdiff);
-	void differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimage, CallbackDifference cbdiff);
+	void differenceArea(SESSION &ses, bool firstdata, vector<CAPTURE_CHANGE_AREA> &capchange, DIFFRECT &area);
+	void differenceFrameTJPEG(SESSION &ses, CAPTURE_IMAGE &capimage, vector<CAPTURE_CHANGE_AREA> &capchange, CallbackDifference cbdiff);
+	void differenceFrameTPALETTE(SESSION &ses, CAPTURE_IMAGE &capimage, vector<CAPTURE_CHANGE_AREA> &capchange, CallbackDifference cbdiff);
 	void differenceCursor(SESSION &ses, CAPTURE_IMAGE &capimage, CallbackDifference cbdiff);
 	void inputsEvent();
 	int intToArray(unsigned char* buffer,int p,int i);
@@ -501,6 +501,19 @@ BOOL CALLBACK checkLayered(HWND hWnd, LPARAM lParam) {
 	return TRUE;
 }
 
+bool ScreenCaptureNative::isDamaged(int monitor) {
+	//Notifiche di modifica non disponibili: il confronto avviene sempre
+	return true;
+}
+
+long ScreenCaptureNative::getShotID(int monitor) {
+	ScreenShotInfo* ii = getScreenShotInfo(monitor);
+	if (ii==NULL) {
+		return -1;
+	}
+	return ii->shotID;
+}
+
 bool ScreenCaptureNative::captureCursor(int monitor, int* info, long& id, unsigned char** rgbdata) {
 	int cursorVis=1; 
 	CURSORINFO appCursorInfo;
@@ -35,6 +35,8 @@ public:
 	void terminate();
 	long captureScreen(int monitor, int distanceFrameMs, CAPTURE_IMAGE* capimage, vector<CAPTURE_CHANGE_AREA>* capchange, vector<CAPTURE_MOVE_AREA>* capmove);
 	bool captureCursor(int monitor, int* info, long& id, unsigned char** rgbdata);
+	bool isDamaged(int monitor);
+	long getShotID(int monitor);
 	//bool getActiveWinPos(long* id, int* info);
 	void inputKeyboard(const char* type,const char* key, bool ctrl, bool alt, bool shift, bool command);
 	void inputMouse(int monitor, int x, int y, int button, int wheel, bool ctrl, bool alt, bool shift, bool command);